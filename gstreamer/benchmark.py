@@ -0,0 +1,309 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Reproducible benchmarks for the detect/track pipeline. They run on a plain
+Linux box without a camera or Edge TPU: the model is replaced by a
+deterministic stub interpreter that reports a configurable number of moving
+boxes, unless a real model is given with --model (run on the CPU by
+default, see --device).
+
+Micro-benchmarks of invoke, get_output, tracker update and both overlay renderers:
+python3 benchmark.py micro --objects 10 100
+
+The same with host side decoding and NMS of raw SSD outputs instead of the
+outputs of the detection postprocess op:
+python3 benchmark.py micro --objects 10 100 --raw
+
+Full pipeline on a synthetic video source, headless, without dropping frames:
+python3 benchmark.py pipeline --frames 300 --objects 20 --tracker sort
+
+Full pipeline on a recorded file with a real model on the CPU:
+python3 benchmark.py pipeline --videosrc video.mp4 --model ../models/model.tflite
+
+Compare the CPU backends on four threads:
+python3 benchmark.py micro --model ../models/model.tflite --device cpu --num_threads 4
+python3 benchmark.py micro --model ../models/model.tflite --device xnnpack --num_threads 4
+
+Both report latency percentiles per stage and peak RSS; the pipeline
+benchmark also reports end-to-end FPS and dropped frames.
+"""
+import argparse
+import collections
+import contextlib
+import importlib.util
+import numpy as np
+import resource
+import time
+
+import common
+import detect
+import postprocess
+from benchmark_tracker import synthetic_detections, time_tracker
+from tracker import linear_assignment, make_tracker
+
+
+class StubInterpreter:
+    """Deterministic stand-in for a tflite SSD detection interpreter.
+
+    Every invoke() moves num_objects boxes along fixed trajectories and writes
+    them to the four outputs of the TFLite detection postprocess op (boxes,
+    class ids, scores, count). invoke_time simulates the accelerator latency.
+    """
+    def __init__(self, num_objects=10, input_size=(300, 300), invoke_time=0.0, seed=0):
+        rng = np.random.default_rng(seed)
+        self.num_objects = num_objects
+        self.invoke_time = invoke_time
+        self.frame = 0
+        self.pos = rng.uniform(0.0, 0.8, (num_objects, 2))
+        self.vel = rng.normal(0.0, 0.005, (num_objects, 2))
+        self.size = rng.uniform(0.05, 0.2, (num_objects, 2))
+        width, height = input_size
+        self.tensors = [
+            np.zeros((1, height, width, 3), dtype=np.uint8),
+            np.zeros((1, num_objects, 4), dtype=np.float32),
+            rng.integers(0, 90, (1, num_objects)).astype(np.float32),
+            np.linspace(0.99, 0.2, num_objects, dtype=np.float32)[np.newaxis],
+            np.array([num_objects], dtype=np.float32),
+        ]
+
+    def allocate_tensors(self):
+        pass
+
+    def _details(self, index):
+        return {'index': index, 'shape': np.array(self.tensors[index].shape),
+                'dtype': self.tensors[index].dtype, 'quantization': (0.0, 0)}
+
+    def get_input_details(self):
+        return [self._details(0)]
+
+    def get_output_details(self):
+        return [self._details(i) for i in range(1, 5)]
+
+    def tensor(self, index):
+        return lambda: self.tensors[index]
+
+    def invoke(self):
+        if self.invoke_time:
+            time.sleep(self.invoke_time)
+        self.frame += 1
+        # Bounce the boxes off the borders of the frame.
+        pos = np.abs((self.pos + self.vel * self.frame) % 1.6 - 0.8)
+        self.tensors[1][0, :, :2] = pos[:, ::-1]
+        self.tensors[1][0, :, 2:] = (pos + self.size)[:, ::-1]
+
+
+class RawStubInterpreter(StubInterpreter):
+    """StubInterpreter of an SSD model without the detection postprocess op.
+
+    Its two outputs are the quantized box encodings and class logits of the
+    1917 anchors of a 300x300 SSD MobileNet, as decoded by postprocess.py.
+    Each object lights up a few neighbouring anchors, so NMS has work to do.
+    """
+    def __init__(self, num_objects=10, input_size=(300, 300), invoke_time=0.0, seed=0,
+                 num_classes=90):
+        rng = np.random.default_rng(seed)
+        self.num_objects = num_objects
+        self.invoke_time = invoke_time
+        self.frame = 0
+        anchors = postprocess.ssd_anchors(input_size, 1917)
+        width, height = input_size
+        self.objects = rng.choice(len(anchors) - 3, num_objects, replace=False)
+        self.classes = rng.integers(1, num_classes + 1, num_objects)
+        # Box encodings in units of 0.05, class logits of 0.1, both around 128.
+        self.quantization = [(0.0, 0), (0.05, 128), (0.1, 128)]
+        self.tensors = [
+            np.zeros((1, height, width, 3), dtype=np.uint8),
+            rng.integers(118, 139, (1, len(anchors), 4)).astype(np.uint8),
+            np.full((1, len(anchors), num_classes + 1), 28, dtype=np.uint8),
+        ]
+
+    def _details(self, index):
+        details = super()._details(index)
+        details['quantization'] = self.quantization[index]
+        return details
+
+    def get_output_details(self):
+        return [self._details(i) for i in range(1, 3)]
+
+    def invoke(self):
+        if self.invoke_time:
+            time.sleep(self.invoke_time)
+        self.frame += 1
+        scores = self.tensors[2][0]
+        scores[:] = 28
+        for offset, logit in enumerate((228, 208, 188)):
+            scores[self.objects + offset, self.classes] = logit
+
+
+class StageTimer:
+    """Collects latency samples per stage."""
+    def __init__(self):
+        self.samples = collections.defaultdict(list)
+
+    @contextlib.contextmanager
+    def __call__(self, stage):
+        start_time = time.monotonic()
+        yield
+        self.samples[stage].append(time.monotonic() - start_time)
+
+    def report(self):
+        print('{:>14} {:>7} {:>9} {:>9} {:>9} {:>9}'.format(
+            'stage', 'count', 'mean ms', 'p50 ms', 'p90 ms', 'p99 ms'))
+        for stage, samples in self.samples.items():
+            ms = 1000 * np.array(samples)
+            p50, p90, p99 = np.percentile(ms, [50, 90, 99])
+            print('{:>14} {:>7} {:>9.3f} {:>9.3f} {:>9.3f} {:>9.3f}'.format(
+                stage, len(ms), ms.mean(), p50, p90, p99))
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux.
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def make_session(args, num_objects):
+    if args.model:
+        interpreter = common.make_interpreter(args.model + '@' + args.device, args.num_threads)
+        interpreter.allocate_tensors()
+    elif args.raw:
+        interpreter = RawStubInterpreter(num_objects, invoke_time=args.invoke_ms / 1000)
+    else:
+        interpreter = StubInterpreter(num_objects, invoke_time=args.invoke_ms / 1000)
+    session = common.InterpreterSession(interpreter)
+    return session, postprocess.make_decoder(session, args.anchors)
+
+
+def run_micro(args):
+    src_size, inference_box = (640, 480), (0, 37, 300, 225)
+    labels = collections.defaultdict(str)
+    renderers = dict(detect.RENDERERS)
+    if importlib.util.find_spec('svgwrite') is None:
+        print('svgwrite is not installed, skipping its renderer.')
+        del renderers['svgwrite']
+    # Import the assignment solver before anything is timed.
+    linear_assignment(np.zeros((2, 2)))
+    for num_objects in args.objects:
+        print('\n{} objects, {} iterations'.format(num_objects, args.iterations))
+        timer = StageTimer()
+        session, decoder = make_session(args, num_objects)
+        inference_size = session.input_size[:2]
+        for _ in range(args.iterations):
+            with timer('invoke'):
+                session.invoke()
+            with timer('get_output'):
+                objs = detect.get_output(session, args.threshold, num_objects, decoder=decoder)
+
+        frames = list(synthetic_detections(num_objects, args.iterations))
+        for name in args.tracker:
+            times = time_tracker(make_tracker(name), frames)
+            timer.samples['update ' + name] = list(times / 1000)
+
+        mot_tracker = make_tracker('sort')
+        for _ in range(args.iterations):
+            trdata = mot_tracker.update(objs[:, :detect.SCORE + 1])
+            for name, renderer in renderers.items():
+                with timer('render ' + name):
+                    renderer(src_size, inference_size, inference_box, objs, labels,
+                             ['FPS'], trdata, True)
+        timer.report()
+    print('\nPeak RSS: {:.1f} MB'.format(peak_rss_mb()))
+
+
+def run_pipeline(args):
+    # Only the full pipeline needs GStreamer and PyGObject.
+    import gstreamer
+
+    session, decoder = make_session(args, args.objects[0])
+    inference_size = session.input_size[:2]
+    labels = collections.defaultdict(str)
+    renderer = detect.RENDERERS[args.renderer]
+    timer = StageTimer()
+
+    def user_callback(input_tensor, src_size, inference_box, mot_tracker):
+        with timer('set_input'):
+            session.set_input(input_tensor)
+        with timer('invoke'):
+            session.invoke()
+        with timer('get_output'):
+            objs = detect.get_output(session, args.threshold, args.top_k, decoder=decoder)
+        trdata = []
+        if mot_tracker != None:
+            with timer('track'):
+                trdata = mot_tracker.update(objs[:, :detect.SCORE + 1])
+        with timer('render'):
+            return renderer(src_size, inference_size, inference_box, objs, labels,
+                            ['FPS'], trdata, mot_tracker != None)
+
+    videosrc = args.videosrc or 'videotestsrc pattern=ball num-buffers={}'.format(args.frames)
+    start_time = time.monotonic()
+    stats = gstreamer.run_pipeline(user_callback,
+                                   src_size=(640, 480),
+                                   appsink_size=inference_size,
+                                   trackerName=args.tracker,
+                                   videosrc=videosrc,
+                                   headless=not args.display)
+    elapsed = time.monotonic() - start_time
+
+    timer.report()
+    print('\nFrames: {} received, {} processed, {} dropped'.format(
+        stats.received, stats.processed, stats.dropped))
+    print('End-to-end: {:.1f} fps over {:.2f} s'.format(stats.processed / elapsed, elapsed))
+    print('Capture to result latency: p50 {:.1f} ms, p99 {:.1f} ms'.format(
+        1000 * stats.latency(0.5), 1000 * stats.latency(0.99)))
+    print('Peak RSS: {:.1f} MB'.format(peak_rss_mb()))
+
+
+def main():
+    common_args = argparse.ArgumentParser(add_help=False)
+    common_args.add_argument('--model', help='.tflite model to run instead of the stub')
+    common_args.add_argument('--device', default='cpu',
+                             help='backend for --model: cpu, xnnpack, auto or an Edge TPU')
+    common_args.add_argument('--num_threads', type=int, default=None,
+                             help='threads for the cpu and xnnpack backends')
+    common_args.add_argument('--objects', type=int, nargs='+', default=[10, 100],
+                             help='number of boxes reported by the stub interpreter')
+    common_args.add_argument('--invoke_ms', type=float, default=0.0,
+                             help='simulated invoke latency of the stub interpreter')
+    common_args.add_argument('--raw', action='store_true',
+                             help='stub an SSD model without the detection postprocess op, '
+                                  'decoded on the host')
+    common_args.add_argument('--anchors', help='anchors of a --model with raw SSD outputs')
+    common_args.add_argument('--threshold', type=float, default=0.1)
+    parser = argparse.ArgumentParser()
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    micro = subparsers.add_parser('micro', parents=[common_args], help='benchmark get_output, tracking and rendering')
+    micro.add_argument('--iterations', type=int, default=500)
+    micro.add_argument('--tracker', nargs='+', default=['sort'],
+                       help='trackers to benchmark')
+    micro.set_defaults(run=run_micro)
+
+    pipeline = subparsers.add_parser('pipeline', parents=[common_args], help='benchmark the full GStreamer pipeline')
+    pipeline.add_argument('--videosrc',
+                          help='video source, defaults to a videotestsrc of --frames frames')
+    pipeline.add_argument('--frames', type=int, default=300)
+    pipeline.add_argument('--tracker', default=None, help='tracker to run')
+    pipeline.add_argument('--top_k', type=int, default=100)
+    pipeline.add_argument('--renderer', default='template', choices=sorted(detect.RENDERERS))
+    pipeline.add_argument('--display', action='store_true',
+                          help='run the live pipeline with its display instead of headless')
+    pipeline.set_defaults(run=run_pipeline)
+
+    args = parser.parse_args()
+    args.run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,93 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Benchmarks the built-in trackers against the upstream SORT implementation on a
+synthetic scene of moving boxes. No camera, model or Edge TPU is needed.
+
+python3 benchmark_tracker.py --objects 10 50 100
+
+'sort_dense' is the built-in tracker with gated association turned off, so
+that it scores every detection/track pair:
+
+python3 benchmark_tracker.py --objects 10 100 1000 --trackers sort sort_dense
+
+The upstream tracker is only benchmarked if it was installed in third_party/
+by install_requirements.sh.
+"""
+import argparse
+import numpy as np
+import time
+from tracker import VectorizedSort, linear_assignment, make_tracker, register_tracker
+
+register_tracker('sort_dense', lambda: VectorizedSort(dense_limit=np.inf))
+
+
+def synthetic_detections(num_objects, num_frames, seed=0, miss_rate=0.1):
+    """Yields (N, 5) [x0, y0, x1, y1, score] detections of boxes moving in a scene.
+
+    Each object is missed with probability miss_rate on every frame. Above 100
+    objects the boxes shrink, as in a crowd seen from further away, so that
+    they cover about the same share of the frame.
+    """
+    rng = np.random.default_rng(seed)
+    pos = rng.uniform(0.0, 0.9, (num_objects, 2))
+    vel = rng.normal(0.0, 0.004, (num_objects, 2))
+    scale = min(1.0, np.sqrt(100 / num_objects))
+    size = rng.uniform(0.03, 0.1, (num_objects, 2)) * scale
+    for _ in range(num_frames):
+        pos += vel
+        dets = np.concatenate((pos, pos + size, rng.uniform(0.3, 1.0, (num_objects, 1))), axis=1)
+        dets[:, :4] += rng.normal(0.0, 0.002, (num_objects, 4))
+        yield dets[rng.random(num_objects) >= miss_rate]
+
+
+def time_tracker(mot_tracker, frames):
+    """Returns per-frame update() times in milliseconds."""
+    times = []
+    for dets in frames:
+        start_time = time.monotonic()
+        mot_tracker.update(dets)
+        times.append((time.monotonic() - start_time) * 1000)
+    return np.array(times)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--objects', type=int, nargs='+', default=[10, 50, 100],
+                        help='number of objects in the scene')
+    parser.add_argument('--frames', type=int, default=300,
+                        help='number of frames per run')
+    parser.add_argument('--trackers', nargs='+', default=['sort', 'iou', 'sort_upstream'],
+                        help='trackers to benchmark')
+    args = parser.parse_args()
+
+    # Import the assignment solver before anything is timed.
+    linear_assignment(np.zeros((2, 2)))
+    print('{:>8} {:>14} {:>10} {:>10}'.format('objects', 'tracker', 'mean ms', 'p95 ms'))
+    for num_objects in args.objects:
+        frames = list(synthetic_detections(num_objects, args.frames, seed=num_objects))
+        for name in args.trackers:
+            try:
+                mot_tracker = make_tracker(name)
+            except ImportError as e:
+                print('{:>8} {:>14} skipped: {}'.format(num_objects, name, e))
+                continue
+            times = time_tracker(mot_tracker, frames)
+            print('{:>8} {:>14} {:>10.3f} {:>10.3f}'.format(
+                num_objects, name, times.mean(), np.percentile(times, 95)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,233 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Record and replay of the frames delivered to the appsink.
+
+A capture file holds the exact RGB frames the model was given, with their
+buffer timestamps and capture times, in a fixed layout that is replayed from
+a memory mapping without decoding or copying:
+
+    header    64 bytes, HEADER_DTYPE: frame size, inference box, frame count
+    records   one per frame, record_dtype(): pts, capture time in seconds since
+              the first frame, then the (height, width, channels) frame, each
+              record starting on a 64 byte boundary
+
+all little endian. detect.py records with --record and replays with --replay,
+which runs the model, tracker and rendering on the recorded frames as fast as
+they go or, with --replay_realtime, at their recorded intervals.
+
+python3 capture.py capture.bin prints what a file holds.
+"""
+import argparse
+import mmap
+import numpy as np
+import time
+
+import common
+import metrics
+import tracker
+from frame_pipeline import FramePipeline
+
+MAGIC = b'CCAP'
+VERSION = 1
+ALIGNMENT = 64
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'), ('version', '<u4'), ('width', '<u4'), ('height', '<u4'),
+    ('channels', '<u4'), ('record_size', '<u4'), ('capacity', '<u4'), ('count', '<u4'),
+    ('src_size', '<u4', 2), ('box', '<i4', 4), ('reserved', 'V8')])
+
+
+def record_dtype(width, height, channels):
+    """Returns the dtype of the records of frames of the given size."""
+    frame_size = width * height * channels
+    return np.dtype({
+        'names': ['pts', 'capture_time', 'frame'],
+        'formats': ['<u8', '<f8', ('u1', (height, width, channels))],
+        'offsets': [0, 8, ALIGNMENT],
+        'itemsize': ALIGNMENT + -(-frame_size // ALIGNMENT) * ALIGNMENT})
+
+
+class CapturedFrame(np.ndarray):
+    """A replayed (height, width, channels) frame with the pts of its buffer."""
+    pts = 0
+
+
+class CaptureWriter:
+    """Records frames to a capture file, replacing any existing file.
+
+    The file is allocated for max_frames frames by open(), once the frame
+    size is known, and cut to the frames written by close(). Frames past
+    max_frames aren't recorded.
+    """
+    def __init__(self, path, max_frames=300):
+        self.path = path
+        self.max_frames = max_frames
+        self.count = 0
+        self.mmap = None
+        self.first_time = None
+        self.full = False
+
+    def open(self, size, box, src_size, channels=3):
+        """Allocates the file for frames of size (width, height) cropped to box in src_size."""
+        width, height = size
+        self.shape = (height, width, channels)
+        dtype = record_dtype(width, height, channels)
+        self.record_size = dtype.itemsize
+        file_size = HEADER_DTYPE.itemsize + self.max_frames * self.record_size
+        with open(self.path, 'w+b') as f:
+            f.truncate(file_size)
+            self.mmap = mmap.mmap(f.fileno(), file_size)
+        self.header = np.ndarray((), HEADER_DTYPE, self.mmap)
+        self.records = np.ndarray((self.max_frames,), dtype, self.mmap, HEADER_DTYPE.itemsize)
+        self.header['version'] = VERSION
+        self.header['width'], self.header['height'], self.header['channels'] = width, height, channels
+        self.header['record_size'] = dtype.itemsize
+        self.header['capacity'] = self.max_frames
+        self.header['src_size'] = src_size
+        self.header['box'] = box
+        self.header['magic'] = MAGIC
+
+    def write(self, buf, capture_time):
+        """Records a frame from a Gst.Buffer with its capture time.monotonic()."""
+        if self.count == self.max_frames:
+            if not self.full:
+                print('Capture {} is full after {} frames.'.format(self.path, self.count))
+                self.full = True
+            return
+        if self.first_time is None:
+            self.first_time = capture_time
+        with common.map_frame(buf, *self.shape) as (frame, _):
+            np.copyto(self.records['frame'][self.count], frame)
+        self.records['pts'][self.count] = buf.pts
+        self.records['capture_time'][self.count] = capture_time - self.first_time
+        self.count += 1
+        self.header['count'] = self.count
+
+    def close(self):
+        """Unmaps the file and cuts it to the frames written."""
+        if self.mmap is None:
+            return
+        del self.header, self.records
+        self.mmap.close()
+        self.mmap = None
+        with open(self.path, 'r+b') as f:
+            f.truncate(HEADER_DTYPE.itemsize + self.count * self.record_size)
+
+
+class CaptureReader:
+    """Maps a capture file read-only.
+
+    frames is the (count, height, width, channels) array of all frames,
+    pts their buffer timestamps and capture_times their capture times in
+    seconds since the first frame. Raises ValueError for other files.
+    """
+    def __init__(self, path):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.mmap) < HEADER_DTYPE.itemsize:
+            raise ValueError('{} is not a capture file'.format(path))
+        header = np.ndarray((), HEADER_DTYPE, self.mmap)
+        if header['magic'] != MAGIC or header['version'] != VERSION:
+            raise ValueError('{} is not a capture file of version {}'.format(path, VERSION))
+        width, height, channels = int(header['width']), int(header['height']), int(header['channels'])
+        self.size = (width, height)
+        self.src_size = tuple(int(x) for x in header['src_size'])
+        self.box = tuple(int(x) for x in header['box'])
+        count = min(int(header['count']),
+                    (len(self.mmap) - HEADER_DTYPE.itemsize) // int(header['record_size']))
+        records = np.ndarray((count,), record_dtype(width, height, channels), self.mmap,
+                             HEADER_DTYPE.itemsize)
+        self.frames = records['frame']
+        self.pts = records['pts']
+        self.capture_times = records['capture_time']
+
+    def __len__(self):
+        return len(self.frames)
+
+    def frame(self, i):
+        """Returns frame i as a CapturedFrame view into the file."""
+        frame = self.frames[i].view(CapturedFrame)
+        frame.pts = int(self.pts[i])
+        return frame
+
+
+class ReplayPipeline(FramePipeline):
+    """FramePipeline fed from a capture file instead of a camera and decoder.
+
+    Frames are passed to user_function as read-only views of the mapped file.
+    With realtime they are released at their recorded intervals and the ring
+    drops frames as it would live, otherwise they are released as fast as
+    inference takes them, without dropping any, like a headless pipeline.
+    """
+    def __init__(self, reader, user_function, mot_tracker, realtime=False, **kwargs):
+        super().__init__(user_function, reader.src_size, mot_tracker, headless=not realtime,
+                         **kwargs)
+        self.reader = reader
+        self.realtime = realtime
+
+    def get_box(self):
+        return self.reader.box
+
+    def run(self):
+        workers = self.start_workers()
+        try:
+            if self.warmup:
+                with (self.startup or metrics.StartupTimer()).phase('warm-up'):
+                    self.warmup()
+            start_time = time.monotonic()
+            for i in range(len(self.reader)):
+                if self.error is not None:
+                    break
+                if self.realtime:
+                    capture_time = start_time + self.reader.capture_times[i]
+                    time.sleep(max(capture_time - time.monotonic(), 0.0))
+                else:
+                    capture_time = time.monotonic()
+                self.add_frame(self.reader.frame(i), capture_time)
+            # Let inference pick up the last frame, as at the end of a file.
+            with self.condition:
+                while self.pending:
+                    self.condition.wait()
+        finally:
+            self.stop_workers(workers)
+
+
+def run_replay(user_function, reader, trackerName, pipeline_depth=1, realtime=False,
+               deadline=0, batch_size=1, batch_wait=0, warmup=None, startup=None):
+    """Runs user_function on the frames of a CaptureReader like run_pipeline()."""
+    mot_tracker = tracker.make_tracker(trackerName) if trackerName else None
+    pipeline = ReplayPipeline(reader, user_function, mot_tracker,
+                              realtime, pipeline_depth=pipeline_depth, deadline=deadline,
+                              batch_size=batch_size, batch_wait=batch_wait, warmup=warmup,
+                              startup=startup)
+    pipeline.run()
+    return pipeline.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prints what a capture file holds.')
+    parser.add_argument('path', help='capture file written by detect.py --record')
+    args = parser.parse_args()
+    reader = CaptureReader(args.path)
+    print('{} frames of {}x{} cropped to {} from {}x{}'.format(
+        len(reader), reader.size[0], reader.size[1], reader.box, *reader.src_size))
+    if len(reader) > 1:
+        duration = reader.capture_times[-1]
+        print('{:.2f} s at {:.1f} fps'.format(duration, (len(reader) - 1) / max(duration, 1e-6)))
+
+
+if __name__ == '__main__':
+    main()
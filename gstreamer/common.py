@@ -14,54 +14,551 @@
 
 """Common utilities."""
 import collections
-import gi
-gi.require_version('Gst', '1.0')
-from gi.repository import Gst
+import concurrent.futures
+import contextlib
+import ctypes
+import mmap
 import numpy as np
-import svgwrite
-import tflite_runtime.interpreter as tflite
+import struct
+import threading
 import time
 
 EDGETPU_SHARED_LIB = 'libedgetpu.so.1'
+GSTREAMER_SHARED_LIB = 'libgstreamer-1.0.so.0'
+GSTVIDEO_SHARED_LIB = 'libgstvideo-1.0.so.0'
 
-def make_interpreter(model_file):
-    model_file, *device = model_file.split('@')
+
+class _GstMapInfo(ctypes.Structure):
+    _fields_ = [('memory', ctypes.c_void_p),
+                ('flags', ctypes.c_int),
+                ('data', ctypes.POINTER(ctypes.c_uint8)),
+                ('size', ctypes.c_size_t),
+                ('maxsize', ctypes.c_size_t),
+                ('user_data', ctypes.c_void_p * 4),
+                ('_gst_reserved', ctypes.c_void_p * 4)]
+
+
+class _GstVideoMeta(ctypes.Structure):
+    # Only the fields up to the plane layout, which are stable across GStreamer 1.x.
+    _fields_ = [('meta_flags', ctypes.c_int),
+                ('meta_info', ctypes.c_void_p),
+                ('buffer', ctypes.c_void_p),
+                ('flags', ctypes.c_int),
+                ('format', ctypes.c_int),
+                ('id', ctypes.c_int),
+                ('width', ctypes.c_uint),
+                ('height', ctypes.c_uint),
+                ('n_planes', ctypes.c_uint),
+                ('offset', ctypes.c_size_t * 4),
+                ('stride', ctypes.c_int * 4)]
+
+
+def _load_libgst():
+    try:
+        libgst = ctypes.CDLL(GSTREAMER_SHARED_LIB)
+    except OSError:
+        return None
+    libgst.gst_buffer_map.argtypes = [ctypes.c_void_p, ctypes.POINTER(_GstMapInfo), ctypes.c_int]
+    libgst.gst_buffer_map.restype = ctypes.c_int
+    libgst.gst_buffer_unmap.argtypes = [ctypes.c_void_p, ctypes.POINTER(_GstMapInfo)]
+    libgst.gst_buffer_unmap.restype = None
+    return libgst
+
+def _load_libgstvideo():
+    try:
+        libgstvideo = ctypes.CDLL(GSTVIDEO_SHARED_LIB)
+    except OSError:
+        return None
+    libgstvideo.gst_buffer_get_video_meta.argtypes = [ctypes.c_void_p]
+    libgstvideo.gst_buffer_get_video_meta.restype = ctypes.POINTER(_GstVideoMeta)
+    return libgstvideo
+
+# Handles of the GStreamer libraries, loaded on first use so that importing
+# this module doesn't load GStreamer.
+_libgst = None
+_libgstvideo = None
+_libs_loaded = False
+
+def _load_libs():
+    global _libgst, _libgstvideo, _libs_loaded
+    if not _libs_loaded:
+        _libgst = _load_libgst()
+        _libgstvideo = _load_libgstvideo()
+        _libs_loaded = True
+
+# GST_MAP_READ, as Gst.MapFlags.READ without importing the bindings.
+_GST_MAP_READ = 1
+
+_PyCapsule_GetPointer = ctypes.PYFUNCTYPE(ctypes.c_void_p, ctypes.py_object, ctypes.c_char_p)(
+    ('PyCapsule_GetPointer', ctypes.pythonapi))
+
+
+def buffer_pointer(buf):
+    """Returns the address of the GstBuffer wrapped by a Gst.Buffer, or None.
+
+    PyGObject hands it out as a PyCapsule in __gpointer__. The address is
+    only trusted if the identity hash of the wrapper, which PyGObject also
+    derives from the wrapped pointer, agrees with it.
+    """
+    capsule = getattr(buf, '__gpointer__', None)
+    if capsule is None:
+        return None
+    try:
+        pointer = _PyCapsule_GetPointer(capsule, None)
+    except (TypeError, ValueError):
+        return None
+    if not pointer or hash(buf) != hash(pointer):
+        return None
+    return pointer
+
+
+def zero_copy_map():
+    """Returns True if map_buffer() maps buffers in place.
+
+    Otherwise, or for a buffer whose address can't be validated (see
+    buffer_pointer()), it maps them through the Python bindings, which copy
+    the data on older versions.
+    """
+    _load_libs()
+    return _libgst is not None
+
+
+@contextlib.contextmanager
+def map_buffer(buf):
+    """Maps a Gst.Buffer for reading and yields its data as a flat uint8 array.
+
+    The array is only valid inside the with block. Raises RuntimeError if the
+    buffer can't be mapped. A numpy frame, e.g. replayed from a capture file,
+    is yielded as a flat view of itself.
+    """
+    if isinstance(buf, np.ndarray):
+        yield buf.reshape(-1)
+        return
+    pointer = buffer_pointer(buf) if zero_copy_map() else None
+    if pointer:
+        mapinfo = _GstMapInfo()
+        if not _libgst.gst_buffer_map(pointer, mapinfo, _GST_MAP_READ):
+            raise RuntimeError('Failed to map buffer')
+        try:
+            if mapinfo.size != buf.get_size():
+                raise RuntimeError('Mapped {} bytes of a {} byte buffer'.format(
+                    mapinfo.size, buf.get_size()))
+            yield np.ctypeslib.as_array(mapinfo.data, shape=(mapinfo.size,))
+        finally:
+            _libgst.gst_buffer_unmap(pointer, mapinfo)
+    else:
+        result, mapinfo = buf.map(_GST_MAP_READ)
+        if not result:
+            raise RuntimeError('Failed to map buffer')
+        try:
+            yield np.frombuffer(mapinfo.data, dtype=np.uint8)
+        finally:
+            buf.unmap(mapinfo)
+
+
+def buffer_layout(buf):
+    """Returns the (offset, stride) of the first plane of a video Gst.Buffer.
+
+    They are taken from the buffer's GstVideoMeta, as set e.g. by hardware
+    decoders; (0, None) if it has none.
+    """
+    if isinstance(buf, np.ndarray):
+        return 0, None
+    _load_libs()
+    pointer = buffer_pointer(buf)
+    if _libgstvideo is None or not pointer:
+        return 0, None
+    meta = _libgstvideo.gst_buffer_get_video_meta(pointer)
+    if not meta:
+        return 0, None
+    return meta.contents.offset[0], meta.contents.stride[0]
+
+
+def frame_view(data, height, width, channels, offset=0, stride=None):
+    """Returns data as a (height, width, channels) view and its route.
+
+    The route is 'direct' for tightly packed rows and 'strided' for padded
+    ones. Neither copies the data. Without a stride, rows are either packed
+    or padded to GStreamer's default 4 byte alignment, which is told from
+    the data size; raises ValueError for data that fits neither.
+    """
+    row = width * channels
+    if stride is None:
+        if data.size == height * row:
+            return data.reshape(height, width, channels), 'direct'
+        stride = (row + 3) & ~3
+        if data.size not in (height * stride, (height - 1) * stride + row):
+            raise ValueError('Frame of {} bytes is neither packed nor 4 byte aligned {}x{}x{}; '
+                             'its stride is unknown'.format(data.size, width, height, channels))
+    if stride < row or data.size < offset + (height - 1) * stride + row:
+        raise ValueError('Frame of {} bytes does not fit {}x{}x{} at offset {} stride {}'.format(
+            data.size, width, height, channels, offset, stride))
+    if stride == row:
+        return data[offset:offset + height * row].reshape(height, width, channels), 'direct'
+    view = np.lib.stride_tricks.as_strided(
+        data[offset:], shape=(height, width, channels), strides=(stride, channels, 1),
+        writeable=False)
+    return view, 'strided'
+
+
+@contextlib.contextmanager
+def map_frame(buf, height, width, channels):
+    """Maps a frame and yields it as frame_view() does, with the stride of its buffer."""
+    with map_buffer(buf) as data:
+        yield frame_view(data, height, width, channels, *buffer_layout(buf))
+
+
+# Backends tried by make_interpreter('model.tflite@auto'), fastest wins.
+AUTO_BACKENDS = ('', 'xnnpack', 'cpu')
+# Invokes timed per backend after an untimed first one.
+AUTO_INVOKES = 5
+
+
+def _load_interpreter(model_file, device, num_threads):
+    import tflite_runtime.interpreter as tflite
+    kwargs = {'model_path': model_file}
+    if num_threads:
+        kwargs['num_threads'] = num_threads
+    if device in ('cpu', 'xnnpack'):
+        # Runtimes from 2.7 on apply XNNPACK by default and can opt out of it.
+        resolver = getattr(tflite, 'OpResolverType', None)
+        if resolver is None:
+            if device == 'xnnpack':
+                raise ValueError('XNNPACK needs tflite_runtime 2.7 or later')
+        elif device == 'cpu':
+            kwargs['experimental_op_resolver_type'] = resolver.BUILTIN_WITHOUT_DEFAULT_DELEGATES
+        else:
+            kwargs['experimental_op_resolver_type'] = resolver.AUTO
+        return tflite.Interpreter(**kwargs)
     return tflite.Interpreter(
-      model_path=model_file,
       experimental_delegates=[
           tflite.load_delegate(EDGETPU_SHARED_LIB,
-                               {'device': device[0]} if device else {})
-      ])
+                               {'device': device} if device else {})
+      ], **kwargs)
+
+
+def _time_invokes(interpreter, count):
+    interpreter.allocate_tensors()
+    # The first invoke includes one-off setup such as uploading the model.
+    interpreter.invoke()
+    times = []
+    for _ in range(count):
+        start_time = time.monotonic()
+        interpreter.invoke()
+        times.append(time.monotonic() - start_time)
+    return sorted(times)[count // 2]
+
+
+def _fastest_interpreter(model_file, num_threads):
+    best, best_name, best_time = None, None, float('inf')
+    for device in AUTO_BACKENDS:
+        name = device or 'edgetpu'
+        try:
+            interpreter = _load_interpreter(model_file, device, num_threads)
+            elapsed = _time_invokes(interpreter, AUTO_INVOKES)
+        except (ValueError, RuntimeError, OSError) as e:
+            print('Backend {}: unavailable ({})'.format(name, e))
+            continue
+        print('Backend {}: {:.2f} ms per invoke'.format(name, 1000 * elapsed))
+        if elapsed < best_time:
+            best, best_name, best_time = interpreter, name, elapsed
+    if best is None:
+        raise ValueError('No backend can run {}'.format(model_file))
+    print('Selected backend {}.'.format(best_name))
+    return best
+
+
+def make_interpreter(model_file, num_threads=None):
+    """Returns an interpreter for 'model.tflite[@device]'.
+
+    device is passed to the Edge TPU delegate (e.g. ':0', 'usb:1'). 'cpu' runs
+    the model with the builtin kernels and 'xnnpack' with the XNNPACK delegate,
+    on num_threads threads. 'auto' times a few invokes on the default Edge TPU,
+    XNNPACK and the CPU and returns the fastest that can run the model.
+    """
+    model_file, *device = model_file.split('@')
+    device = device[0] if device else ''
+    if device == 'auto':
+        return _fastest_interpreter(model_file, num_threads)
+    return _load_interpreter(model_file, device, num_threads)
+
+class InterpreterSession:
+    """Interpreter with its tensor details resolved once at load time.
+
+    Indices, shapes and quantization parameters are looked up when the session
+    is created instead of on every frame, and output() dequantizes only the
+    entries the caller asks for into buffers allocated up front, so the steady
+    state per-frame path allocates nothing.
+
+    The session keeps the tensor accessors rather than numpy views: the
+    interpreter refuses to invoke while views into its tensors are alive.
+
+    Models that allow it can be resized to run a batch of frames per invoke
+    with resize_batch(); inputs and outputs are then addressed by their index
+    in the batch.
+    """
+    def __init__(self, interpreter):
+        self.interpreter = interpreter
+        self.input_routes = collections.Counter()
+        self._resolve()
+
+    def _resolve(self):
+        interpreter = self.interpreter
+        input_details = interpreter.get_input_details()[0]
+        self.input_shape = tuple(input_details['shape'])
+        batch_size, height, width, channels = self.input_shape
+        self.batch_size = batch_size
+        self.input_size = (width, height, channels)
+        self._input = interpreter.tensor(input_details['index'])
+        self._output_details = interpreter.get_output_details()
+        self._outputs = []
+        for details in self._output_details:
+            scale, zero_point = details.get('quantization', (0.0, 0))
+            # Outputs without the batch dimension, as float32.
+            buffer = np.empty(tuple(details['shape'])[1:], dtype=np.float32)
+            self._outputs.append((interpreter.tensor(details['index']), scale, zero_point, buffer))
+
+    def resize_batch(self, batch_size):
+        """Resizes the model to take batch_size frames per invoke.
+
+        Raises ValueError if the model can't run batches of that size, e.g.
+        because it was compiled for the Edge TPU with a fixed batch size or
+        its outputs don't have a batch dimension.
+        """
+        if batch_size == self.batch_size:
+            return
+        index = self.interpreter.get_input_details()[0]['index']
+        try:
+            self.interpreter.resize_tensor_input(index, (batch_size,) + self.input_shape[1:])
+            self.interpreter.allocate_tensors()
+        except (RuntimeError, ValueError) as e:
+            raise ValueError('Model can\'t be resized to batches of {}: {}'.format(batch_size, e))
+        self._resolve()
+        for details in self.interpreter.get_output_details():
+            if details['shape'][0] != batch_size:
+                raise ValueError('Output {} of the model has no batch dimension'.format(
+                    details['name']))
+
+    def invoke(self):
+        self.interpreter.invoke()
+
+    def input_tensor(self, index=0):
+        """Returns input tensor view as numpy array of shape (height, width, channels)."""
+        return self._input()[index]
+
+    def set_input(self, buf, index=0):
+        """Copies a frame from a Gst.Buffer to the input tensor, at index in the batch.
+
+        The buffer is mapped in place and copied with a single, possibly
+        strided, copy. The route taken is counted in input_routes.
+        """
+        with map_frame(buf, *self.input_shape[1:]) as (frame, route):
+            np.copyto(self.input_tensor(index), frame)
+        self.input_routes[route] += 1
+
+    @property
+    def num_outputs(self):
+        return len(self._outputs)
+
+    def output_shape(self, i):
+        return tuple(self._output_details[i]['shape'])
+
+    def output_dtype(self, i):
+        return self._output_details[i]['dtype']
+
+    def quantization(self, i):
+        """Returns the (scale, zero_point) of output i, scale is 0 if it isn't quantized."""
+        _, scale, zero_point, _ = self._outputs[i]
+        return scale, zero_point
+
+    def raw_output(self, i, index=0):
+        """Returns output i for frame index of the batch as stored, without dequantizing.
+
+        The result is a view into the interpreter, which must be dropped before
+        the next invoke.
+        """
+        tensor, _, _, _ = self._outputs[i]
+        return tensor()[index]
+
+    def output(self, i, count=None, index=0):
+        """Returns output i for frame index of the batch, dequantized to float32.
+
+        Only the first count entries are read if count is given. The result is
+        a reused buffer which is only valid until the next call for output i.
+        """
+        tensor, scale, zero_point, buffer = self._outputs[i]
+        data = tensor()[index]
+        if data.ndim and count is not None:
+            data = data[:count]
+        out = buffer[:len(data)] if data.ndim else buffer
+        np.subtract(data, zero_point, out=out, dtype=np.float32)
+        if scale != 0:
+            np.multiply(out, scale, out=out)
+        return out
+
+
+class PoolInstance:
+    """One interpreter of an InterpreterPool and its stats."""
+    def __init__(self, name, interpreter):
+        self.name = name
+        self.interpreter = interpreter
+        self.executor = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+        self.pending = 0  # Jobs queued or running.
+        self.jobs = 0
+        self.total_time = 0.0
+        self.max_time = 0.0
+
+    def __str__(self):
+        return '{}: jobs: {} pending: {} mean: {:.2f} ms max: {:.2f} ms'.format(
+            self.name, self.jobs, self.pending,
+            1000 * self.total_time / max(self.jobs, 1), 1000 * self.max_time)
+
+
+class InterpreterPool:
+    """Runs jobs on several interpreters of the same model, e.g. one per Edge TPU.
+
+    A job is fn(interpreter, *args); it is queued on the instance with the
+    fewest pending jobs and runs on that instance's own thread. Futures are
+    returned in submission order, so consuming them in order keeps results in
+    frame order. Any tflite Interpreter (or InterpreterSession) works, CPU
+    interpreters can stand in for Edge TPUs.
+    """
+    def __init__(self, interpreters, names=None):
+        names = names or ['interpreter {}'.format(i) for i in range(len(interpreters))]
+        self.instances = [PoolInstance(name, interpreter)
+                          for name, interpreter in zip(names, interpreters)]
+        self.lock = threading.Lock()
+
+    def __len__(self):
+        return len(self.instances)
+
+    @property
+    def interpreter(self):
+        """The first interpreter, e.g. to read the model's input size."""
+        return self.instances[0].interpreter
+
+    def submit(self, fn, *args):
+        with self.lock:
+            instance = min(self.instances, key=lambda i: (i.pending, i.jobs))
+            instance.pending += 1
+        return instance.executor.submit(self._run, instance, fn, args)
+
+    def run(self, fn, *args):
+        """Runs fn on the least busy instance and waits for its result."""
+        return self.submit(fn, *args).result()
+
+    def map(self, fn, iterable, max_pending=None):
+        """Yields fn(interpreter, item) for each item, in order.
+
+        At most max_pending jobs (default: two per instance) are in flight.
+        """
+        max_pending = max_pending or 2 * len(self)
+        futures = collections.deque()
+        for item in iterable:
+            futures.append(self.submit(fn, item))
+            if len(futures) >= max_pending:
+                yield futures.popleft().result()
+        while futures:
+            yield futures.popleft().result()
+
+    def _run(self, instance, fn, args):
+        start_time = time.monotonic()
+        try:
+            return fn(instance.interpreter, *args)
+        finally:
+            elapsed = time.monotonic() - start_time
+            with self.lock:
+                instance.pending -= 1
+                instance.jobs += 1
+                instance.total_time += elapsed
+                instance.max_time = max(instance.max_time, elapsed)
+
+    def warmup(self):
+        """Invokes every interpreter once, in parallel, outside of the stats.
+
+        The first invoke pays one-off costs such as uploading the model to
+        the Edge TPU, which would otherwise delay the first frame.
+        """
+        futures = [instance.executor.submit(instance.interpreter.invoke)
+                   for instance in self.instances]
+        for future in futures:
+            future.result()
+
+    def stats(self):
+        with self.lock:
+            return [str(instance) for instance in self.instances]
+
+    def close(self):
+        for instance in self.instances:
+            instance.executor.shutdown()
+
+
+def make_interpreter_pool(model_file, devices, batch_size=1, num_threads=None):
+    """Returns an InterpreterPool of InterpreterSessions of model_file, one per device.
+
+    devices are as for make_interpreter, e.g. [':0', ':1'] or ['cpu', 'cpu'].
+    The sessions are resized to batch_size frames per invoke if it isn't 1.
+    """
+    interpreters = []
+    for device in devices:
+        interpreter = make_interpreter('{}@{}'.format(model_file, device) if device else model_file,
+                                       num_threads)
+        interpreter.allocate_tensors()
+        session = InterpreterSession(interpreter)
+        if batch_size != 1:
+            session.resize_batch(batch_size)
+        interpreters.append(session)
+    return InterpreterPool(interpreters, names=['interpreter {} ({})'.format(i, device or 'default')
+                                                for i, device in enumerate(devices)])
+
+
+def _fb_field(buf, table, index):
+    """Returns the position of field index of the flatbuffer table at table, None if absent."""
+    vtable = table - struct.unpack_from('<i', buf, table)[0]
+    if 4 + 2 * index >= struct.unpack_from('<H', buf, vtable)[0]:
+        return None
+    offset = struct.unpack_from('<H', buf, vtable + 4 + 2 * index)[0]
+    return table + offset if offset else None
+
+
+def _fb_deref(buf, pos):
+    """Follows the flatbuffer offset at pos to the table or vector it refers to."""
+    if pos is None:
+        raise ValueError('missing field')
+    return pos + struct.unpack_from('<I', buf, pos)[0]
+
+
+def model_input_size(model_file):
+    """Returns the input size of a TFLite model as a (width, height, channels) tuple.
 
-def input_image_size(interpreter):
-    """Returns input size as (width, height, channels) tuple."""
-    _, height, width, channels = interpreter.get_input_details()[0]['shape']
+    Read from the model file's flatbuffer rather than from a loaded
+    interpreter, so that the pipeline can be built while the model loads.
+    model_file may carry a '@device' suffix as for make_interpreter(). Raises
+    ValueError if it isn't a TFLite model with an image input.
+    """
+    model_file = model_file.split('@')[0]
+    with open(model_file, 'rb') as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as buf:
+        try:
+            if buf[4:8] != b'TFL3':
+                raise ValueError('no TFLite file identifier')
+            # Model.subgraphs[0], SubGraph.tensors[SubGraph.inputs[0]], Tensor.shape.
+            model = _fb_deref(buf, 0)
+            subgraphs = _fb_deref(buf, _fb_field(buf, model, 2))
+            subgraph = _fb_deref(buf, subgraphs + 4)
+            tensors = _fb_deref(buf, _fb_field(buf, subgraph, 0))
+            inputs = _fb_deref(buf, _fb_field(buf, subgraph, 1))
+            tensor = _fb_deref(buf, tensors + 4 + 4 * struct.unpack_from('<i', buf, inputs + 4)[0])
+            shape = _fb_deref(buf, _fb_field(buf, tensor, 0))
+            shape = struct.unpack_from('<{}i'.format(struct.unpack_from('<I', buf, shape)[0]),
+                                       buf, shape + 4)
+        except (ValueError, struct.error) as e:
+            raise ValueError('{} is not a TFLite model: {}'.format(model_file, e))
+    if len(shape) != 4:
+        raise ValueError('Input of {} has shape {}, not (batch, height, width, channels)'.format(
+            model_file, list(shape)))
+    _, height, width, channels = shape
     return width, height, channels
 
-def input_tensor(interpreter):
-    """Returns input tensor view as numpy array of shape (height, width, channels)."""
-    tensor_index = interpreter.get_input_details()[0]['index']
-    return interpreter.tensor(tensor_index)()[0]
-
-def set_input(interpreter, buf):
-    """Copies data to input tensor."""
-    result, mapinfo = buf.map(Gst.MapFlags.READ)
-    if result:
-        np_buffer = np.reshape(np.frombuffer(mapinfo.data, dtype=np.uint8),
-            interpreter.get_input_details()[0]['shape'])
-        input_tensor(interpreter)[:, :] = np_buffer
-        buf.unmap(mapinfo)
-
-def output_tensor(interpreter, i):
-    """Returns dequantized output tensor if quantized before."""
-    output_details = interpreter.get_output_details()[i]
-    output_data = np.squeeze(interpreter.tensor(output_details['index'])())
-    if 'quantization' not in output_details:
-        return output_data
-    scale, zero_point = output_details['quantization']
-    if scale == 0:
-        return output_data - zero_point
-    return scale * (output_data - zero_point)
 
 def avg_fps_counter(window_size):
     window = collections.deque(maxlen=window_size)
@@ -25,6 +25,47 @@ python3 detect.py --videosrc /dev/video1 --videofmt jpeg
 Choose an Object Tracker. Example : To run sort tracker
 python3 detect.py --tracker sort
 
+Use the greedy IoU tracker, which is cheaper than SORT:
+python3 detect.py --tracker iou
+
+Run several cameras or files as separate streams on one interpreter:
+python3 detect.py --tracker sort --videosrc /dev/video0 /dev/video1 video.mp4
+
+Track every frame of a recorded video without a display, as fast as possible:
+python3 detect.py --tracker sort --headless --videosrc video.mp4 --output tracks.csv
+
+Run the detector on every 3rd frame at most and let the tracker fill in the rest:
+python3 detect.py --tracker sort --detect_interval 3
+
+Skip the detector while less than 1% of the picture changes, for at most 30 frames:
+python3 detect.py --tracker sort --motion_threshold 0.01 --motion_refresh 30
+
+Publish track records for other processes, and print them from another shell:
+python3 detect.py --tracker sort --events /dev/shm/tracks
+python3 events.py /dev/shm/tracks
+
+Keep the latency from capture to result under 100 ms by skipping older frames:
+python3 detect.py --tracker sort --deadline_ms 100
+
+Process a recording 8 frames per invoke with a model that can be batched, on the CPU:
+python3 detect.py --devices cpu --batch_size 8 --headless --videosrc video.mp4 --model model.tflite
+
+Run without an Edge TPU, on four CPU threads with XNNPACK:
+python3 detect.py --tracker sort --devices xnnpack --num_threads 4 --model model.tflite
+
+Track a camera without showing it, e.g. to only publish track events:
+python3 detect.py --tracker sort --display none --events /dev/shm/tracks
+
+Record the frames the model sees, then rerun them as fast as they go:
+python3 detect.py --tracker sort --record capture.bin --record_frames 600
+python3 detect.py --tracker sort --replay capture.bin
+
+Spread frames over two Edge TPUs:
+python3 detect.py --tracker sort --devices :0 :1
+
+Overlap inference of the next frame with tracking and rendering:
+python3 detect.py --tracker sort --pipeline_depth 2
+
 TEST_DATA=../all_models
 
 Run coco model:
@@ -35,16 +76,87 @@ python3 detect.py \
 import argparse
 import collections
 import common
-import gstreamer
+import concurrent.futures
+import events
+import math
+import metrics
+import mot
+import motion
 import numpy as np
 import os
+import postprocess
 import re
-import svgwrite
+import threading
 import time
-from tracker import ObjectTracker
+import xml.sax.saxutils
+import tracker
+
+# Columns of the (N, 6) detection array returned by get_output(). The first five
+# columns are laid out the way SORT expects its detections, so
+# objs[:, :SCORE + 1] can be handed to the tracker without a copy.
+XMIN, YMIN, XMAX, YMAX, SCORE, CLASS_ID = range(6)
+# Columns of the (M, 7) track array: the box, then the track id and the score
+# and class id of the detection the track was matched to (see label_tracks()).
+TRACK_ID, TRACK_SCORE, TRACK_CLASS_ID = range(4, 7)
+
+# Per-frame results handed from one stage of the pipeline to the next.
+# skipped tells why the detector didn't run on a frame: None if it did, 'coast'
+# if the tracker predicts the frame, 'static' if the last result is reused.
+# pts is the timestamp of the frame's buffer in nanoseconds.
+Frame = collections.namedtuple('Frame', [
+    'objs', 'inference_time', 'src_size', 'inference_box', 'mot_tracker',
+    'trdata', 'trackerFlag', 'skipped', 'pts'], defaults=([], False, None, 0))
+
+
+class DetectionInterval:
+    """Decides on which frames of a stream to run the detector.
+
+    The detector runs at least every max_interval frames; on the frames in
+    between the tracker coasts on its motion model. The interval never drops
+    below what the measured invoke time allows within budget seconds per
+    frame. It grows by one after every detection that leaves the scene
+    unchanged and falls back to that minimum as soon as a track appears or is
+    lost, or the mean detection score drops by more than score_drop.
+
+    In a staged pipeline should_detect() and update() are called from
+    different stages, i.e. threads, and are serialized by a lock.
+    """
+    def __init__(self, max_interval, budget, score_drop=0.1):
+        self.max_interval = max_interval
+        self.budget = budget
+        self.score_drop = score_drop
+        self.interval = 1
+        self.skipped = 0
+        self.invoke_time = 0.0
+        self.track_ids = set()
+        self.mean_score = None
+        self.lock = threading.Lock()
+
+    def should_detect(self):
+        with self.lock:
+            if self.skipped + 1 >= self.interval:
+                self.skipped = 0
+                return True
+            self.skipped += 1
+            return False
 
+    def min_interval(self):
+        return min(self.max_interval, max(1, math.ceil(self.invoke_time / self.budget)))
 
-Object = collections.namedtuple('Object', ['id', 'score', 'bbox'])
+    def update(self, objs, inference_time, trdata):
+        """Adapts the interval to the results of a detection."""
+        track_ids = set(np.asarray(trdata).reshape(-1, 7)[:, TRACK_ID].tolist())
+        mean_score = float(objs[:, SCORE].mean()) if len(objs) else 0.0
+        with self.lock:
+            # Exponential moving average of the invoke time.
+            self.invoke_time += 0.2 * (inference_time - self.invoke_time)
+            changed = track_ids != self.track_ids or (
+                self.mean_score is not None and mean_score < self.mean_score - self.score_drop)
+            if changed:
+                self.interval = self.min_interval()
+            else:
+                self.interval = max(self.min_interval(), min(self.max_interval, self.interval + 1))
+            self.track_ids, self.mean_score = track_ids, mean_score
 
 
 def load_labels(path):
@@ -59,90 +171,160 @@ def shadow_text(dwg, x, y, text, font_size=20):
     dwg.add(dwg.text(text, insert=(x, y), fill='white', font_size=font_size))
 
 
-def generate_svg(src_size, inference_size, inference_box, objs, labels, text_lines, trdata, trackerFlag):
-    dwg = svgwrite.Drawing('', size=src_size)
+def to_source_coords(boxes, src_size, inference_size, inference_box):
+    """Maps relative (N, 4) [xmin, ymin, xmax, ymax] boxes to source pixels.
+
+    Returns an (N, 4) array of [x, y, w, h] in the source coordinate space.
+    """
     src_w, src_h = src_size
     inf_w, inf_h = inference_size
     box_x, box_y, box_w, box_h = inference_box
-    scale_x, scale_y = src_w / box_w, src_h / box_h
+    # Relative coordinates.
+    xywh = np.empty((len(boxes), 4))
+    xywh[:, :2] = boxes[:, :2]
+    xywh[:, 2:] = boxes[:, 2:4] - boxes[:, :2]
+    # Absolute coordinates, input tensor space.
+    xywh = np.trunc(xywh * (inf_w, inf_h, inf_w, inf_h))
+    # Subtract boxing offset.
+    xywh[:, :2] -= (box_x, box_y)
+    # Scale to source coordinate space.
+    return xywh * (src_w / box_w, src_h / box_h, src_w / box_w, src_h / box_h)
+
+
+def label_tracks(trdata, objs, indices=None):
+    """Returns (M, 5) tracker output as an (M, 7) track array with score and class id.
+
+    indices gives the row of objs each track was matched to, as kept by trackers
+    with detection_indices. Without it tracks are matched to the detection they
+    overlap most. Tracks without a detection get score 0 and class id -1.
+    """
+    trdata = np.asarray(trdata, dtype=float).reshape(-1, 5)
+    if indices is None or len(indices) != len(trdata):
+        iou = tracker.iou_matrix(trdata[:, :4], objs[:, :4])
+        indices = np.full(len(trdata), -1)
+        if iou.size:
+            indices = np.where(iou.max(axis=1) > 0, iou.argmax(axis=1), -1)
+    tracks = np.empty((len(trdata), 7))
+    tracks[:, :5] = trdata
+    tracks[:, TRACK_SCORE:] = (0.0, -1.0)
+    matched = indices >= 0
+    tracks[matched, TRACK_SCORE:] = objs[indices[matched]][:, [SCORE, CLASS_ID]]
+    return tracks
+
+
+def score_percents(scores):
+    """Returns scores as integer percents, truncated as the float32 scores of the detector.
+
+    Track arrays hold the scores as float64, where 0.9 from the detector is
+    0.8999999761581421 and would be shown as 89%.
+    """
+    return (100 * np.asarray(scores, dtype=np.float32)).astype(int)
+
+
+def overlay_items(src_size, inference_size, inference_box, objs, labels, trdata, trackerFlag):
+    """Returns the boxes to draw as an (N, 4) [x, y, w, h] array in source pixels and their labels."""
+    if trackerFlag and len(trdata):
+        tracks = np.asarray(trdata)
+        if tracks.shape[1] < 7:
+            tracks = label_tracks(tracks, objs)
+        rects = to_source_coords(tracks, src_size, inference_size, inference_box)
+        percents = score_percents(tracks[:, TRACK_SCORE])
+        class_ids = tracks[:, TRACK_CLASS_ID].astype(int)
+        track_ids = tracks[:, TRACK_ID].astype(int)
+        texts = ['{}% {} ID:{}'.format(percent, labels.get(class_id, class_id), track_id)
+                 if class_id >= 0 else 'ID:{}'.format(track_id)
+                 for percent, class_id, track_id in zip(
+                     percents.tolist(), class_ids.tolist(), track_ids.tolist())]
+        return rects, texts
+    rects = to_source_coords(objs, src_size, inference_size, inference_box)
+    percents = score_percents(objs[:, SCORE])
+    class_ids = objs[:, CLASS_ID].astype(int)
+    texts = ['{}% {}'.format(percent, labels.get(class_id, class_id))
+             for percent, class_id in zip(percents.tolist(), class_ids.tolist())]
+    return rects, texts
+
+
+def generate_svg(src_size, inference_size, inference_box, objs, labels, text_lines, trdata, trackerFlag):
+    # Only imported when this renderer is chosen.
+    import svgwrite
+    dwg = svgwrite.Drawing('', size=src_size)
 
     for y, line in enumerate(text_lines, start=1):
         shadow_text(dwg, 10, y*20, line)
-    if trackerFlag and (np.array(trdata)).size:
-        for td in trdata:
-            x0, y0, x1, y1, trackID = td[0].item(), td[1].item(
-            ), td[2].item(), td[3].item(), td[4].item()
-            overlap = 0
-            for ob in objs:
-                dx0, dy0, dx1, dy1 = ob.bbox.xmin.item(), ob.bbox.ymin.item(
-                ), ob.bbox.xmax.item(), ob.bbox.ymax.item()
-                area = (min(dx1, x1)-max(dx0, x0))*(min(dy1, y1)-max(dy0, y0))
-                if (area > overlap):
-                    overlap = area
-                    obj = ob
-
-            # Relative coordinates.
-            x, y, w, h = x0, y0, x1 - x0, y1 - y0
-            # Absolute coordinates, input tensor space.
-            x, y, w, h = int(x * inf_w), int(y *
-                                             inf_h), int(w * inf_w), int(h * inf_h)
-            # Subtract boxing offset.
-            x, y = x - box_x, y - box_y
-            # Scale to source coordinate space.
-            x, y, w, h = x * scale_x, y * scale_y, w * scale_x, h * scale_y
-            percent = int(100 * obj.score)
-            label = '{}% {} ID:{}'.format(
-                percent, labels.get(obj.id, obj.id), int(trackID))
-            shadow_text(dwg, x, y - 5, label)
-            dwg.add(dwg.rect(insert=(x, y), size=(w, h),
-                             fill='none', stroke='red', stroke_width='2'))
-    else:
-        for obj in objs:
-            x0, y0, x1, y1 = list(obj.bbox)
-            # Relative coordinates.
-            x, y, w, h = x0, y0, x1 - x0, y1 - y0
-            # Absolute coordinates, input tensor space.
-            x, y, w, h = int(x * inf_w), int(y *
-                                             inf_h), int(w * inf_w), int(h * inf_h)
-            # Subtract boxing offset.
-            x, y = x - box_x, y - box_y
-            # Scale to source coordinate space.
-            x, y, w, h = x * scale_x, y * scale_y, w * scale_x, h * scale_y
-            percent = int(100 * obj.score)
-            label = '{}% {}'.format(percent, labels.get(obj.id, obj.id))
-            shadow_text(dwg, x, y - 5, label)
-            dwg.add(dwg.rect(insert=(x, y), size=(w, h),
-                             fill='none', stroke='red', stroke_width='2'))
+    rects, texts = overlay_items(src_size, inference_size, inference_box, objs, labels,
+                                 trdata, trackerFlag)
+    for (x, y, w, h), label in zip(rects.tolist(), texts):
+        shadow_text(dwg, x, y - 5, label)
+        dwg.add(dwg.rect(insert=(x, y), size=(w, h),
+                         fill='none', stroke='red', stroke_width='2'))
     return dwg.tostring()
 
 
-class BBox(collections.namedtuple('BBox', ['xmin', 'ymin', 'xmax', 'ymax'])):
-    """Bounding box.
-    Represents a rectangle which sides are either vertical or horizontal, parallel
-    to the x or y axis.
+# Templates of the template renderer. Attributes shared by all labels and all
+# boxes are set once on a group instead of on every element.
+SVG_HEADER = '<svg xmlns="http://www.w3.org/2000/svg" width="{}" height="{}">'
+SVG_TEXT = ('<text x="{:.0f}" y="{:.0f}" fill="black">{text}</text>'
+            '<text x="{:.0f}" y="{:.0f}" fill="white">{text}</text>')
+SVG_RECT = '<rect x="{:.0f}" y="{:.0f}" width="{:.0f}" height="{:.0f}"/>'
+
+
+def svg_text(x, y, text):
+    return SVG_TEXT.format(x + 1, y + 1, x, y, text=xml.sax.saxutils.escape(text))
+
+
+def generate_svg_template(src_size, inference_size, inference_box, objs, labels, text_lines,
+                          trdata, trackerFlag):
+    """Same overlay as generate_svg, formatted straight from the arrays without a DOM.
+
+    The output is also smaller, so the overlay element parses it faster.
     """
-    __slots__ = ()
+    rects, texts = overlay_items(src_size, inference_size, inference_box, objs, labels,
+                                 trdata, trackerFlag)
+    rects = rects.tolist()
+    parts = [SVG_HEADER.format(*src_size), '<g font-size="20">']
+    parts.extend(svg_text(10, y * 20, line) for y, line in enumerate(text_lines, start=1))
+    parts.extend(svg_text(x, y - 5, label) for (x, y, _, _), label in zip(rects, texts))
+    parts.append('</g><g fill="none" stroke="red" stroke-width="2">')
+    parts.extend(SVG_RECT.format(*rect) for rect in rects)
+    parts.append('</g></svg>')
+    return ''.join(parts)
 
 
-def get_output(interpreter, score_threshold, top_k, image_scale=1.0):
-    """Returns list of detected objects."""
-    boxes = common.output_tensor(interpreter, 0)
-    category_ids = common.output_tensor(interpreter, 1)
-    scores = common.output_tensor(interpreter, 2)
+# Overlay renderers selectable with --renderer.
+RENDERERS = {'svgwrite': generate_svg, 'template': generate_svg_template}
 
-    def make(i):
-        ymin, xmin, ymax, xmax = boxes[i]
-        return Object(
-            id=int(category_ids[i]),
-            score=scores[i],
-            bbox=BBox(xmin=np.maximum(0.0, xmin),
-                      ymin=np.maximum(0.0, ymin),
-                      xmax=np.minimum(1.0, xmax),
-                      ymax=np.minimum(1.0, ymax)))
-    return [make(i) for i in range(top_k) if scores[i] >= score_threshold]
+
+def get_output(session, score_threshold, top_k, image_scale=1.0, index=0, decoder=None):
+    """Returns detected objects as an (N, 6) float32 array.
+
+    Each row is [xmin, ymin, xmax, ymax, score, class_id] (see the column
+    constants above), with box coordinates relative to the input tensor and
+    clipped to [0, 1]. session is a common.InterpreterSession, index the frame
+    in its batch. Models without the detection postprocess op need the
+    postprocess.SsdDecoder of the model as decoder.
+    """
+    if decoder is not None:
+        return decoder(session, score_threshold, top_k, index)
+    boxes = session.output(0, top_k, index)
+    category_ids = session.output(1, top_k, index)
+    scores = session.output(2, top_k, index)
+
+    keep = scores >= score_threshold
+    objs = np.empty((np.count_nonzero(keep), 6), dtype=np.float32)
+    # Model boxes are [ymin, xmin, ymax, xmax].
+    objs[:, XMIN:YMAX + 1] = boxes[keep][:, [1, 0, 3, 2]]
+    np.clip(objs[:, XMIN:YMAX + 1], 0.0, 1.0, out=objs[:, XMIN:YMAX + 1])
+    objs[:, SCORE] = scores[keep]
+    objs[:, CLASS_ID] = category_ids[keep]
+    return objs
 
 
 def main():
+    # Imported here, so that the helpers above can be used without PyGObject,
+    # e.g. by benchmark.py. gstreamer is only imported for live sources below.
+    import capture
+    import frame_pipeline
+
     default_model_dir = '../models'
     default_model = 'mobilenet_ssd_v2_coco_quant_postprocess_edgetpu.tflite'
     default_labels = 'coco_labels.txt'
@@ -155,64 +337,488 @@ def main():
                         help='number of categories with highest score to display')
     parser.add_argument('--threshold', type=float, default=0.1,
                         help='classifier score threshold')
-    parser.add_argument('--videosrc', help='Which video source to use. ',
-                        default='/dev/video0')
+    parser.add_argument('--anchors',
+                        help='.npy file of the (anchors, 4) [y, x, h, w] anchors of a model with '
+                             'raw SSD outputs, if not those of the default SSD anchor generator')
+    parser.add_argument('--videosrc', help='Which video source to use. Several sources '
+                        'are run as separate streams sharing the interpreters.',
+                        nargs='+', default=['/dev/video0'])
+    parser.add_argument('--devices', nargs='+', default=[''],
+                        help='load the model on each of these devices and spread frames '
+                             'over them, e.g. :0 :1 for two Edge TPUs, cpu or xnnpack to run '
+                             'on the CPU, or auto for the fastest backend that can run the model')
+    parser.add_argument('--num_threads', type=int, default=None,
+                        help='threads per interpreter for the CPU and XNNPACK backends')
     parser.add_argument('--videofmt', help='Input video format.',
                         default='raw',
                         choices=['raw', 'h264', 'jpeg'])
     parser.add_argument('--tracker', help='Name of the Object Tracker To be used.',
                         default=None,
-                        choices=[None, 'sort'])
+                        choices=tracker.available_trackers())
+    parser.add_argument('--stats_interval', type=int, default=10,
+                        help='seconds between per-stream stats with several sources (0 disables)')
+    parser.add_argument('--pipeline_depth', type=int, default=0,
+                        help='run inference, tracking and rendering as pipelined stages '
+                             'with up to this many frames queued between stages '
+                             '(0 runs them serially)')
+    parser.add_argument('--headless', action='store_true',
+                        help='process every frame of --videosrc as fast as possible, '
+                             'without a display')
+    parser.add_argument('--output',
+                        help='write detections and tracks per frame to this file: '
+                             'MOTChallenge CSV, or JSON lines if it ends in .jsonl')
+    parser.add_argument('--batch_size', type=int, default=1,
+                        help='run the model once over up to this many queued frames, for '
+                             'models that can be resized to a batch (CPU or batch compiled)')
+    parser.add_argument('--batch_wait_ms', type=float, default=10,
+                        help='longest wait for more frames to fill a batch')
+    parser.add_argument('--deadline_ms', type=float, default=0,
+                        help='discard frames captured longer ago than this before they are '
+                             'run through the model (0 disables)')
+    parser.add_argument('--detect_interval', type=int, default=1,
+                        help='run the detector at most every this many frames and let the '
+                             'tracker predict the frames in between; the interval adapts to '
+                             'invoke time and scene changes (needs a --tracker; trackers '
+                             'without a predict-only step still detect every frame)')
+    parser.add_argument('--detect_budget_ms', type=float, default=33,
+                        help='time per frame the detector may use with --detect_interval')
+    parser.add_argument('--motion_threshold', type=float, default=0,
+                        help='skip the detector and reuse its last result while less than '
+                             'this fraction of the sampled pixels changed since the last '
+                             'detection (0 disables)')
+    parser.add_argument('--motion_pixel_threshold', type=int, default=25,
+                        help='change in pixel value that counts as motion')
+    parser.add_argument('--motion_refresh', type=int, default=30,
+                        help='run the detector at least every this many frames of a static scene')
+    parser.add_argument('--events',
+                        help='publish track records with enter and exit events to a ring '
+                             'buffer at this path, e.g. /dev/shm/tracks (see events.py)')
+    parser.add_argument('--events_exit_after', type=int,
+                        help='frames a track may go unreported before its exit event '
+                             '(default: as long as the tracker keeps unreported tracks)')
+    parser.add_argument('--display', default='ximage', choices=frame_pipeline.DISPLAYS,
+                        help='sink showing the video with the overlay: ximagesink, glimagesink '
+                             'which saves a colour conversion per frame, or none to run a live '
+                             'source without showing it')
+    parser.add_argument('--renderer', default='template', choices=sorted(RENDERERS),
+                        help='how the overlay SVG is built: formatted from templates, or '
+                             'through an svgwrite DOM')
+    parser.add_argument('--record',
+                        help='write the frames given to the model, with their timestamps, '
+                             'to this capture file (see capture.py)')
+    parser.add_argument('--record_frames', type=int, default=300,
+                        help='most frames written to --record')
+    parser.add_argument('--replay',
+                        help='run on the frames of a capture file written by --record '
+                             'instead of --videosrc, without a display')
+    parser.add_argument('--replay_realtime', action='store_true',
+                        help='replay frames at their recorded intervals, dropping the ones '
+                             'inference has no time for, instead of as fast as possible')
+    parser.add_argument('--metrics_port', type=int, default=0,
+                        help='serve Prometheus metrics on http://127.0.0.1:PORT/metrics')
+    parser.add_argument('--metrics_file',
+                        help='periodically write Prometheus metrics to this file')
+    parser.add_argument('--metrics_interval', type=float, default=10,
+                        help='seconds between writes of --metrics_file')
     args = parser.parse_args()
+    if args.detect_interval > 1 and not args.tracker:
+        parser.error('--detect_interval needs a --tracker')
+    if args.deadline_ms and args.headless:
+        parser.error('--deadline_ms drops frames, --headless processes all of them')
+    if args.events and not args.tracker:
+        parser.error('--events needs a --tracker')
+    if args.motion_threshold and len(args.videosrc) > 1 and not args.tracker:
+        parser.error('--motion_threshold with several sources needs a --tracker')
+    if args.headless and len(args.videosrc) > 1:
+        parser.error('--headless takes a single --videosrc')
+    if args.output and len(args.videosrc) > 1:
+        parser.error('--output takes a single --videosrc')
+    if args.batch_size > 1 and len(args.devices) > 1 and len(args.videosrc) == 1:
+        parser.error('--batch_size with several --devices needs several --videosrc')
+    if args.record and (len(args.videosrc) > 1 or args.replay):
+        parser.error('--record takes a single --videosrc')
+    if args.replay and len(args.videosrc) > 1:
+        parser.error('--replay takes a single --videosrc')
+    if args.replay_realtime and not args.replay:
+        parser.error('--replay_realtime needs --replay')
+    if args.deadline_ms and args.replay and not args.replay_realtime:
+        parser.error('--deadline_ms drops frames, --replay processes all of them unless '
+                     '--replay_realtime')
+    reader = None
+    if args.replay:
+        try:
+            reader = capture.CaptureReader(args.replay)
+        except (OSError, ValueError) as e:
+            parser.error(str(e))
+
+    # Read from the model file, the pipelines are built before the model is loaded.
+    try:
+        w, h, channels = common.model_input_size(args.model)
+    except (OSError, ValueError) as e:
+        parser.error(str(e))
+    inference_size = (w, h)
+    if reader and reader.size != inference_size:
+        parser.error('{} holds {}x{} frames, the model takes {}x{}'.format(
+            args.replay, *reader.size, *inference_size))
+
+    startup = metrics.StartupTimer()
+
+    def load_model():
+        with startup.phase('load model'):
+            return common.make_interpreter_pool(args.model, args.devices, args.batch_size,
+                                                args.num_threads)
 
     print('Loading {} with {} labels.'.format(args.model, args.labels))
-    interpreter = common.make_interpreter(args.model)
-    interpreter.allocate_tensors()
+    # Load the model while GStreamer (and GTK) initialize and the pipelines are
+    # built and start to preroll; warmup() waits for it.
+    loader = concurrent.futures.ThreadPoolExecutor(max_workers=1)
+    loaded = loader.submit(load_model)
+    loader.shutdown(wait=False)
+    if not args.replay:
+        # A replay runs without the GStreamer Python bindings.
+        import gstreamer
+        with startup.phase('init gstreamer'):
+            gstreamer.init(gui=not args.headless and args.display != 'none')
     labels = load_labels(args.labels)
+    # Set by warmup().
+    pool = decoder = None
 
-    w, h, _ = common.input_image_size(interpreter)
-    inference_size = (w, h)
-    # Average fps over last 30 frames.
-    fps_counter = common.avg_fps_counter(30)
+    registry = metrics.REGISTRY
+    input_time = registry.histogram('input_seconds', 'Time to copy a frame into the input tensor.')
+    invoke_time = registry.histogram('invoke_seconds', 'Time spent in interpreter.invoke().')
+    postprocess_time = registry.histogram('postprocess_seconds', 'Time spent in get_output().')
+    tracker_time = registry.histogram('tracker_seconds', 'Time spent updating the tracker.')
+    motion_time = registry.histogram('motion_seconds', 'Time spent in the motion gate.')
+    render_time = registry.histogram('render_seconds', 'Time to render or write the results.')
+    if args.metrics_port:
+        registry.serve(args.metrics_port)
+    if args.metrics_file:
+        registry.write_periodically(args.metrics_file, args.metrics_interval)
 
-    def user_callback(input_tensor, src_size, inference_box, mot_tracker):
-        nonlocal fps_counter
+    def warmup():
+        """Waits for the model, which loads while the pipelines preroll, and warms it up."""
+        nonlocal pool, decoder
+        try:
+            pool = loaded.result()
+            decoder = postprocess.make_decoder(pool.interpreter, args.anchors)
+        except ValueError as e:
+            parser.error(str(e))
+        print('Postprocessing: {}.'.format(
+            decoder or 'TFLite detection postprocess op in the model'))
+        for instance in pool.instances:
+            registry.gauge('interpreter_pending', 'Frames queued or running on an interpreter.',
+                           fn=lambda instance=instance: instance.pending,
+                           interpreter=instance.name)
+            for route in ('direct', 'strided'):
+                registry.counter('input_route_total',
+                                 'Frames copied to the input tensor per route.',
+                                 fn=lambda instance=instance, route=route:
+                                     instance.interpreter.input_routes[route],
+                                 interpreter=instance.name, route=route)
+        print('Input frames are mapped {}.'.format(
+            'in place' if common.zero_copy_map() else 'through the Python bindings'))
+        pool.warmup()
+
+    def invoke(session, input_tensor):
         start_time = time.monotonic()
-        common.set_input(interpreter, input_tensor)
-        interpreter.invoke()
+        with input_time.time():
+            session.set_input(input_tensor)
+        with invoke_time.time():
+            session.invoke()
         # For larger input image sizes, use the edgetpu.classification.engine for better performance
-        objs = get_output(interpreter, args.threshold, args.top_k)
+        with postprocess_time.time():
+            objs = get_output(session, args.threshold, args.top_k, decoder=decoder)
+        end_time = time.monotonic()
+        return objs, end_time - start_time
+
+    def invoke_batch(session, input_tensors):
+        """Runs the model once over several frames, returns (objs, time) per frame."""
+        start_time = time.monotonic()
+        with input_time.time():
+            for index, input_tensor in enumerate(input_tensors):
+                session.set_input(input_tensor, index)
+        with invoke_time.time():
+            session.invoke()
+        with postprocess_time.time():
+            objs = [get_output(session, args.threshold, args.top_k, index=index, decoder=decoder)
+                    for index in range(len(input_tensors))]
         end_time = time.monotonic()
-        detections = []  # np.array([])
-        for n in range(0, len(objs)):
-            element = []  # np.array([])
-            element.append(objs[n].bbox.xmin)
-            element.append(objs[n].bbox.ymin)
-            element.append(objs[n].bbox.xmax)
-            element.append(objs[n].bbox.ymax)
-            element.append(objs[n].score)  # print('element= ',element)
-            detections.append(element)  # print('dets: ',dets)
-        # convert to numpy array #      print('npdets: ',dets)
-        detections = np.array(detections)
-        trdata = []
-        trackerFlag = False
-        if detections.any():
-            if mot_tracker != None:
-                trdata = mot_tracker.update(detections)
-                trackerFlag = True
+        return [(o, end_time - start_time) for o in objs]
+
+    # Per stream, i.e. per tracker: last frame the detector ran on, DetectionInterval,
+    # MotionGate and the average fps over its last 30 frames.
+    last_detected = {}
+    intervals = {}
+    gates = {}
+    fps_counters = {}
+    # Streams without a tracker share a counter, which scheduler workers may
+    # advance at the same time.
+    fps_lock = threading.Lock()
+
+    def next_fps(mot_tracker):
+        with fps_lock:
+            if mot_tracker not in fps_counters:
+                fps_counters[mot_tracker] = common.avg_fps_counter(30)
+            return next(fps_counters[mot_tracker])
+
+    def get_interval(mot_tracker):
+        if args.detect_interval <= 1 or not hasattr(mot_tracker, 'coast'):
+            return None
+        if mot_tracker not in intervals:
+            intervals[mot_tracker] = DetectionInterval(args.detect_interval,
+                                                       args.detect_budget_ms / 1000)
+        return intervals[mot_tracker]
+
+    def get_gate(mot_tracker):
+        if not args.motion_threshold:
+            return None
+        if mot_tracker not in gates:
+            gate = gates[mot_tracker] = motion.MotionGate(
+                args.motion_threshold, args.motion_pixel_threshold, args.motion_refresh)
+            stream = str(len(gates) - 1)
+            registry.counter('motion_frames_total', 'Frames checked by the motion gate.',
+                             fn=lambda: gate.frames, stream=stream)
+            registry.counter('motion_skipped_total', 'Frames the motion gate found static.',
+                             fn=lambda: gate.skipped, stream=stream)
+        return gates[mot_tracker]
+
+    def is_static(input_tensor, mot_tracker):
+        gate = get_gate(mot_tracker)
+        if gate is None:
+            return False
+        with motion_time.time(), common.map_frame(input_tensor, h, w, channels) as (frame, _):
+            return gate.is_static(frame)
+
+    def skip_detection(input_tensor, mot_tracker):
+        """Returns why the detector can be skipped on a frame, None if it can't.
+
+        The interval is checked first: the motion gate takes every frame it
+        doesn't find static as its reference, which must be a detected frame.
+        """
+        interval = get_interval(mot_tracker)
+        if interval is not None and not interval.should_detect():
+            return 'coast'
+        if is_static(input_tensor, mot_tracker):
+            return 'static'
+        return None
+
+    def infer(input_tensor, src_size, inference_box, mot_tracker):
+        skipped = skip_detection(input_tensor, mot_tracker)
+        if skipped:
+            return Frame(None, 0.0, src_size, inference_box, mot_tracker, skipped=skipped,
+                         pts=input_tensor.pts)
+        objs, inference_time = pool.run(invoke, input_tensor)
+        return Frame(objs, inference_time, src_size, inference_box, mot_tracker,
+                     pts=input_tensor.pts)
+
+    def infer_batch(frames):
+        """infer() over a list of frame arguments, with one invoke for all detections."""
+        skipped = [skip_detection(input_tensor, mot_tracker)
+                   for input_tensor, _, _, mot_tracker in frames]
+        to_detect = [input_tensor for (input_tensor, _, _, _), skip in zip(frames, skipped)
+                     if not skip]
+        results = iter(pool.run(invoke_batch, to_detect) if to_detect else [])
+        batch = []
+        for (input_tensor, src_size, inference_box, mot_tracker), skip in zip(frames, skipped):
+            if skip:
+                batch.append(Frame(None, 0.0, src_size, inference_box, mot_tracker,
+                                   skipped=skip, pts=input_tensor.pts))
+            else:
+                objs, inference_time = next(results)
+                batch.append(Frame(objs, inference_time, src_size, inference_box, mot_tracker,
+                                   pts=input_tensor.pts))
+        return batch
+
+    def dispatch(input_tensor, src_size, inference_box, mot_tracker):
+        skipped = skip_detection(input_tensor, mot_tracker)
+        if skipped:
+            return skipped, src_size, inference_box, mot_tracker, input_tensor.pts
+        # Doesn't wait for the result, so every interpreter of the pool stays busy.
+        return (pool.submit(invoke, input_tensor), src_size, inference_box, mot_tracker,
+                input_tensor.pts)
+
+    def collect(dispatched):
+        future, src_size, inference_box, mot_tracker, pts = dispatched
+        if isinstance(future, str):
+            return Frame(None, 0.0, src_size, inference_box, mot_tracker, skipped=future,
+                         pts=pts)
+        objs, inference_time = future.result()
+        return Frame(objs, inference_time, src_size, inference_box, mot_tracker, pts=pts)
+
+    def track(frame):
+        interval = get_interval(frame.mot_tracker)
+        if frame.skipped:
+            last = last_detected[frame.mot_tracker]
+            frame = frame._replace(objs=last.objs, inference_time=last.inference_time)
+        if frame.skipped == 'coast':
+            # Move the tracks on with the motion model, label them with the last detections.
+            with tracker_time.time():
+                trdata = frame.mot_tracker.coast()
+                trdata = label_tracks(trdata, frame.objs, frame.mot_tracker.detection_indices)
+            return frame._replace(trdata=trdata, trackerFlag=True)
+        # Score column included, class id left out; this is a view, not a copy.
+        detections = frame.objs[:, :SCORE + 1]
+        # Also without detections, so that unmatched tracks age and expire.
+        if frame.mot_tracker != None:
+            with tracker_time.time():
+                trdata = frame.mot_tracker.update(detections)
+                trdata = label_tracks(trdata, frame.objs,
+                                      getattr(frame.mot_tracker, 'detection_indices', None))
+            frame = frame._replace(trdata=trdata, trackerFlag=True)
+        if not frame.skipped:
+            last_detected[frame.mot_tracker] = frame
+            if interval is not None:
+                interval.update(frame.objs, frame.inference_time, frame.trdata)
+        return frame
+
+    renderer = RENDERERS[args.renderer]
+    writer = mot.make_writer(args.output) if args.output else None
+    frame_index = 0
+
+    def write(frame):
+        nonlocal frame_index
+        frame_index += 1
+        objs = frame.objs[:0] if frame.skipped == 'coast' else frame.objs
+        detections = np.concatenate((
+            to_source_coords(objs, frame.src_size, inference_size, frame.inference_box),
+            objs[:, SCORE:]), axis=1)
+        tracks = track_scores = None
+        if frame.mot_tracker != None:
+            trdata = np.asarray(frame.trdata).reshape(-1, 7)
+            tracks = np.concatenate((
+                to_source_coords(trdata, frame.src_size, inference_size, frame.inference_box),
+                trdata[:, TRACK_ID:TRACK_ID + 1]), axis=1)
+            track_scores = trdata[:, TRACK_SCORE]
+        writer.write(frame_index, detections, tracks, track_scores)
+
+    event_writer = None
+    if args.events:
+        exit_after = args.events_exit_after
+        if exit_after is None:
+            exit_after = events.tracker_exit_after(tracker.make_tracker(args.tracker))
+        event_writer = events.TrackEventWriter(args.events, exit_after=exit_after)
+    # The tracker of each source, made here so that events carry the index i
+    # of 'stream i' in the pipeline stats. A single source is stream 0.
+    mot_trackers = None
+    if len(args.videosrc) > 1 and args.tracker:
+        mot_trackers = [tracker.make_tracker(args.tracker) for _ in args.videosrc]
+    stream_ids = {mot_tracker: i for i, mot_tracker in enumerate(mot_trackers or [])}
+
+    def publish(frame):
+        stream = stream_ids.get(frame.mot_tracker, 0)
+        trdata = np.asarray(frame.trdata).reshape(-1, 7)
+        tracks = np.empty_like(trdata)
+        tracks[:, :4] = to_source_coords(trdata, frame.src_size, inference_size,
+                                         frame.inference_box)
+        tracks[:, TRACK_ID:] = trdata[:, TRACK_ID:]
+        event_writer.write(stream, frame.pts, tracks)
+
+    def render(frame):
+        with render_time.time():
+            return render_frame(frame)
+
+    def render_frame(frame):
+        if writer:
+            write(frame)
+        if event_writer:
+            publish(frame)
+        if args.headless or args.replay or args.display == 'none':
+            return None
+        if len(frame.objs) != 0:
             text_lines = [
-                'Inference: {:.2f} ms'.format((end_time - start_time) * 1000),
-                'FPS: {} fps'.format(round(next(fps_counter))), ]
-        if len(objs) != 0:
-            return generate_svg(src_size, inference_size, inference_box, objs, labels, text_lines, trdata, trackerFlag)
-
-    result = gstreamer.run_pipeline(user_callback,
-                                    src_size=(640, 480),
-                                    appsink_size=inference_size,
-                                    trackerName=args.tracker,
-                                    videosrc=args.videosrc,
-                                    videofmt=args.videofmt)
+                'Inference: {:.2f} ms'.format(frame.inference_time * 1000),
+                'FPS: {} fps'.format(round(next_fps(frame.mot_tracker))), ]
+            interval = get_interval(frame.mot_tracker)
+            if interval is not None:
+                text_lines.append('Detect every: {} frames'.format(interval.interval))
+            gate = get_gate(frame.mot_tracker)
+            if gate is not None:
+                text_lines.append('Motion gate: {:.0%} skipped'.format(gate.skip_rate()))
+            return renderer(frame.src_size, inference_size, frame.inference_box, frame.objs,
+                            labels, text_lines, frame.trdata, frame.trackerFlag)
 
+    def user_callback(input_tensor, src_size, inference_box, mot_tracker):
+        return render(track(infer(input_tensor, src_size, inference_box, mot_tracker)))
+
+    def user_callback_batch(frames):
+        return [render(track(frame)) for frame in infer_batch(frames)]
+
+    batched = args.batch_size > 1
+    batch_wait = args.batch_wait_ms / 1000
+
+    start_time = time.monotonic()
+    if len(args.videosrc) > 1:
+        # One worker per interpreter, each serving whichever stream is ready.
+        callback = user_callback_batch if batched else user_callback
+        result = gstreamer.run_pipelines([callback] * len(args.devices),
+                                         src_size=(640, 480),
+                                         appsink_size=inference_size,
+                                         trackerName=args.tracker,
+                                         videosrcs=args.videosrc,
+                                         videofmt=args.videofmt,
+                                         stats_interval=args.stats_interval,
+                                         deadline=args.deadline_ms / 1000,
+                                         batch_size=args.batch_size,
+                                         batch_wait=batch_wait,
+                                         warmup=warmup,
+                                         startup=startup,
+                                         display=args.display,
+                                         mot_trackers=mot_trackers)
+    else:
+        pipeline_depth = args.pipeline_depth
+        if len(args.devices) > 1:
+            # Keep a frame queued for every interpreter of the pool.
+            user_function = [dispatch, collect, track, render]
+            pipeline_depth = max(pipeline_depth, len(args.devices))
+        elif pipeline_depth:
+            # Invoke the next frame while the previous ones are tracked and rendered.
+            user_function = [infer_batch if batched else infer, track, render]
+        else:
+            user_function = user_callback_batch if batched else user_callback
+        if reader:
+            result = capture.run_replay(user_function, reader, args.tracker,
+                                        pipeline_depth=pipeline_depth,
+                                        realtime=args.replay_realtime,
+                                        deadline=args.deadline_ms / 1000,
+                                        batch_size=args.batch_size,
+                                        batch_wait=batch_wait,
+                                        warmup=warmup,
+                                        startup=startup)
+        else:
+            recorder = args.record and capture.CaptureWriter(args.record, args.record_frames)
+            result = gstreamer.run_pipeline(user_function,
+                                            src_size=(640, 480),
+                                            appsink_size=inference_size,
+                                            trackerName=args.tracker,
+                                            videosrc=args.videosrc[0],
+                                            videofmt=args.videofmt,
+                                            pipeline_depth=pipeline_depth,
+                                            headless=args.headless,
+                                            deadline=args.deadline_ms / 1000,
+                                            batch_size=args.batch_size,
+                                            batch_wait=batch_wait,
+                                            warmup=warmup,
+                                            startup=startup,
+                                            display=args.display,
+                                            recorder=recorder)
+            if recorder:
+                recorder.close()
+                print('Recorded {} frames to {}.'.format(recorder.count, args.record))
+        if args.headless or args.replay:
+            elapsed = time.monotonic() - start_time
+            print('Processed {} frames in {:.1f} s ({:.1f} fps).'.format(
+                result.processed, elapsed, result.processed / elapsed))
+        print('Capture to result latency p50: {:.1f} ms p99: {:.1f} ms, {} late frames.'.format(
+            1000 * result.latency(0.5), 1000 * result.latency(0.99), result.late))
+    if writer:
+        writer.close()
+    if event_writer:
+        event_writer.close()
+    for gate in gates.values():
+        print('Motion gate: {}'.format(gate))
+    for line in pool.stats():
+        print(line)
+    pool.close()
 
 if __name__ == '__main__':
     main()
@@ -0,0 +1,251 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Compact binary stream of per-frame track records for downstream consumers.
+
+Records are written to a memory-mapped ring buffer file, preferably on tmpfs
+(e.g. /dev/shm/tracks), by a single writer, and read by any number of readers
+that map the same file. Each record has a fixed 40 byte layout, RECORD_DTYPE:
+
+    pts       uint64   buffer timestamp in nanoseconds
+    track_id  uint32
+    frame     uint32   frame number in its stream, from 1
+    box       4 float32  [x, y, w, h] in source pixels
+    score     float32
+    class_id  int16
+    stream    uint8    index of the stream
+    event     uint8    UPDATE, ENTER (first record of a track) or EXIT (last)
+
+all little endian. The file starts with a 64 byte header (HEADER_DTYPE) that
+holds the capacity in records and the total number of records written, head.
+Like a seqlock, the writer first advances writing to the count it is about
+to reach, stores the records of a frame with one copy and then advances
+head; readers keep their own position, so a slow reader only loses records
+and never blocks the writer.
+
+The header fields are plain stores through the mapping, without memory
+barriers, which Python can't issue. That is enough on x86, where other
+processes see stores in program order. On ARM and other weakly ordered CPUs
+a reader on another core may see head advance before the records it
+publishes, or miss the advance of writing, and then return a torn record
+without counting it as lost. There, pin readers to the writer's core or
+treat the records as best effort.
+
+Reading from Python:
+
+    reader = events.RingReader('/dev/shm/tracks')
+    for records in reader.poll():
+        entered = records[records['event'] == events.ENTER]
+
+or from the command line: python3 events.py /dev/shm/tracks
+"""
+import argparse
+import mmap
+import numpy as np
+import threading
+import time
+
+MAGIC = b'CTRK'
+VERSION = 2
+
+UPDATE, ENTER, EXIT = range(3)
+
+RECORD_DTYPE = np.dtype([
+    ('pts', '<u8'), ('track_id', '<u4'), ('frame', '<u4'), ('box', '<f4', 4),
+    ('score', '<f4'), ('class_id', '<i2'), ('stream', 'u1'), ('event', 'u1')])
+
+HEADER_DTYPE = np.dtype([
+    ('magic', 'S4'), ('version', '<u4'), ('record_size', '<u4'), ('capacity', '<u4'),
+    ('head', '<u8'), ('writing', '<u8'), ('reserved', 'V32')])
+
+
+class RingWriter:
+    """Writes records to a ring buffer file, replacing any existing file."""
+    def __init__(self, path, capacity=1 << 16):
+        size = HEADER_DTYPE.itemsize + capacity * RECORD_DTYPE.itemsize
+        with open(path, 'w+b') as f:
+            f.truncate(size)
+            self.mmap = mmap.mmap(f.fileno(), size)
+        self.header = np.ndarray((), HEADER_DTYPE, self.mmap)
+        self.records = np.ndarray((capacity,), RECORD_DTYPE, self.mmap, HEADER_DTYPE.itemsize)
+        self.capacity = capacity
+        self.header['record_size'] = RECORD_DTYPE.itemsize
+        self.header['capacity'] = capacity
+        self.header['version'] = VERSION
+        # Written last, readers wait for it.
+        self.header['magic'] = MAGIC
+
+    def write(self, records):
+        """Appends an array of RECORD_DTYPE records."""
+        head = int(self.header['head'])
+        # Of more records than fit, only the newest are kept.
+        head += max(0, len(records) - self.capacity)
+        records = records[-self.capacity:]
+        start = head % self.capacity
+        first = min(len(records), self.capacity - start)
+        # Readers drop what they copied from the slots about to be overwritten.
+        self.header['writing'] = head + len(records)
+        self.records[start:start + first] = records[:first]
+        self.records[:len(records) - first] = records[first:]
+        # Publish only once the records are in place.
+        self.header['head'] = head + len(records)
+
+    def close(self):
+        del self.header, self.records
+        self.mmap.close()
+
+
+class RingReader:
+    """Reads the records of a ring buffer file written by RingWriter.
+
+    Starts at the newest record, or at the oldest one still in the buffer
+    with from_start. lost counts the records overwritten before they were read.
+    """
+    def __init__(self, path, from_start=False):
+        with open(path, 'rb') as f:
+            self.mmap = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.header = np.ndarray((), HEADER_DTYPE, self.mmap)
+        if self.header['magic'] != MAGIC or self.header['version'] != VERSION:
+            raise ValueError('{} is not a track event ring buffer'.format(path))
+        self.capacity = int(self.header['capacity'])
+        self.records = np.ndarray((self.capacity,), RECORD_DTYPE, self.mmap,
+                                  HEADER_DTYPE.itemsize)
+        head = int(self.header['head'])
+        self.position = max(0, head - self.capacity) if from_start else head
+        self.lost = 0
+
+    def read(self):
+        """Returns a copy of the records written since the last call."""
+        head = int(self.header['head'])
+        if head - self.position > self.capacity:
+            self.lost += head - self.capacity - self.position
+            self.position = head - self.capacity
+        indices = np.arange(self.position, head) % self.capacity
+        records = self.records[indices]
+        # Records in slots the writer started to overwrite while they were copied are torn.
+        overwritten = int(self.header['writing']) - self.capacity - self.position
+        if overwritten > 0:
+            records = records[overwritten:]
+            self.lost += overwritten
+        self.position = head
+        return records
+
+    def poll(self, interval=0.005):
+        """Yields the new records whenever there are any, forever."""
+        while True:
+            records = self.read()
+            if len(records):
+                yield records
+            else:
+                time.sleep(interval)
+
+    def close(self):
+        del self.header, self.records
+        self.mmap.close()
+
+
+def tracker_exit_after(mot_tracker):
+    """Returns the most frames in a row a live track of mot_tracker goes unreported.
+
+    A SORT style tracker keeps a track for max_age frames without a
+    detection, and reports it again once it has been matched min_hits times
+    in a row.
+    """
+    max_age = getattr(mot_tracker, 'max_age', 1)
+    min_hits = getattr(mot_tracker, 'min_hits', 1)
+    return max_age + max(min_hits - 1, 0)
+
+
+class TrackEventWriter:
+    """Turns the tracks of each frame into records with enter and exit events.
+
+    A track enters with its first record and exits, repeating its last box,
+    once it hasn't been reported for more than exit_after frames of its
+    stream. The default is SORT's default max_age, so that a track missed on
+    a single frame isn't reported as leaving and entering again; see
+    tracker_exit_after() for the value that suits a given tracker.
+
+    write() may be called from several threads, e.g. the workers of a
+    StreamScheduler; the ring still has a single writer.
+    """
+    def __init__(self, path, capacity=1 << 16, exit_after=1):
+        self.ring = RingWriter(path, capacity)
+        self.exit_after = exit_after
+        self.lock = threading.Lock()
+        # stream -> [frame number, last records of live tracks, frames missed by each]
+        self.streams = {}
+
+    def write(self, stream, pts, tracks):
+        """Writes one frame of a stream.
+
+        tracks: (M, 7) [x, y, w, h, track_id, score, class_id] in source pixels.
+        """
+        with self.lock:
+            self._write(stream, pts, tracks)
+
+    def _write(self, stream, pts, tracks):
+        state = self.streams.setdefault(
+            stream, [0, np.empty(0, RECORD_DTYPE), np.empty(0, dtype=int)])
+        state[0] += 1
+        frame, live, missed = state
+        records = np.empty(len(tracks), RECORD_DTYPE)
+        records['pts'] = pts
+        records['frame'] = frame
+        records['stream'] = stream
+        records['box'] = tracks[:, :4]
+        records['track_id'] = tracks[:, 4]
+        records['score'] = tracks[:, 5]
+        records['class_id'] = tracks[:, 6]
+        records['event'] = np.where(np.isin(records['track_id'], live['track_id']), UPDATE, ENTER)
+
+        absent = ~np.isin(live['track_id'], records['track_id'])
+        live, missed = live[absent], missed[absent] + 1
+        gone = missed > self.exit_after
+        exits = live[gone]
+        exits['pts'], exits['frame'], exits['event'] = pts, frame, EXIT
+        state[1] = np.concatenate((records, live[~gone]))
+        state[2] = np.concatenate((np.zeros(len(records), dtype=int), missed[~gone]))
+        self.ring.write(np.concatenate((records, exits)))
+
+    def close(self):
+        """Writes exits for all live tracks and closes the ring buffer."""
+        with self.lock:
+            for frame, live, _ in self.streams.values():
+                live['event'] = EXIT
+                self.ring.write(live)
+            self.ring.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Prints the records of a track event ring buffer.')
+    parser.add_argument('path')
+    parser.add_argument('--from_start', action='store_true',
+                        help='start at the oldest record still in the buffer')
+    args = parser.parse_args()
+    reader = RingReader(args.path, args.from_start)
+    names = {UPDATE: 'update', ENTER: 'enter', EXIT: 'exit'}
+    try:
+        for records in reader.poll():
+            for r in records:
+                print('{} stream={} frame={} pts={} id={} class={} score={:.2f} box={}'.format(
+                    names[int(r['event'])], r['stream'], r['frame'], r['pts'], r['track_id'],
+                    r['class_id'], r['score'], np.round(r['box'], 1).tolist()))
+    except KeyboardInterrupt:
+        print('{} records lost'.format(reader.lost))
+
+
+if __name__ == '__main__':
+    main()
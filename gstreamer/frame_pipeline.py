@@ -0,0 +1,350 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+The frame queueing and inference workers of a pipeline, apart from where the
+frames come from.
+
+FramePipeline is fed by the appsink of a GStreamer pipeline in gstreamer.py
+and by a capture file in capture.py. It doesn't import the GStreamer Python
+bindings, so replaying a capture works without them.
+"""
+import collections
+import queue
+import threading
+import time
+
+import metrics
+
+# Sinks of the display branch of gstreamer.PipelineBuilder: ximagesink needs one
+# more colour conversion than glimagesink, which takes the overlay's BGRA as is.
+DISPLAYS = ('ximage', 'gl', 'none')
+
+# Passed down the stage queues to shut down staged workers.
+_STOP = object()
+
+class StreamStats:
+    """Frame counters of one stream, updated under the pipeline's condition."""
+    def __init__(self):
+        self.received = 0   # Frames delivered by the appsink.
+        self.processed = 0  # Frames handed to inference.
+        self.dropped = 0    # Frames overwritten before inference picked them up.
+        self.late = 0       # Frames discarded for missing the deadline.
+        # Capture to result latencies of the most recent frames, in seconds.
+        self.latencies = collections.deque(maxlen=1000)
+        self.last_time = time.monotonic()
+        self.last_processed = 0
+
+    def fps(self):
+        """Returns processed frames per second since the previous call."""
+        now = time.monotonic()
+        fps = (self.processed - self.last_processed) / max(now - self.last_time, 1e-6)
+        self.last_time, self.last_processed = now, self.processed
+        return fps
+
+    def latency(self, q):
+        """Returns the q-quantile of the recent latencies in seconds, 0 without any."""
+        latencies = sorted(self.latencies)
+        return latencies[min(int(q * len(latencies)), len(latencies) - 1)] if latencies else 0.0
+
+    def __str__(self):
+        return ('fps: {:.1f} received: {} processed: {} dropped: {} late: {} '
+                'latency p50: {:.1f} ms p99: {:.1f} ms').format(
+            self.fps(), self.received, self.processed, self.dropped, self.late,
+            1000 * self.latency(0.5), 1000 * self.latency(0.99))
+
+
+class FramePipeline:
+    """Runs user_function on queued frames and shows its SVG result.
+
+    user_function is either a single callable or, for a staged pipeline, a
+    sequence of callables. The first stage is called like a single
+    user_function, each later stage is called with the previous stage's
+    result and the last stage returns the SVG. Every stage runs on its own
+    thread, connected by queues of at most pipeline_depth results, so that
+    e.g. the next frame is invoked on the Edge TPU while the current one is
+    tracked and rendered. Stages are single threaded, so results stay in
+    frame order. An intermediate stage may return None to drop the frame.
+
+    When several pipelines share a StreamScheduler, the scheduler's workers
+    call user_function instead and the pipelines share its condition.
+
+    Frames wait for inference in a ring of up to max_pending frames, which
+    drops the oldest when full; a headless pipeline holds back its source
+    instead and processes every frame. With a batch_size above 1 the first
+    stage (or user_function) is called with a list of up to that many frames'
+    arguments as for StreamScheduler, at most batch_wait seconds after the
+    first of them was ready, and returns a list with one result per frame.
+
+    Every frame carries its capture time through all stages; the time from
+    capture to the result being shown is recorded per frame. With a deadline
+    (in seconds), frames that are already older than that when inference
+    would pick them up are discarded instead.
+
+    warmup is called before the source starts. The first result shown
+    finishes the startup timer, if given.
+
+    If a stage raises, the pipeline stops: the exception is kept in error,
+    later stages drain their queues so no stage blocks, and run() re-raises
+    it once the workers are done.
+
+    Subclasses feed frames with add_frame(), provide get_box() and may show
+    results in display().
+    """
+    def __init__(self, user_function, src_size, mot_tracker, pipeline_depth=1,
+                 condition=None, name=None, headless=False, deadline=0,
+                 max_pending=1, batch_size=1, batch_wait=0, warmup=None, startup=None):
+        self.user_function = user_function
+        self.pipeline_depth = pipeline_depth
+        self.headless = headless
+        self.running = False
+        # First exception raised by a stage, re-raised by stop_workers().
+        self.error = None
+        # (frame, capture_time) of the frames waiting for inference.
+        self.pending = collections.deque()
+        self.max_pending = max(max_pending, batch_size)
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.deadline = deadline
+        self.warmup = warmup
+        self.startup = startup
+        self.src_size = src_size
+        self.condition = condition or threading.Condition()
+        self.name = name
+        self.stats = StreamStats()
+        self.mot_tracker = mot_tracker
+        self.setup_metrics()
+
+    def setup_metrics(self):
+        stream = self.name or '0'
+        registry = metrics.REGISTRY
+        registry.counter('frames_received_total', 'Frames delivered by the appsink.',
+                         fn=lambda: self.stats.received, stream=stream)
+        registry.counter('frames_processed_total', 'Frames handed to inference.',
+                         fn=lambda: self.stats.processed, stream=stream)
+        registry.counter('frames_overwritten_total',
+                         'Frames replaced by a newer one before inference picked them up.',
+                         fn=lambda: self.stats.dropped, stream=stream)
+        registry.counter('frames_late_total', 'Frames discarded for missing the deadline.',
+                         fn=lambda: self.stats.late, stream=stream)
+        self.frame_interval = registry.histogram(
+            'frame_interval_seconds', 'Time between frames arriving at the appsink.',
+            stream=stream)
+        self.wait_latency = registry.histogram(
+            'frame_wait_seconds', 'Time from capture until inference picks up a frame.',
+            stream=stream)
+        self.latency = registry.histogram(
+            'frame_latency_seconds', 'Time from capture until the result of a frame is shown.',
+            stream=stream)
+        self.last_arrival = None
+
+    def start_workers(self):
+        """Starts and returns the inference worker(s)."""
+        self.running = True
+        if callable(self.user_function):
+            workers = [threading.Thread(target=self.inference_loop)]
+        else:
+            workers = self.start_stages(self.user_function)
+        for worker in workers:
+            worker.start()
+        return workers
+
+    def stop_workers(self, workers):
+        """Stops the workers once a headless pipeline's pending frames are done.
+
+        Raises the exception a stage failed with, if any.
+        """
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+        for worker in workers:
+            worker.join()
+        if self.error is not None:
+            raise self.error
+
+    def fail(self, error):
+        """Stops the pipeline after a stage raised error."""
+        with self.condition:
+            if self.error is None:
+                self.error = error
+            self.running = False
+            self.pending.clear()
+            self.condition.notify_all()
+        self.quit()
+
+    def quit(self):
+        """Ends run() early, subclasses that run a main loop quit it."""
+
+    def add_frame(self, frame, capture_time):
+        """Queues a frame for inference, e.g. a Gst.Buffer.
+
+        A headless pipeline waits for room in the ring, others drop the oldest
+        frame.
+        """
+        now = time.monotonic()
+        if self.last_arrival:
+            self.frame_interval.observe(now - self.last_arrival)
+        self.last_arrival = now
+        with self.condition:
+            while self.headless and len(self.pending) >= self.max_pending and self.running:
+                self.condition.wait()
+            if self.error is not None:
+                return
+            self.stats.received += 1
+            if len(self.pending) >= self.max_pending:
+                # The oldest frame was never picked up by inference.
+                self.pending.popleft()
+                self.stats.dropped += 1
+            self.pending.append((frame, capture_time))
+            self.condition.notify_all()
+
+    def take_buffer(self):
+        """Takes the oldest pending frame, with the condition held.
+
+        Returns (gstbuffer, capture_time), or (None, None) if the frame missed
+        the deadline.
+        """
+        gstbuffer, capture_time = self.pending.popleft()
+        # Wake up a headless appsink callback waiting for the slot.
+        self.condition.notify_all()
+        wait = time.monotonic() - capture_time
+        if self.deadline and wait > self.deadline:
+            self.stats.late += 1
+            return None, None
+        self.stats.processed += 1
+        self.wait_latency.observe(wait)
+        return gstbuffer, capture_time
+
+    def next_frames(self):
+        """Waits for the next batch of frames, returns [(gstbuffer, capture_time)].
+
+        Returns an empty list once stopped.
+        """
+        frames = []
+        deadline = None
+        with self.condition:
+            while len(frames) < self.batch_size:
+                if not self.running and not self.headless:
+                    break
+                if self.pending:
+                    gstbuffer, capture_time = self.take_buffer()
+                    if gstbuffer is not None:
+                        frames.append((gstbuffer, capture_time))
+                    continue
+                if not self.running or (frames and not self.batch_wait):
+                    break
+                if frames and deadline is None:
+                    deadline = time.monotonic() + self.batch_wait
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    break
+                self.condition.wait(timeout)
+        return frames
+
+    def call_first_stage(self, stage, frames):
+        """Runs stage on frames, returns [(result, capture_time)] in frame order."""
+        args = [(gstbuffer, self.src_size, self.get_box(), self.mot_tracker)
+                for gstbuffer, _ in frames]
+        if self.batch_size == 1:
+            results = [stage(*args[0])]
+        else:
+            results = stage(args)
+        return [(result, capture_time) for result, (_, capture_time) in zip(results, frames)]
+
+    def show(self, svg, capture_time):
+        latency = time.monotonic() - capture_time
+        self.latency.observe(latency)
+        with self.condition:
+            self.stats.latencies.append(latency)
+        if self.startup:
+            self.startup.finish()
+            self.startup = None
+        if svg:
+            self.display(svg)
+
+    def display(self, svg):
+        """Shows an SVG result, results are only counted without a display."""
+
+    def inference_loop(self):
+        try:
+            while True:
+                frames = self.next_frames()
+                if not frames:
+                    break
+
+                # Passing Gst.Buffer as input tensor avoids 2 copies of it:
+                # * Python bindings copies the data when mapping gstbuffer
+                # * Numpy copies the data when creating ndarray.
+                # This requires a recent version of the python3-edgetpu package. If this
+                # raises an exception please make sure dependencies are up to date.
+                for svg, capture_time in self.call_first_stage(self.user_function, frames):
+                    self.show(svg, capture_time)
+        except Exception as e:
+            self.fail(e)
+
+    def start_stages(self, stages):
+        """Returns one (unstarted) worker thread per stage, chained by queues."""
+        queues = [queue.Queue(maxsize=self.pipeline_depth) for _ in stages[1:]]
+        for i, q in enumerate(queues):
+            metrics.REGISTRY.gauge('stage_queue_size', 'Results queued before a pipeline stage.',
+                                   fn=q.qsize, stream=self.name or '0', stage=i + 1)
+        workers = [threading.Thread(target=self.first_stage_loop,
+                                    args=(stages[0], queues[0] if queues else None))]
+        for i, stage in enumerate(stages[1:]):
+            outbox = queues[i + 1] if i + 1 < len(queues) else None
+            workers.append(threading.Thread(target=self.stage_loop,
+                                            args=(stage, queues[i], outbox)))
+        return workers
+
+    def first_stage_loop(self, stage, outbox):
+        try:
+            while True:
+                frames = self.next_frames()
+                if not frames:
+                    break
+                for result, capture_time in self.call_first_stage(stage, frames):
+                    if outbox is None:
+                        self.show(result, capture_time)
+                    elif result is not None:
+                        # Blocks while the later stages are behind, the pending
+                        # ring then keeps only the newest frames as in the serial loop.
+                        outbox.put((result, capture_time))
+        except Exception as e:
+            self.fail(e)
+        finally:
+            # Later stages drain their inbox until _STOP, so this can't block forever.
+            if outbox is not None:
+                outbox.put(_STOP)
+
+    def stage_loop(self, stage, inbox, outbox):
+        try:
+            while True:
+                item = inbox.get()
+                if item is _STOP:
+                    break
+                if self.error is not None:
+                    # Keep draining, so that earlier stages never block on a full queue.
+                    continue
+                try:
+                    item, capture_time = item
+                    result = stage(item)
+                    if outbox is None:
+                        self.show(result, capture_time)
+                    elif result is not None:
+                        outbox.put((result, capture_time))
+                except Exception as e:
+                    self.fail(e)
+        finally:
+            if outbox is not None:
+                outbox.put(_STOP)
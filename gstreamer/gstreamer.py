@@ -12,33 +12,250 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import metrics
+import os
 import sys
-import svgwrite
 import threading
-from tracker import ObjectTracker
+import time
+import tracker
+from frame_pipeline import DISPLAYS, FramePipeline
 
 import gi
 gi.require_version('Gst', '1.0')
-gi.require_version('GstBase', '1.0')
-gi.require_version('Gtk', '3.0')
-from gi.repository import GLib, GObject, Gst, GstBase, Gtk
+from gi.repository import GLib, GObject, Gst
+
+# Imported by init() for pipelines with a display only.
+Gtk = None
+
+# Longest wait for a file source to preroll before starting to play anyway.
+PREROLL_TIMEOUT = 5 * Gst.SECOND
+
+def init(gui=True):
+    """Initializes GStreamer and, if gui, imports GTK. Safe to call more than once.
+
+    Deferred from import time, so headless runs never load GTK and callers can
+    load the model meanwhile.
+    """
+    global Gtk
+    if not Gst.is_initialized():
+        GObject.threads_init()
+        Gst.init(None)
+    if gui and Gtk is None:
+        gi.require_version('Gtk', '3.0')
+        from gi.repository import Gtk
+
+def _play(pipelines, warmup=None, startup=None):
+    """Sets the Gst.Pipelines to PLAYING, calling warmup while they preroll.
+
+    warmup, e.g. a first invoke of the model, then overlaps with opening the
+    sources and decoding the first frame instead of delaying the first result.
+    """
+    startup = startup or metrics.StartupTimer()
+    for pipeline in pipelines:
+        pipeline.set_state(Gst.State.PAUSED)
+    if warmup:
+        with startup.phase('warm-up'):
+            warmup()
+    with startup.phase('preroll'):
+        for pipeline in pipelines:
+            pipeline.get_state(PREROLL_TIMEOUT)
+    for pipeline in pipelines:
+        pipeline.set_state(Gst.State.PLAYING)
+
+class StreamScheduler:
+    """Shares inference workers fairly between several GstPipelines.
+
+    Each worker runs its own user_function, typically bound to its own
+    interpreter. Streams are served round-robin, oldest pending frame first,
+    and a stream is never handed to two workers at once so its tracker sees
+    frames in order.
+
+    With a batch_size above 1, a worker collects up to that many pending
+    frames across streams, waiting at most batch_wait seconds after the first,
+    and calls user_function once with the list of their
+    (gstbuffer, src_size, inference_box, mot_tracker) arguments; it returns
+    the list of SVGs.
+
+    Without gui the pipelines run on a GLib main loop instead of GTK. A
+    stream that fails is stopped like one that ended, and the scheduler
+    quits once no stream is left. If user_function raises, the scheduler
+    stops all streams and run() re-raises the first exception.
+    """
+    def __init__(self, user_functions, batch_size=1, batch_wait=0, gui=True):
+        self.user_functions = user_functions
+        self.main_loop = None if gui else GLib.MainLoop()
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.condition = threading.Condition()
+        self.pipelines = []
+        self.busy = set()
+        self.next_index = 0
+        self.running = False
+        # First exception raised by a worker, re-raised by run().
+        self.error = None
 
-GObject.threads_init()
-Gst.init(None)
+    def next_frames(self):
+        """Waits for frames of ready streams, returns [(pipeline, gstbuffer, capture_time)].
 
-class GstPipeline:
-    def __init__(self, pipeline, user_function, src_size, mot_tracker):
-        self.user_function = user_function
-        self.running = False
-        self.gstbuffer = None
+        Returns an empty list once stopped.
+        """
+        frames = []
+        taken = set()
+        deadline = None
+        with self.condition:
+            while self.running and len(frames) < self.batch_size:
+                for i in range(len(self.pipelines)):
+                    index = (self.next_index + i) % len(self.pipelines)
+                    pipeline = self.pipelines[index]
+                    if pipeline in self.busy and pipeline not in taken:
+                        continue
+                    while pipeline.pending and len(frames) < self.batch_size:
+                        gstbuffer, capture_time = pipeline.take_buffer()
+                        if gstbuffer is not None:
+                            frames.append((pipeline, gstbuffer, capture_time))
+                    if frames and frames[-1][0] is pipeline:
+                        self.next_index = index + 1
+                        self.busy.add(pipeline)
+                        taken.add(pipeline)
+                    if len(frames) == self.batch_size:
+                        break
+                if len(frames) == self.batch_size:
+                    break
+                if frames and not self.batch_wait:
+                    break
+                if frames and deadline is None:
+                    deadline = time.monotonic() + self.batch_wait
+                timeout = None if deadline is None else deadline - time.monotonic()
+                if timeout is not None and timeout <= 0:
+                    break
+                self.condition.wait(timeout)
+            return frames
+
+    def worker_loop(self, user_function):
+        while True:
+            frames = self.next_frames()
+            if not frames:
+                break
+            try:
+                args = [(gstbuffer, pipeline.src_size, pipeline.get_box(), pipeline.mot_tracker)
+                        for pipeline, gstbuffer, _ in frames]
+                if self.batch_size == 1:
+                    svgs = [user_function(*args[0])]
+                else:
+                    svgs = user_function(args)
+                for (pipeline, _, capture_time), svg in zip(frames, svgs):
+                    pipeline.show(svg, capture_time)
+            except Exception as e:
+                self.fail(e)
+            finally:
+                with self.condition:
+                    for pipeline, _, _ in frames:
+                        self.busy.discard(pipeline)
+                    self.condition.notify_all()
+
+    def fail(self, error):
+        """Stops all streams after a worker raised error."""
+        with self.condition:
+            if self.error is None:
+                self.error = error
+            self.running = False
+            self.condition.notify_all()
+        self.quit()
+
+    def on_eos(self, pipeline):
+        self.remove(pipeline, 'end of stream')
+
+    def on_error(self, pipeline):
+        self.remove(pipeline, 'stopped after an error')
+
+    def remove(self, pipeline, reason):
+        pipeline.pipeline.set_state(Gst.State.NULL)
+        print('{}: {}'.format(pipeline.name, reason))
+        with self.condition:
+            if pipeline in self.pipelines:
+                self.pipelines.remove(pipeline)
+            if not self.pipelines:
+                self.quit()
+
+    def quit(self):
+        # Also called from the workers by fail(), see GstPipeline.quit().
+        GLib.idle_add(self.main_loop.quit if self.main_loop else Gtk.main_quit)
+
+    def print_stats(self):
+        with self.condition:
+            for pipeline in self.pipelines:
+                print('{}: {}'.format(pipeline.name, pipeline.stats))
+        return True
+
+    def run(self, stats_interval=0, warmup=None, startup=None):
+        pipelines = list(self.pipelines)
+        self.running = True
+        workers = [threading.Thread(target=self.worker_loop, args=(f,))
+                   for f in self.user_functions]
+        for worker in workers:
+            worker.start()
+        if stats_interval:
+            GLib.timeout_add_seconds(stats_interval, self.print_stats)
+
+        try:
+            # Run pipelines.
+            _play([pipeline.pipeline for pipeline in pipelines], warmup, startup)
+            try:
+                if self.main_loop:
+                    self.main_loop.run()
+                else:
+                    Gtk.main()
+            except:
+                pass
+        finally:
+            # Clean up, also if warmup failed.
+            for pipeline in pipelines:
+                pipeline.pipeline.set_state(Gst.State.NULL)
+            while GLib.MainContext.default().iteration(False):
+                pass
+            with self.condition:
+                self.running = False
+                self.condition.notify_all()
+            for worker in workers:
+                worker.join()
+        for pipeline in pipelines:
+            print('{}: {}'.format(pipeline.name, pipeline.stats))
+        if self.error is not None:
+            raise self.error
+
+class GstPipeline(FramePipeline):
+    """FramePipeline fed by the appsink of a GStreamer pipeline.
+
+    Results are drawn by its rsvgoverlay or glsvgoverlaysink. A pipeline
+    without a display branch runs without GTK. A headless pipeline never
+    drops frames: the appsink callback waits until inference has picked up
+    the previous frame, which holds back the decoder, and the last frame is
+    still processed at EOS.
+
+    The capture time of a frame is estimated from its buffer timestamp and
+    the pipeline clock. warmup is called while the pipeline prerolls, before
+    it starts playing. With a recorder (see capture.py), every frame
+    delivered by the appsink is also recorded.
+
+    on_eos and on_error are called with the pipeline at the end of the stream
+    and after an error; both default to quitting run().
+    """
+    def __init__(self, pipeline, user_function, src_size, mot_tracker, pipeline_depth=1,
+                 condition=None, on_eos=None, name=None, headless=False, deadline=0,
+                 max_pending=1, batch_size=1, batch_wait=0, warmup=None, startup=None,
+                 recorder=None, on_error=None):
+        super().__init__(user_function, src_size, mot_tracker, pipeline_depth, condition, name,
+                         headless, deadline, max_pending, batch_size, batch_wait, warmup, startup)
         self.sink_size = None
-        self.src_size = src_size
         self.box = None
-        self.condition = threading.Condition()
-        self.mot_tracker = mot_tracker
+        self.on_eos = on_eos or (lambda pipeline: pipeline.quit())
+        self.on_error = on_error or (lambda pipeline: pipeline.quit())
+        self.recorder = recorder
         self.pipeline = Gst.parse_launch(pipeline)
         self.overlay = self.pipeline.get_by_name('overlay')
         self.overlaysink = self.pipeline.get_by_name('overlaysink')
+        # Set by run(); a StreamScheduler runs the loop of scheduled pipelines.
+        self.main_loop = None
         appsink = self.pipeline.get_by_name('appsink')
         appsink.connect('new-sample', self.on_new_sample)
 
@@ -47,42 +264,61 @@ class GstPipeline:
         bus.add_signal_watch()
         bus.connect('message', self.on_bus_message)
 
+        self.setup_queue_metrics()
+
         # Set up a full screen window on Coral, no-op otherwise.
         self.setup_window()
 
+    def setup_queue_metrics(self):
+        # Leaky queues drop a buffer every time they overrun.
+        for element in self.pipeline.iterate_elements():
+            factory = element.get_factory()
+            if factory and factory.get_name() == 'queue' and int(element.get_property('leaky')):
+                counter = metrics.REGISTRY.counter('frames_dropped_queue_total',
+                                                   'Frames dropped by a leaky queue.',
+                                                   stream=self.name or '0',
+                                                   queue=element.get_name())
+                element.connect('overrun', lambda queue, counter=counter: counter.inc())
+
     def run(self):
-        # Start inference worker.
-        self.running = True
-        worker = threading.Thread(target=self.inference_loop)
-        worker.start()
+        workers = self.start_workers()
+        # GTK only runs the display.
+        if not (self.overlay or self.overlaysink):
+            self.main_loop = GLib.MainLoop()
 
-        # Run pipeline.
-        self.pipeline.set_state(Gst.State.PLAYING)
         try:
-            Gtk.main()
-        except:
-            pass
-
-        # Clean up.
-        self.pipeline.set_state(Gst.State.NULL)
-        while GLib.MainContext.default().iteration(False):
-            pass
-        with self.condition:
-            self.running = False
-            self.condition.notify_all()
-        worker.join()
+            # Run pipeline.
+            _play([self.pipeline], self.warmup, self.startup)
+            try:
+                if self.main_loop:
+                    self.main_loop.run()
+                else:
+                    Gtk.main()
+            except:
+                pass
+        finally:
+            # Clean up, also if warmup failed.
+            self.pipeline.set_state(Gst.State.NULL)
+            while GLib.MainContext.default().iteration(False):
+                pass
+            self.stop_workers(workers)
+
+    def quit(self):
+        # Also called from the workers by fail(). Quitting from an idle callback
+        # keeps GTK on its own thread and isn't lost if the loop hasn't started.
+        GLib.idle_add(self.main_loop.quit if self.main_loop else Gtk.main_quit)
 
     def on_bus_message(self, bus, message):
         t = message.type
         if t == Gst.MessageType.EOS:
-            Gtk.main_quit()
+            self.on_eos(self)
         elif t == Gst.MessageType.WARNING:
             err, debug = message.parse_warning()
             sys.stderr.write('Warning: %s: %s\n' % (err, debug))
         elif t == Gst.MessageType.ERROR:
             err, debug = message.parse_error()
             sys.stderr.write('Error: %s: %s\n' % (err, debug))
-            Gtk.main_quit()
+            self.on_error(self)
         return True
 
     def on_new_sample(self, sink):
@@ -90,11 +326,29 @@ class GstPipeline:
         if not self.sink_size:
             s = sample.get_caps().get_structure(0)
             self.sink_size = (s.get_value('width'), s.get_value('height'))
-        with self.condition:
-            self.gstbuffer = sample.get_buffer()
-            self.condition.notify_all()
+            if self.recorder:
+                self.recorder.open(self.sink_size, self.get_box(), self.src_size)
+        capture_time = self.get_capture_time(sample, time.monotonic())
+        if self.recorder:
+            self.recorder.write(sample.get_buffer(), capture_time)
+        self.add_frame(sample.get_buffer(), capture_time)
         return Gst.FlowReturn.OK
 
+    def get_capture_time(self, sample, now):
+        """Returns the time.monotonic() at which the sample was captured.
+
+        That is its arrival time, less how far the pipeline clock has run past
+        the buffer timestamp. Without a clock or a timestamp, or headless where
+        the clock doesn't pace the pipeline, it is the arrival time.
+        """
+        pts = sample.get_buffer().pts
+        clock = self.pipeline.get_clock()
+        if self.headless or clock is None or pts == Gst.CLOCK_TIME_NONE:
+            return now
+        running_time = sample.get_segment().to_running_time(Gst.Format.TIME, pts)
+        age = (clock.get_time() - self.pipeline.get_base_time() - running_time) / Gst.SECOND
+        return now - max(age, 0.0)
+
     def get_box(self):
         if not self.box:
             glbox = self.pipeline.get_by_name('glbox')
@@ -112,28 +366,11 @@ class GstPipeline:
                     self.sink_size[1] + box.get_property('top') + box.get_property('bottom'))
         return self.box
 
-    def inference_loop(self):
-        while True:
-            with self.condition:
-                while not self.gstbuffer and self.running:
-                    self.condition.wait()
-                if not self.running:
-                    break
-                gstbuffer = self.gstbuffer
-                self.gstbuffer = None
-
-            # Passing Gst.Buffer as input tensor avoids 2 copies of it:
-            # * Python bindings copies the data when mapping gstbuffer
-            # * Numpy copies the data when creating ndarray.
-            # This requires a recent version of the python3-edgetpu package. If this
-            # raises an exception please make sure dependencies are up to date.
-            input_tensor = gstbuffer
-            svg = self.user_function(input_tensor, self.src_size, self.get_box(), self.mot_tracker)
-            if svg:
-                if self.overlay:
-                    self.overlay.set_property('data', svg)
-                if self.overlaysink:
-                    self.overlaysink.set_property('svg', svg)
+    def display(self, svg):
+        if self.overlay:
+            self.overlay.set_property('data', svg)
+        if self.overlaysink:
+            self.overlaysink.set_property('svg', svg)
 
     def setup_window(self):
         # Only set up our own window if we have Coral overlay sink in the pipeline.
@@ -202,75 +439,224 @@ def detectCoralDevBoard():
   except: pass
   return False
 
+def make_mot_tracker(trackerName):
+    """Returns a new multi-object tracker of the given name, or None without a name."""
+    if trackerName is None:
+        return None
+    return tracker.make_tracker(trackerName)
+
+# Jitter buffer of RTSP sources in ms, the default of 2 s delays every frame as much.
+RTSP_LATENCY_MS = 100
+
+class PipelineBuilder:
+    """Builds the gst-launch description of the pipeline for one source.
+
+    The pipeline is put together element by element, with caps between them
+    so that each branch scales and converts every frame at most once: the
+    inference branch scales in the source's own format first and converts
+    only the scaled frame to RGB, and the display branch converts once to
+    the BGRA rsvgoverlay draws on. Encoded sources are decoded before the
+    branches split. display picks the sink of the display branch, 'none'
+    leaves it out; on the Coral Dev Board both branches run on the GPU.
+
+    A headless pipeline has no display branch, no rate limiting and no leaky
+    queues, and its appsink doesn't drop or sync to the clock, so files are
+    decoded as fast as inference consumes the frames.
+
+    conversions lists the scalings and colour conversions done on the CPU for
+    every frame, as (element, (width, height) of its input).
+    """
+    def __init__(self, src_size, appsink_size, videosrc, videofmt='raw', headless=False,
+                 display='ximage'):
+        if display not in DISPLAYS:
+            raise ValueError('Unknown display {}, expected one of {}'.format(display, DISPLAYS))
+        self.src_size = src_size
+        self.appsink_size = appsink_size
+        self.videosrc = videosrc
+        self.videofmt = videofmt
+        self.headless = headless
+        self.display = 'none' if headless else display
+        self.coral = not headless and detectCoralDevBoard()
+        # Threads for elements that work on full size frames.
+        self.threads = min(4, os.cpu_count() or 1)
+        self.conversions = []
+
+    def queue(self):
+        """Returns a branch queue, keeping only the newest frame on the CPU path."""
+        if self.headless or self.coral:
+            return 'queue'
+        return 'queue max-size-buffers=1 leaky=downstream'
+
+    def scaled_size(self):
+        """Returns the src_size scaled to fit the appsink, keeping the aspect ratio."""
+        scale = min(self.appsink_size[0] / self.src_size[0], self.appsink_size[1] / self.src_size[1])
+        return tuple(int(x * scale) for x in self.src_size)
+
+    def source(self):
+        """Returns the elements delivering raw video from the source."""
+        width, height = self.src_size
+        src_format = {'h264': 'video/x-h264', 'jpeg': 'image/jpeg'}.get(self.videofmt, 'video/x-raw')
+        src_caps = '{},width={},height={},framerate=30/1'.format(src_format, width, height)
+        encoded = self.videofmt != 'raw'
+        videosrc = self.videosrc
+        if videosrc.startswith('/dev/video'):
+            elements = ['v4l2src device=%s' % videosrc, src_caps]
+        elif videosrc.startswith('http'):
+            elements, encoded = ['souphttpsrc location=%s' % videosrc], True
+        elif videosrc.startswith('rtsp'):
+            elements = ['rtspsrc location=%s latency=%d' % (videosrc, RTSP_LATENCY_MS)]
+            encoded = True
+        elif videosrc.startswith('videotestsrc'):
+            # Synthetic source, e.g. 'videotestsrc pattern=ball num-buffers=300'.
+            elements = [videosrc, src_caps]
+        else:
+            demux = 'avidemux' if videosrc.endswith('avi') else 'qtdemux'
+            elements = ['filesrc location=%s' % videosrc, '%s name=demux demux.video_0' % demux,
+                        'queue', 'decodebin']
+            # Headless files keep every frame, but still scale it: boxes are mapped to src_size.
+            caps = 'video/x-raw,width={},height={}'.format(width, height)
+            if not self.headless:
+                elements.append('videorate')
+                caps += ',framerate=30/1'
+            return elements + self.scale_to_src_size(caps)
+        if encoded or self.coral:
+            elements.append('decodebin')
+        if videosrc.startswith(('http', 'rtsp')):
+            # Streams arrive in whatever size they were encoded at.
+            elements += self.scale_to_src_size()
+        return elements
+
+    def scale_to_src_size(self, caps=None):
+        """Returns the elements scaling decoded frames of any size to src_size.
+
+        The frames are scaled in the decoder's format, the branches convert them.
+        """
+        self.conversions.append(('videoscale', None))
+        return ['videoscale n-threads=%d' % self.threads,
+                caps or 'video/x-raw,width={},height={}'.format(*self.src_size)]
+
+    def appsink(self):
+        if self.headless:
+            return 'appsink name=appsink emit-signals=true max-buffers=1 drop=false sync=false'
+        return 'appsink name=appsink emit-signals=true max-buffers=1 drop=true'
+
+    def inference_branch(self):
+        """Returns the elements turning raw video into RGB frames for the appsink."""
+        sink_caps = 'video/x-raw,format=RGB,width={},height={}'.format(*self.appsink_size)
+        if self.coral:
+            return ['glfilterbin filter=glbox name=glbox', sink_caps, self.appsink()]
+        scaled = self.scaled_size()
+        self.conversions += [('videoscale', self.src_size), ('videoconvert', scaled)]
+        return ['videoscale n-threads=%d' % self.threads,
+                'video/x-raw,width={},height={}'.format(*scaled),
+                'videoconvert', 'videobox name=box autocrop=true', sink_caps, self.appsink()]
+
+    def display_branch(self):
+        """Returns the elements drawing the SVG overlay on the source video."""
+        if self.coral:
+            return ['glsvgoverlaysink name=overlaysink']
+        elements = ['videoconvert n-threads=%d' % self.threads, 'rsvgoverlay name=overlay']
+        self.conversions.append(('videoconvert', self.src_size))
+        if self.display == 'gl':
+            return elements + ['glimagesink sync=false']
+        self.conversions.append(('videoconvert', self.src_size))
+        return elements + ['videoconvert n-threads=%d' % self.threads, 'ximagesink sync=false']
+
+    def build(self):
+        """Returns the gst-launch description and fills in conversions."""
+        self.conversions = []
+        source = self.source()
+        if self.coral:
+            source.append('glupload')
+        if self.display == 'none':
+            return ' ! '.join(source + self.inference_branch())
+        return '{} ! tee name=t\n  t. ! {}\n  t. ! {}'.format(
+            ' ! '.join(source),
+            ' ! '.join([self.queue()] + self.inference_branch()),
+            ' ! '.join([self.queue()] + self.display_branch()))
+
+    def summary(self):
+        """Returns a line counting the per-frame conversions of the last build()."""
+        if not self.conversions:
+            return 'No scaling or colour conversion on the CPU.'
+        return 'Scaling and colour conversions on the CPU per frame: {} ({})'.format(
+            len(self.conversions), ', '.join(
+                '{} of {}'.format(element, '{}x{}'.format(*size) if size else 'the decoded frame')
+                for element, size in self.conversions))
+
 def run_pipeline(user_function,
                  src_size,
                  appsink_size,
                  trackerName,
                  videosrc='/dev/video1',
-                 videofmt='raw'):
-    objectOfTracker = None
-    if videofmt == 'h264':
-        SRC_CAPS = 'video/x-h264,width={width},height={height},framerate=30/1'
-    elif videofmt == 'jpeg':
-        SRC_CAPS = 'image/jpeg,width={width},height={height},framerate=30/1'
-    else:
-        SRC_CAPS = 'video/x-raw,width={width},height={height},framerate=30/1'
-    if videosrc.startswith('/dev/video'):
-        PIPELINE = 'v4l2src device=%s ! {src_caps}'%videosrc
-    elif videosrc.startswith('http'):
-        PIPELINE = 'souphttpsrc location=%s'%videosrc
-    elif videosrc.startswith('rtsp'):
-        PIPELINE = 'rtspsrc location=%s'%videosrc
-    else:
-        demux =  'avidemux' if videosrc.endswith('avi') else 'qtdemux'
-        PIPELINE = """filesrc location=%s ! %s name=demux  demux.video_0
-                    ! queue ! decodebin  ! videorate
-                    ! videoconvert n-threads=4 ! videoscale n-threads=4
-                    ! {src_caps} ! {leaky_q} """ % (videosrc, demux)
-    ''' Check for the object tracker.'''
-    if trackerName != None:
-        if trackerName == 'mediapipe':
-            if detectCoralDevBoard():
-                objectOfTracker = ObjectTracker('mediapipe')
-            else:
-                print("Tracker MediaPipe is only available on the Dev Board. Keeping the tracker as None")
-                trackerName = None
-        else:
-            objectOfTracker = ObjectTracker(trackerName)
-    else:
-        pass
-
-    if detectCoralDevBoard():
-        scale_caps = None
-        PIPELINE += """ ! decodebin ! glupload ! tee name=t
-            t. ! queue ! glfilterbin filter=glbox name=glbox ! {sink_caps} ! {sink_element}
-            t. ! queue ! glsvgoverlaysink name=overlaysink
-        """
-    else:
-        scale = min(appsink_size[0] / src_size[0], appsink_size[1] / src_size[1])
-        scale = tuple(int(x * scale) for x in src_size)
-        scale_caps = 'video/x-raw,width={width},height={height}'.format(width=scale[0], height=scale[1])
-        PIPELINE += """ ! tee name=t
-            t. ! {leaky_q} ! videoconvert ! videoscale ! {scale_caps} ! videobox name=box autocrop=true
-               ! {sink_caps} ! {sink_element}
-            t. ! {leaky_q} ! videoconvert
-               ! rsvgoverlay name=overlay ! videoconvert ! ximagesink sync=false
-            """
-    if objectOfTracker:
-        mot_tracker = objectOfTracker.trackerObject.mot_tracker
-    else:
-        mot_tracker = None
-    SINK_ELEMENT = 'appsink name=appsink emit-signals=true max-buffers=1 drop=true'
-    SINK_CAPS = 'video/x-raw,format=RGB,width={width},height={height}'
-    LEAKY_Q = 'queue max-size-buffers=1 leaky=downstream'
-
-    src_caps = SRC_CAPS.format(width=src_size[0], height=src_size[1])
-    sink_caps = SINK_CAPS.format(width=appsink_size[0], height=appsink_size[1])
-    pipeline = PIPELINE.format(leaky_q=LEAKY_Q,
-        src_caps=src_caps, sink_caps=sink_caps,
-        sink_element=SINK_ELEMENT, scale_caps=scale_caps)
-
-    print('Gstreamer pipeline:\n', pipeline)
-
-    pipeline = GstPipeline(pipeline, user_function, src_size, mot_tracker)
+                 videofmt='raw',
+                 pipeline_depth=1,
+                 headless=False,
+                 deadline=0,
+                 batch_size=1,
+                 batch_wait=0,
+                 warmup=None,
+                 startup=None,
+                 display='ximage',
+                 recorder=None):
+    startup = startup or metrics.StartupTimer()
+    init(gui=not headless and display != 'none')
+    with startup.phase('build pipeline'):
+        builder = PipelineBuilder(src_size, appsink_size, videosrc, videofmt, headless, display)
+        pipeline = builder.build()
+        print('Gstreamer pipeline:\n', pipeline)
+        print(builder.summary())
+
+        mot_tracker = make_mot_tracker(trackerName)
+        pipeline = GstPipeline(pipeline, user_function, src_size, mot_tracker, pipeline_depth,
+                               headless=headless, deadline=deadline,
+                               batch_size=batch_size, batch_wait=batch_wait,
+                               warmup=warmup, startup=startup, recorder=recorder)
     pipeline.run()
+    return pipeline.stats
+
+def run_pipelines(user_functions,
+                  src_size,
+                  appsink_size,
+                  trackerName,
+                  videosrcs,
+                  videofmt='raw',
+                  stats_interval=10,
+                  deadline=0,
+                  batch_size=1,
+                  batch_wait=0,
+                  warmup=None,
+                  startup=None,
+                  display='ximage',
+                  mot_trackers=None):
+    """Runs one pipeline per source in videosrcs, sharing the inference workers.
+
+    user_functions holds one callable per inference worker, e.g. one per
+    interpreter. Every stream gets its own tracker, a new one of trackerName
+    unless mot_trackers gives the tracker of each source, so that callers can
+    tell the streams apart by the mot_tracker their frames are handed with.
+    Per-stream frame stats are printed every stats_interval seconds (0
+    disables) and on exit.
+    """
+    if mot_trackers is None:
+        mot_trackers = [make_mot_tracker(trackerName) for _ in videosrcs]
+    elif len(mot_trackers) != len(videosrcs):
+        raise ValueError('{} trackers for {} sources'.format(len(mot_trackers), len(videosrcs)))
+    startup = startup or metrics.StartupTimer()
+    gui = display != 'none'
+    init(gui)
+    scheduler = StreamScheduler(user_functions, batch_size, batch_wait, gui)
+    with startup.phase('build pipeline'):
+        for i, (videosrc, mot_tracker) in enumerate(zip(videosrcs, mot_trackers)):
+            builder = PipelineBuilder(src_size, appsink_size, videosrc, videofmt,
+                                      display=display)
+            pipeline = builder.build()
+            print('Gstreamer pipeline {}:\n'.format(i), pipeline)
+            print(builder.summary())
+            scheduler.pipelines.append(GstPipeline(
+                pipeline, None, src_size, mot_tracker,
+                condition=scheduler.condition, on_eos=scheduler.on_eos,
+                on_error=scheduler.on_error,
+                name='stream {} ({})'.format(i, videosrc), deadline=deadline,
+                max_pending=batch_size, startup=startup))
+    scheduler.run(stats_interval, warmup, startup)
@@ -50,7 +50,7 @@ echo "Note that the trackers have their own licensing, many of which
 are not Apache. Care should be taken if using a tracker with restrictive
 licenses for end applications."
 
-read -p "Install SORT (GPLv3)? " -n 1 -r
+read -p "Install upstream SORT (GPLv3, optional: --tracker sort is built in)? " -n 1 -r
 if [[ $REPLY =~ ^[Yy]$ ]]
 then
     wget https://github.com/abewley/sort/archive/master.zip -O sort.zip
@@ -0,0 +1,233 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Low overhead counters, gauges and histograms for the pipeline, exported in the
+Prometheus text format from a local HTTP endpoint or to a periodically
+rewritten stats file.
+
+Metrics are registered once and then updated on the hot path:
+
+    invoke_time = metrics.REGISTRY.histogram('invoke_seconds', 'Time spent in invoke().')
+    with invoke_time.time():
+        interpreter.invoke()
+
+Counters and gauges can also read their value from a function at export time,
+which costs nothing per frame:
+
+    metrics.REGISTRY.gauge('queue_size', 'Frames queued.', fn=q.qsize, stage='1')
+"""
+import bisect
+import contextlib
+import http.server
+import os
+import threading
+import time
+
+# Latency buckets in seconds, from 0.5 ms to 1 s.
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.002, 0.005, 0.01, 0.02, 0.05, 0.1, 0.2, 0.5, 1.0)
+
+
+def _format_labels(labels, extra=None):
+    items = list(labels.items()) + list((extra or {}).items())
+    if not items:
+        return ''
+    return '{%s}' % ','.join('%s="%s"' % (k, str(v).replace('"', '\\"')) for k, v in items)
+
+
+class Counter:
+    type = 'counter'
+
+    def __init__(self, name, labels, fn=None):
+        self.name = name
+        self.labels = labels
+        self.fn = fn
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def samples(self):
+        yield self.name, _format_labels(self.labels), self.fn() if self.fn else self.value
+
+
+class Gauge(Counter):
+    type = 'gauge'
+
+    def set(self, value):
+        self.value = value
+
+
+class Histogram:
+    type = 'histogram'
+
+    def __init__(self, name, labels, buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.labels = labels
+        self.buckets = tuple(buckets)
+        # The last count is for values above all buckets (le="+Inf").
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.lock = threading.Lock()
+
+    def observe(self, value):
+        i = bisect.bisect_left(self.buckets, value)
+        with self.lock:
+            self.counts[i] += 1
+            self.sum += value
+
+    @contextlib.contextmanager
+    def time(self):
+        start_time = time.monotonic()
+        yield
+        self.observe(time.monotonic() - start_time)
+
+    def samples(self):
+        with self.lock:
+            counts, total = list(self.counts), self.sum
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            le = '+Inf' if bound == float('inf') else repr(bound)
+            yield self.name + '_bucket', _format_labels(self.labels, {'le': le}), cumulative
+        yield self.name + '_sum', _format_labels(self.labels), total
+        yield self.name + '_count', _format_labels(self.labels), cumulative
+
+
+class Registry:
+    """Holds metrics by name and labels and renders them for export.
+
+    Registering the same name and labels twice returns the existing metric.
+    """
+    def __init__(self, prefix='coral_tracker_'):
+        self.prefix = prefix
+        self.families = {}  # name -> (help, type, {labels: metric})
+        self.lock = threading.Lock()
+
+    def _register(self, cls, name, help, labels, **kwargs):
+        name = self.prefix + name
+        key = tuple(sorted(labels.items()))
+        with self.lock:
+            _, _, metrics = self.families.setdefault(name, (help, cls.type, {}))
+            if key not in metrics:
+                metrics[key] = cls(name, labels, **kwargs)
+            return metrics[key]
+
+    def counter(self, name, help, fn=None, **labels):
+        return self._register(Counter, name, help, labels, fn=fn)
+
+    def gauge(self, name, help, fn=None, **labels):
+        return self._register(Gauge, name, help, labels, fn=fn)
+
+    def histogram(self, name, help, buckets=DEFAULT_BUCKETS, **labels):
+        return self._register(Histogram, name, help, labels, buckets=buckets)
+
+    def render(self):
+        """Returns all metrics in the Prometheus text exposition format."""
+        with self.lock:
+            families = [(name, help, type, list(metrics.values()))
+                        for name, (help, type, metrics) in self.families.items()]
+        lines = []
+        for name, help, type, metrics in families:
+            lines.append('# HELP %s %s' % (name, help))
+            lines.append('# TYPE %s %s' % (name, type))
+            for metric in metrics:
+                for sample_name, labels, value in metric.samples():
+                    lines.append('%s%s %s' % (sample_name, labels, value))
+        return '\n'.join(lines) + '\n'
+
+    def serve(self, port, host='127.0.0.1'):
+        """Serves the metrics at http://host:port/metrics from a daemon thread."""
+        registry = self
+
+        class Handler(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                if self.path != '/metrics':
+                    self.send_error(404)
+                    return
+                body = registry.render().encode('utf-8')
+                self.send_response(200)
+                self.send_header('Content-Type', 'text/plain; version=0.0.4')
+                self.send_header('Content-Length', str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = http.server.ThreadingHTTPServer((host, port), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        print('Serving metrics on http://{}:{}/metrics'.format(*server.server_address[:2]))
+        return server
+
+    def write_periodically(self, path, interval):
+        """Rewrites path with the metrics every interval seconds from a daemon thread."""
+        def loop():
+            while True:
+                time.sleep(interval)
+                tmp_path = path + '.tmp'
+                with open(tmp_path, 'w') as f:
+                    f.write(self.render())
+                # Readers never see a partially written file.
+                os.replace(tmp_path, path)
+        threading.Thread(target=loop, daemon=True).start()
+
+
+# Registry shared by all modules of the pipeline.
+REGISTRY = Registry()
+
+
+class StartupTimer:
+    """Times the phases of startup, which may overlap on different threads.
+
+        startup = metrics.StartupTimer()
+        with startup.phase('load model'):
+            interpreter = make_interpreter(model)
+        ...
+        startup.finish()
+
+    finish() prints when each phase started and how long it took, and exports
+    them as startup_phase_seconds gauges, the first time it is called.
+    """
+    def __init__(self):
+        self.start_time = time.monotonic()
+        self.phases = []  # (name, start, duration) in seconds since start_time.
+        self.total = None
+        self.lock = threading.Lock()
+
+    @contextlib.contextmanager
+    def phase(self, name):
+        start_time = time.monotonic()
+        try:
+            yield
+        finally:
+            with self.lock:
+                self.phases.append((name, start_time - self.start_time,
+                                    time.monotonic() - start_time))
+
+    def finish(self, name='first result'):
+        with self.lock:
+            if self.total is not None:
+                return
+            self.total = time.monotonic() - self.start_time
+            phases = sorted(self.phases, key=lambda phase: phase[1])
+        print('Startup: {:.1f} ms to {}'.format(1000 * self.total, name))
+        for phase, start, duration in phases:
+            print('  {:<16} at {:>8.1f} ms took {:>8.1f} ms'.format(
+                phase, 1000 * start, 1000 * duration))
+            REGISTRY.gauge('startup_phase_seconds', 'Time spent in a startup phase.',
+                           phase=phase).set(duration)
+        REGISTRY.gauge('startup_seconds', 'Time from startup to the first result.').set(self.total)
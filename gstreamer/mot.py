@@ -0,0 +1,101 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Writers for per-frame detections and tracks, used by the headless mode of
+detect.py.
+
+MotWriter writes MOTChallenge style CSV, one line per box:
+    frame, id, bb_left, bb_top, bb_width, bb_height, conf, x, y, z
+Frames are numbered from 1 as in MOTChallenge. Tracks carry their track id,
+detections use id -1. The world coordinates x, y, z are always -1. Without a
+tracker the detections are written to the file itself. With one it holds the
+tracks, as a tracker's result file in MOTChallenge, and the detections go to a
+companion file in the layout of MOTChallenge's det.txt, e.g. tracks.det.csv
+next to tracks.csv.
+
+JsonlWriter writes one JSON object per frame with the full detection and track
+arrays.
+
+Boxes are given to both writers as [x, y, w, h] in source pixels.
+"""
+import json
+import numpy as np
+import os
+
+
+class MotWriter:
+    def __init__(self, path, det_path=None):
+        self.file = open(path, 'w')
+        root, ext = os.path.splitext(path)
+        self.det_path = det_path or root + '.det' + ext
+        # Opened on the first frame with tracks.
+        self.det_file = None
+
+    def write(self, frame, detections, tracks=None, track_scores=None):
+        """Writes one frame.
+
+        detections: (N, 6) [x, y, w, h, score, class_id].
+        tracks: (M, 5) [x, y, w, h, track_id] or None without a tracker.
+        track_scores: (M,) scores of the tracks, 1 if not given.
+        """
+        rows = np.full((len(detections), 10), -1.0)
+        rows[:, 0] = frame
+        rows[:, 2:7] = detections[:, :5]
+        if tracks is None:
+            self._write_rows(self.file, rows)
+            return
+        if self.det_file is None:
+            self.det_file = open(self.det_path, 'w')
+        self._write_rows(self.det_file, rows)
+        rows = np.full((len(tracks), 10), -1.0)
+        rows[:, 0] = frame
+        rows[:, 1] = tracks[:, 4]
+        rows[:, 2:6] = tracks[:, :4]
+        rows[:, 6] = 1.0 if track_scores is None else track_scores
+        self._write_rows(self.file, rows)
+
+    @staticmethod
+    def _write_rows(file, rows):
+        np.savetxt(file, rows, delimiter=',',
+                   fmt=['%d', '%d', '%.2f', '%.2f', '%.2f', '%.2f', '%.4f', '%d', '%d', '%d'])
+
+    def close(self):
+        self.file.close()
+        if self.det_file:
+            self.det_file.close()
+
+
+class JsonlWriter:
+    def __init__(self, path):
+        self.file = open(path, 'w')
+
+    def write(self, frame, detections, tracks=None, track_scores=None):
+        record = {'frame': frame,
+                  'detections': np.round(detections, 4).tolist()}
+        if tracks is not None:
+            record['tracks'] = np.round(tracks, 4).tolist()
+            if track_scores is not None:
+                record['track_scores'] = np.round(track_scores, 4).tolist()
+        self.file.write(json.dumps(record) + '\n')
+
+    def close(self):
+        self.file.close()
+
+
+def make_writer(path):
+    """Returns a JsonlWriter for *.jsonl paths and a MotWriter otherwise."""
+    if path.endswith('.jsonl'):
+        return JsonlWriter(path)
+    return MotWriter(path)
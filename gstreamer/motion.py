@@ -0,0 +1,70 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""
+Cheap pre-inference gate that tells whether a frame changed enough since the
+last detected frame to be worth running the detector on.
+
+Frames are compared on a grid that keeps every step-th pixel of one channel,
+against the frame the detector last ran on, so slow changes still add up. A
+frame is static when fewer than threshold of the sampled pixels changed by
+more than pixel_threshold. At most refresh_interval frames in a row are
+skipped, so new objects in a very still scene are found eventually.
+"""
+import numpy as np
+
+
+class MotionGate:
+    def __init__(self, threshold=0.01, pixel_threshold=25, refresh_interval=30, step=8):
+        self.threshold = threshold
+        self.pixel_threshold = pixel_threshold
+        self.refresh_interval = refresh_interval
+        self.step = step
+        self.reference = None
+        self.sample = None
+        self.diff = None
+        self.since_refresh = 0
+        self.frames = 0
+        self.skipped = 0
+
+    def is_static(self, frame):
+        """Returns True if the detector can be skipped on frame, a (H, W, C) uint8 array.
+
+        Otherwise frame becomes the new reference.
+        """
+        self.frames += 1
+        grid = frame[::self.step, ::self.step, min(1, frame.shape[2] - 1)]
+        if self.reference is None or self.reference.shape != grid.shape:
+            self.reference = np.empty(grid.shape, dtype=np.int16)
+            self.sample = np.empty(grid.shape, dtype=np.int16)
+            self.diff = np.empty(grid.shape, dtype=np.int16)
+        elif self.since_refresh < self.refresh_interval:
+            np.copyto(self.sample, grid)
+            np.subtract(self.sample, self.reference, out=self.diff)
+            np.abs(self.diff, out=self.diff)
+            changed = np.count_nonzero(self.diff > self.pixel_threshold) / self.diff.size
+            if changed < self.threshold:
+                self.since_refresh += 1
+                self.skipped += 1
+                return True
+        np.copyto(self.reference, grid)
+        self.since_refresh = 0
+        return False
+
+    def skip_rate(self):
+        return self.skipped / self.frames if self.frames else 0.0
+
+    def __str__(self):
+        return 'skipped {} of {} frames ({:.0%})'.format(self.skipped, self.frames, self.skip_rate())
@@ -0,0 +1,228 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""
+Host side postprocessing of SSD models exported without the TFLite detection
+postprocess op, whose outputs are the raw box regressions (1, anchors, 4) and
+class scores (1, anchors, classes + 1) of every anchor.
+
+    decoder = postprocess.make_decoder(session)  # None if the model has the op.
+    session.invoke()
+    objs = decoder(session, score_threshold=0.5, top_k=10)
+
+Scores are thresholded before anything is dequantized or decoded, at most
+pre_nms_top_k of the remaining (anchor, class) pairs are decoded against a
+cached anchor grid and class-aware non-maximum suppression keeps the top_k
+best. The anchors are those of the SSD anchor generator of the TensorFlow
+Object Detection API with its default settings (e.g. the 1917 anchors of SSD
+MobileNet at 300x300); other models can pass their anchors as an (anchors, 4)
+[y_center, x_center, height, width] .npy file.
+"""
+import functools
+import math
+import numpy as np
+
+import tracker
+
+# Default settings of the TF Object Detection API SSD anchor generator and box coder.
+NUM_LAYERS = 6
+MIN_SCALE = 0.2
+MAX_SCALE = 0.95
+ASPECT_RATIOS = (1.0, 2.0, 0.5, 3.0, 1.0 / 3.0)
+BOX_CODER_SCALES = np.array([10.0, 10.0, 5.0, 5.0], dtype=np.float32)
+
+# Candidates decoded and run through NMS per frame, at least top_k.
+PRE_NMS_TOP_K = 100
+
+
+@functools.lru_cache(maxsize=None)
+def ssd_anchors(input_size, num_anchors):
+    """Returns the (num_anchors, 4) [y_center, x_center, height, width] anchor grid.
+
+    input_size is the (width, height) of the model input. The grid has one
+    feature map of a sixteenth of the input size and NUM_LAYERS - 1 more of
+    half the size each, with 3 anchors per cell on the first and 6 on the
+    others. Raises ValueError if that doesn't give num_anchors anchors.
+    """
+    scales = [MIN_SCALE + (MAX_SCALE - MIN_SCALE) * i / (NUM_LAYERS - 1)
+              for i in range(NUM_LAYERS)] + [1.0]
+    width, height = math.ceil(input_size[0] / 16), math.ceil(input_size[1] / 16)
+    layers = []
+    for i in range(NUM_LAYERS):
+        if i == 0:
+            specs = [(0.1, 1.0), (scales[0], 2.0), (scales[0], 0.5)]
+        else:
+            specs = [(scales[i], ratio) for ratio in ASPECT_RATIOS]
+            specs.append((math.sqrt(scales[i] * scales[i + 1]), 1.0))
+        scale, ratio = np.array(specs, dtype=np.float32).T
+        y, x = np.meshgrid((np.arange(height) + 0.5) / height, (np.arange(width) + 0.5) / width,
+                           indexing='ij')
+        layer = np.empty((height, width, len(specs), 4), dtype=np.float32)
+        layer[..., 0] = y[..., np.newaxis]
+        layer[..., 1] = x[..., np.newaxis]
+        layer[..., 2] = scale / np.sqrt(ratio)
+        layer[..., 3] = scale * np.sqrt(ratio)
+        layers.append(layer.reshape(-1, 4))
+        width, height = math.ceil(width / 2), math.ceil(height / 2)
+    anchors = np.concatenate(layers)
+    if len(anchors) != num_anchors:
+        raise ValueError('The default SSD anchors of a {}x{} input are {}, the model has {}; '
+                         'pass its anchors as a .npy file'.format(
+                             input_size[0], input_size[1], len(anchors), num_anchors))
+    anchors.flags.writeable = False
+    return anchors
+
+
+def decode_boxes(encodings, anchors):
+    """Returns (N, 4) [xmin, ymin, xmax, ymax] boxes of [ty, tx, th, tw] box encodings."""
+    encodings = encodings / BOX_CODER_SCALES
+    center = encodings[:, :2] * anchors[:, 2:] + anchors[:, :2]
+    half_size = 0.5 * np.exp(encodings[:, 2:]) * anchors[:, 2:]
+    boxes = np.empty((len(encodings), 4), dtype=np.float32)
+    # Anchors are [y, x], boxes [x, y].
+    boxes[:, :2] = (center - half_size)[:, ::-1]
+    boxes[:, 2:] = (center + half_size)[:, ::-1]
+    return boxes
+
+
+def nms(boxes, scores, class_ids, iou_threshold, top_k):
+    """Returns the indices of the boxes kept by greedy per-class NMS, best first.
+
+    The IoU of all pairs is computed at once; the greedy pass then only
+    combines rows of the resulting suppression matrix.
+    """
+    order = np.argsort(-scores, kind='stable')
+    boxes, class_ids = boxes[order], class_ids[order]
+    suppresses = tracker.iou_matrix(boxes, boxes) > iou_threshold
+    suppresses &= class_ids[:, np.newaxis] == class_ids[np.newaxis, :]
+    suppresses = np.triu(suppresses, k=1)
+    keep = np.ones(len(order), dtype=bool)
+    kept = 0
+    for i in range(len(order)):
+        if keep[i]:
+            kept += 1
+            if kept == top_k:
+                keep[i + 1:] = False
+                break
+            keep &= ~suppresses[i]
+    return order[keep]
+
+
+class SsdDecoder:
+    """Turns the raw outputs of an SSD model into detections like get_output().
+
+    Bound to a model, not an interpreter, so one decoder serves all sessions
+    of an InterpreterPool. Scores are taken as logits, with a sigmoid applied
+    to the kept ones, unless their quantization range lies within [0, 1].
+    """
+    def __init__(self, session, boxes_output, scores_output, anchors,
+                 iou_threshold=0.5, pre_nms_top_k=PRE_NMS_TOP_K):
+        self.boxes_output = boxes_output
+        self.scores_output = scores_output
+        self.anchors = anchors
+        self.iou_threshold = iou_threshold
+        self.pre_nms_top_k = pre_nms_top_k
+        self.scores_scale, self.scores_zero_point = session.quantization(scores_output)
+        self.boxes_scale, self.boxes_zero_point = session.quantization(boxes_output)
+        self.num_classes = session.output_shape(scores_output)[-1] - 1
+        self.logits = True
+        self.scores_dtype = np.dtype(session.output_dtype(scores_output))
+        if self.scores_scale:
+            info = np.iinfo(self.scores_dtype)
+            low = self.scores_scale * (info.min - self.scores_zero_point)
+            high = self.scores_scale * (info.max - self.scores_zero_point)
+            self.logits = not (low >= 0.0 and high <= 1.0)
+
+    def __str__(self):
+        return 'raw SSD outputs decoded on the host ({} anchors, {} classes)'.format(
+            len(self.anchors), self.num_classes)
+
+    def _threshold(self, score_threshold):
+        """Returns score_threshold as a scalar of the scores output, None if none can pass.
+
+        Quantized scores are compared as integers, without dequantizing them.
+        """
+        if self.logits:
+            if score_threshold <= 0.0:
+                score_threshold = -np.inf
+            elif score_threshold >= 1.0:
+                return None
+            else:
+                score_threshold = math.log(score_threshold / (1.0 - score_threshold))
+        if not self.scores_scale:
+            return self.scores_dtype.type(score_threshold)
+        info = np.iinfo(self.scores_dtype)
+        if score_threshold == -np.inf:
+            return self.scores_dtype.type(info.min)
+        threshold = math.ceil(score_threshold / self.scores_scale + self.scores_zero_point)
+        if threshold > info.max:
+            return None
+        return self.scores_dtype.type(max(threshold, info.min))
+
+    def __call__(self, session, score_threshold, top_k, index=0):
+        threshold = self._threshold(score_threshold)
+        if threshold is None:
+            return np.empty((0, 6), dtype=np.float32)
+        # Column 0 is the background class.
+        scores = session.raw_output(self.scores_output, index)[:, 1:]
+        # Much faster than a 2D np.nonzero().
+        anchor_ids, class_ids = np.divmod(np.flatnonzero(scores >= threshold), self.num_classes)
+        candidates = scores[anchor_ids, class_ids].astype(np.float32)
+        pre_nms_top_k = max(self.pre_nms_top_k, top_k)
+        if len(candidates) > pre_nms_top_k:
+            best = np.argpartition(-candidates, pre_nms_top_k - 1)[:pre_nms_top_k]
+            anchor_ids, class_ids, candidates = anchor_ids[best], class_ids[best], candidates[best]
+        encodings = session.raw_output(self.boxes_output, index)[anchor_ids].astype(np.float32)
+
+        if self.scores_scale:
+            candidates = self.scores_scale * (candidates - self.scores_zero_point)
+        if self.logits:
+            candidates = 1.0 / (1.0 + np.exp(-candidates))
+        if self.boxes_scale:
+            encodings = self.boxes_scale * (encodings - self.boxes_zero_point)
+        boxes = decode_boxes(encodings, self.anchors[anchor_ids])
+
+        keep = nms(boxes, candidates, class_ids, self.iou_threshold, top_k)
+        objs = np.empty((len(keep), 6), dtype=np.float32)
+        objs[:, :4] = np.clip(boxes[keep], 0.0, 1.0)
+        objs[:, 4] = candidates[keep]
+        objs[:, 5] = class_ids[keep]
+        return objs
+
+
+def make_decoder(session, anchors_file=None, iou_threshold=0.5):
+    """Returns an SsdDecoder for a model with raw SSD outputs, None if it has the postprocess op.
+
+    The mode is told from the outputs: the postprocess op has four (boxes,
+    classes, scores, count), a raw SSD model two of (1, anchors, 4) and
+    (1, anchors, classes + 1). Raises ValueError for any other model.
+    """
+    shapes = [tuple(session.output_shape(i)) for i in range(session.num_outputs)]
+    if len(shapes) == 4:
+        return None
+    if len(shapes) == 2 and all(len(shape) == 3 for shape in shapes) and \
+            shapes[0][1] == shapes[1][1]:
+        boxes_output = 0 if shapes[0][2] == 4 else 1
+        scores_output = 1 - boxes_output
+        num_anchors = shapes[boxes_output][1]
+        if anchors_file:
+            anchors = np.load(anchors_file).astype(np.float32)
+            if anchors.shape != (num_anchors, 4):
+                raise ValueError('{} holds {} anchors, the model has {}'.format(
+                    anchors_file, anchors.shape, num_anchors))
+        else:
+            anchors = ssd_anchors(tuple(session.input_size[:2]), num_anchors)
+        return SsdDecoder(session, boxes_output, scores_output, anchors, iou_threshold)
+    raise ValueError('Unsupported model outputs {}: expected the TFLite detection postprocess '
+                     'op or raw SSD box encodings and class scores'.format(shapes))
@@ -0,0 +1,217 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the frame mapping helpers of common.py. Run with: python3 -m pytest test_common.py"""
+import ctypes
+import struct
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import common
+
+_PyCapsule_New = ctypes.PYFUNCTYPE(ctypes.py_object, ctypes.c_void_p, ctypes.c_char_p,
+                                   ctypes.c_void_p)(('PyCapsule_New', ctypes.pythonapi))
+
+
+def padded_frame(height, width, channels, stride, offset=0):
+    """Returns (flat data, expected frame) for rows of stride bytes starting at offset."""
+    rng = np.random.default_rng(stride)
+    data = rng.integers(0, 256, offset + height * stride, dtype=np.uint8)
+    rows = data[offset:].reshape(height, stride)
+    return data, rows[:, :width * channels].reshape(height, width, channels)
+
+
+def test_frame_view_packed_is_direct():
+    data, expected = padded_frame(4, 5, 3, 15)
+    view, route = common.frame_view(data, 4, 5, 3)
+    assert route == 'direct'
+    np.testing.assert_array_equal(view, expected)
+    assert np.shares_memory(view, data)
+
+
+@pytest.mark.parametrize('width,channels', [(5, 3), (7, 3), (3, 1)])
+def test_frame_view_default_alignment_is_strided(width, channels):
+    stride = (width * channels + 3) & ~3
+    data, expected = padded_frame(6, width, channels, stride)
+    view, route = common.frame_view(data, 6, width, channels)
+    assert route == 'strided'
+    np.testing.assert_array_equal(view, expected)
+    assert np.shares_memory(view, data)
+    assert not view.flags.writeable
+
+
+def test_frame_view_last_row_unpadded():
+    data, expected = padded_frame(6, 5, 3, 16)
+    data = data[:5 * 16 + 15]
+    view, route = common.frame_view(data, 6, 5, 3)
+    assert route == 'strided'
+    np.testing.assert_array_equal(view, expected)
+
+
+def test_frame_view_stride_and_offset():
+    data, expected = padded_frame(8, 10, 3, 64, offset=128)
+    view, route = common.frame_view(data, 8, 10, 3, offset=128, stride=64)
+    assert route == 'strided'
+    np.testing.assert_array_equal(view, expected)
+
+
+def test_frame_view_stride_equal_to_row_is_direct():
+    data, expected = padded_frame(8, 10, 3, 30, offset=16)
+    view, route = common.frame_view(data, 8, 10, 3, offset=16, stride=30)
+    assert route == 'direct'
+    np.testing.assert_array_equal(view, expected)
+
+
+@pytest.mark.parametrize('size,kwargs', [
+    (4 * 15 + 7, {}),                        # Neither packed nor 4 byte aligned.
+    (4 * 16, {'stride': 12}),                # Stride shorter than a row.
+    (3 * 16, {'stride': 16}),                # Too short for the rows.
+    (4 * 16, {'stride': 16, 'offset': 8}),   # Too short after the offset.
+])
+def test_frame_view_rejects_bad_layouts(size, kwargs):
+    with pytest.raises(ValueError):
+        common.frame_view(np.zeros(size, dtype=np.uint8), 4, 5, 3, **kwargs)
+
+
+def test_map_frame_numpy_frame():
+    frame = np.arange(4 * 5 * 3, dtype=np.uint8).reshape(4, 5, 3)
+    with common.map_frame(frame, 4, 5, 3) as (view, route):
+        assert route == 'direct'
+        np.testing.assert_array_equal(view, frame)
+
+
+class FakeBoxed:
+    """Stands in for a PyGObject boxed wrapper: a capsule and an identity hash."""
+
+    def __init__(self, pointer, hash_value):
+        self.__gpointer__ = _PyCapsule_New(pointer, None, None)
+        self.hash_value = hash_value
+
+    def __hash__(self):
+        return self.hash_value
+
+
+def test_buffer_pointer():
+    assert common.buffer_pointer(FakeBoxed(0x1000, 0x1000)) == 0x1000
+    # A hash that doesn't match the capsule isn't trusted.
+    assert common.buffer_pointer(FakeBoxed(0x1000, 0x2000)) is None
+    assert common.buffer_pointer(object()) is None
+
+
+def tflite_model(input_shape):
+    """Returns a minimal TFLite flatbuffer whose input is the second of two tensors."""
+    buf = bytearray(b'\0\0\0\0TFL3')
+
+    def put(fmt, *values):
+        pos = len(buf)
+        buf.extend(struct.pack(fmt, *values))
+        return pos
+
+    def table(num_fields, present):
+        """Writes a table whose present fields are offsets, returns it and their positions."""
+        offsets = [4 + 4 * present.index(i) if i in present else 0 for i in range(num_fields)]
+        vtable = put('<HH{}H'.format(num_fields), 4 + 2 * num_fields, 4 + 4 * len(present),
+                     *offsets)
+        buf.extend(b'\0' * (-len(buf) % 4))
+        pos = put('<i', len(buf) - vtable)
+        return pos, [put('<I', 0) for _ in present]
+
+    def vector(fmt, values):
+        pos = put('<I', len(values))
+        put('<{}{}'.format(len(values), fmt), *values)
+        return pos
+
+    def link(pos, target):
+        struct.pack_into('<I', buf, pos, target - pos)
+
+    model, (subgraphs_field,) = table(3, [2])  # Model.subgraphs
+    link(0, model)
+    subgraphs = vector('I', [0])
+    link(subgraphs_field, subgraphs)
+    subgraph, (tensors_field, inputs_field) = table(2, [0, 1])  # SubGraph.tensors, inputs
+    link(subgraphs + 4, subgraph)
+    tensors = vector('I', [0, 0])
+    link(tensors_field, tensors)
+    link(inputs_field, vector('i', [1]))
+    for i, shape in enumerate([(1, 10), input_shape]):
+        tensor, (shape_field,) = table(1, [0])  # Tensor.shape
+        link(tensors + 4 + 4 * i, tensor)
+        link(shape_field, vector('i', shape))
+    return bytes(buf)
+
+
+def test_model_input_size(tmp_path):
+    path = tmp_path / 'model.tflite'
+    path.write_bytes(tflite_model((1, 300, 320, 3)))
+    assert common.model_input_size(str(path)) == (320, 300, 3)
+    assert common.model_input_size(str(path) + '@usb:0') == (320, 300, 3)
+
+
+@pytest.mark.parametrize('data', [b'\0' * 64, tflite_model((300, 320))[:40],
+                                  tflite_model((300, 320))])
+def test_model_input_size_rejects_other_files(tmp_path, data):
+    path = tmp_path / 'model.tflite'
+    path.write_bytes(data)
+    with pytest.raises(ValueError):
+        common.model_input_size(str(path))
+
+
+class StubInterpreter:
+    """Stands in for an interpreter: a name and an invoke() count."""
+
+    def __init__(self, name):
+        self.name = name
+        self.invokes = 0
+
+    def invoke(self):
+        self.invokes += 1
+
+
+def test_interpreter_pool_map_keeps_order():
+    pool = common.InterpreterPool([StubInterpreter('a'), StubInterpreter('b')])
+
+    def job(interpreter, item):
+        # Later items finish first.
+        time.sleep(0.001 * (20 - item))
+        return item, interpreter.name
+    results = list(pool.map(job, range(20)))
+    pool.close()
+    assert [item for item, _ in results] == list(range(20))
+    assert {name for _, name in results} == {'a', 'b'}
+
+
+def test_interpreter_pool_dispatches_to_least_busy():
+    pool = common.InterpreterPool([StubInterpreter('a'), StubInterpreter('b')])
+    release = threading.Event()
+    blocked = pool.submit(lambda interpreter: (release.wait(10), interpreter.name)[1])
+    # With one instance busy, every job goes to the other one.
+    names = [pool.run(lambda interpreter: interpreter.name) for _ in range(5)]
+    release.set()
+    assert blocked.result() not in names
+    assert len(set(names)) == 1
+    stats = pool.stats()
+    pool.close()
+    assert sum(int(line.split('jobs: ')[1].split()[0]) for line in stats) == 6
+
+
+def test_interpreter_pool_warmup_invokes_each_interpreter():
+    interpreters = [StubInterpreter('a'), StubInterpreter('b')]
+    pool = common.InterpreterPool(interpreters)
+    pool.warmup()
+    pool.close()
+    assert [i.invokes for i in interpreters] == [1, 1]
+    assert pool.interpreter is interpreters[0]
@@ -0,0 +1,180 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for events.py. Run with: python3 -m pytest test_events.py"""
+import threading
+import time
+
+import numpy as np
+import pytest
+
+import events
+import tracker
+
+
+def make_records(start, count):
+    records = np.zeros(count, events.RECORD_DTYPE)
+    records['track_id'] = np.arange(start, start + count)
+    return records
+
+
+@pytest.fixture
+def ring(tmp_path):
+    path = str(tmp_path / 'tracks')
+    writer = events.RingWriter(path, capacity=8)
+    yield path, writer
+    writer.close()
+
+
+def test_ring_reads_in_order_across_wraparound(ring):
+    path, writer = ring
+    reader = events.RingReader(path)
+    seen = []
+    for start in range(0, 30, 3):
+        writer.write(make_records(start, 3))
+        seen.extend(reader.read()['track_id'].tolist())
+    assert seen == list(range(30))
+    assert reader.lost == 0
+    assert len(reader.read()) == 0
+    reader.close()
+
+
+def test_ring_reader_from_start(ring):
+    path, writer = ring
+    writer.write(make_records(0, 5))
+    assert events.RingReader(path).read().size == 0
+    assert events.RingReader(path, from_start=True).read()['track_id'].tolist() == list(range(5))
+    writer.write(make_records(5, 7))
+    reader = events.RingReader(path, from_start=True)
+    assert reader.read()['track_id'].tolist() == list(range(4, 12))
+
+
+def test_ring_slow_reader_loses_overwritten_records(ring):
+    path, writer = ring
+    reader = events.RingReader(path)
+    writer.write(make_records(0, 6))
+    writer.write(make_records(6, 6))
+    assert reader.read()['track_id'].tolist() == list(range(4, 12))
+    assert reader.lost == 4
+
+
+def test_ring_write_of_more_than_capacity_keeps_newest(ring):
+    path, writer = ring
+    reader = events.RingReader(path)
+    writer.write(make_records(0, 20))
+    assert reader.read()['track_id'].tolist() == list(range(12, 20))
+    assert reader.lost == 12
+
+
+def test_ring_reader_drops_torn_records(ring):
+    path, writer = ring
+    reader = events.RingReader(path)
+    writer.write(make_records(0, 6))
+    # The writer has announced 4 more records, which overwrite the slots of
+    # positions 0 and 1, but not yet published them.
+    writer.header['writing'] = 10
+    writer.records[0:2] = make_records(8, 2)
+    records = reader.read()
+    assert records['track_id'].tolist() == list(range(2, 6))
+    assert reader.lost == 2
+    # Once published, the new records are read after the surviving ones.
+    writer.records[6:8] = make_records(6, 2)
+    writer.header['head'] = 10
+    assert reader.read()['track_id'].tolist() == list(range(6, 10))
+    assert reader.lost == 2
+
+
+def test_ring_reader_rejects_other_files(tmp_path):
+    path = tmp_path / 'other'
+    path.write_bytes(b'\0' * 128)
+    with pytest.raises(ValueError):
+        events.RingReader(str(path))
+
+
+def tracks(*ids):
+    rows = np.zeros((len(ids), 7))
+    rows[:, 4] = ids
+    return rows
+
+
+def test_track_events(tmp_path):
+    path = str(tmp_path / 'tracks')
+    writer = events.TrackEventWriter(path, exit_after=1)
+    reader = events.RingReader(path)
+    writer.write(0, 1, tracks(1, 2))
+    writer.write(0, 2, tracks(1))       # 2 missed once: no exit.
+    writer.write(0, 3, tracks(1, 2))
+    writer.write(0, 4, tracks())        # Both missed once.
+    writer.write(0, 5, tracks())        # Both missed twice: exit.
+    writer.close()
+    records = reader.read()
+    events_by_frame = [(int(r['frame']), int(r['track_id']), int(r['event'])) for r in records]
+    assert events_by_frame == [
+        (1, 1, events.ENTER), (1, 2, events.ENTER),
+        (2, 1, events.UPDATE),
+        (3, 1, events.UPDATE), (3, 2, events.UPDATE),
+        (5, 1, events.EXIT), (5, 2, events.EXIT)]
+
+
+def test_track_events_close_exits_live_tracks(tmp_path):
+    path = str(tmp_path / 'tracks')
+    writer = events.TrackEventWriter(path)
+    reader = events.RingReader(path)
+    writer.write(0, 1, tracks(1))
+    writer.write(1, 1, tracks(1))
+    writer.close()
+    records = reader.read()
+    assert [(int(r['stream']), int(r['event'])) for r in records] == [
+        (0, events.ENTER), (1, events.ENTER), (0, events.EXIT), (1, events.EXIT)]
+
+
+def test_track_events_from_several_threads(tmp_path):
+    path = str(tmp_path / 'tracks')
+    writer = events.TrackEventWriter(path)
+    reader = events.RingReader(path)
+    ring_write = writer.ring.write
+    writing = []
+    overlaps = []
+
+    def slow_write(records):
+        # Holds the ring long enough for an unserialized write to overlap.
+        writing.append(None)
+        overlaps.append(len(writing) > 1)
+        time.sleep(0.001)
+        ring_write(records)
+        writing.pop()
+    writer.ring.write = slow_write
+    num_frames = 50
+
+    def write_stream(stream):
+        for frame in range(num_frames):
+            writer.write(stream, frame, tracks(1, 2))
+    threads = [threading.Thread(target=write_stream, args=(stream,)) for stream in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    writer.close()
+    assert not any(overlaps)
+    records = reader.read()
+    assert reader.lost == 0
+    for stream in range(4):
+        updates = records[(records['stream'] == stream) & (records['event'] != events.EXIT)]
+        assert updates['frame'].tolist() == [f for f in range(1, num_frames + 1) for _ in range(2)]
+
+
+def test_tracker_exit_after():
+    assert events.tracker_exit_after(tracker.VectorizedSort(max_age=1, min_hits=3)) == 3
+    assert events.tracker_exit_after(tracker.GreedyIoUTracker(max_age=2, min_hits=1)) == 2
+    assert events.tracker_exit_after(object()) == 1
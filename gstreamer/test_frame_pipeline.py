@@ -0,0 +1,96 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the FramePipeline workers. Run with: python3 -m pytest test_frame_pipeline.py"""
+import threading
+import time
+
+import pytest
+
+import frame_pipeline
+
+
+class ListPipeline(frame_pipeline.FramePipeline):
+    """Runs the pipeline on a list of frames, as ReplayPipeline does on a file."""
+
+    def __init__(self, frames, user_function, **kwargs):
+        super().__init__(user_function, (640, 480), None, headless=True, **kwargs)
+        self.frames = frames
+        self.shown = []
+
+    def get_box(self):
+        return (0, 0, 640, 480)
+
+    def display(self, svg):
+        self.shown.append(svg)
+
+    def run(self):
+        workers = self.start_workers()
+        for frame in self.frames:
+            self.add_frame(frame, time.monotonic())
+        with self.condition:
+            while self.pending:
+                self.condition.wait()
+        self.stop_workers(workers)
+
+
+def run_with_timeout(pipeline, timeout=10):
+    errors = []
+
+    def target():
+        try:
+            pipeline.run()
+        except Exception as e:
+            errors.append(e)
+    thread = threading.Thread(target=target, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    assert not thread.is_alive(), 'pipeline did not stop'
+    return errors
+
+
+def first(frame, src_size, box, mot_tracker):
+    return frame
+
+
+def test_stages_run_in_order():
+    pipeline = ListPipeline(list(range(50)), [first, lambda x: x * 2, str], pipeline_depth=2)
+    assert run_with_timeout(pipeline) == []
+    assert pipeline.shown == [str(i * 2) for i in range(50)]
+
+
+@pytest.mark.parametrize('failing', [0, 1, 2])
+def test_failing_stage_stops_pipeline(failing):
+    def fail_at(i):
+        def stage(x):
+            if x == 10:
+                raise RuntimeError('stage {}'.format(i))
+            return x
+        return stage
+    stages = [first, lambda x: x, str]
+    if failing == 0:
+        stages[0] = lambda frame, *args: fail_at(0)(frame)
+    else:
+        stages[failing] = fail_at(failing)
+    pipeline = ListPipeline(list(range(100)), stages, pipeline_depth=2)
+    errors = run_with_timeout(pipeline)
+    assert [str(e) for e in errors] == ['stage {}'.format(failing)]
+    assert '10' not in pipeline.shown
+
+
+def test_failing_user_function_stops_pipeline():
+    def user_function(frame, *args):
+        raise ValueError('bad frame')
+    errors = run_with_timeout(ListPipeline(list(range(10)), user_function))
+    assert [str(e) for e in errors] == ['bad frame']
@@ -0,0 +1,43 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the StreamScheduler workers. Run with: python3 -m pytest test_gstreamer.py"""
+import threading
+import time
+
+import pytest
+
+from test_frame_pipeline import ListPipeline
+
+try:
+    import gstreamer
+except (ImportError, ValueError) as e:
+    pytest.skip('GStreamer Python bindings not available: {}'.format(e), allow_module_level=True)
+
+
+def test_failing_scheduler_worker_stops_scheduler():
+    def user_function(frame, *args):
+        raise RuntimeError('map failed')
+    scheduler = gstreamer.StreamScheduler([user_function], gui=False)
+    pipeline = ListPipeline([], None, condition=scheduler.condition)
+    scheduler.pipelines.append(pipeline)
+    scheduler.running = True
+    for i in range(3):
+        pipeline.add_frame(i, time.monotonic())
+    worker = threading.Thread(target=scheduler.worker_loop, args=(user_function,), daemon=True)
+    worker.start()
+    worker.join(10)
+    assert not worker.is_alive()
+    assert str(scheduler.error) == 'map failed'
+    assert not scheduler.running
@@ -0,0 +1,65 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for mot.py. Run with: python3 -m pytest test_mot.py"""
+import json
+
+import numpy as np
+
+import mot
+
+DETECTIONS = np.array([[10.0, 20.0, 30.0, 40.0, 0.9, 1.0],
+                       [50.0, 60.0, 70.0, 80.0, 0.5, 2.0]])
+TRACKS = np.array([[11.0, 21.0, 30.0, 40.0, 3.0]])
+
+
+def read_rows(path):
+    return np.loadtxt(path, delimiter=',', ndmin=2)
+
+
+def test_mot_writer_without_tracker(tmp_path):
+    path = str(tmp_path / 'dets.csv')
+    writer = mot.make_writer(path)
+    writer.write(1, DETECTIONS)
+    writer.write(2, DETECTIONS[:0])
+    writer.close()
+    rows = read_rows(path)
+    np.testing.assert_array_equal(rows[:, :2], [[1, -1], [1, -1]])
+    np.testing.assert_allclose(rows[:, 2:7], DETECTIONS[:, :5])
+    assert not (tmp_path / 'dets.det.csv').exists()
+
+
+def test_mot_writer_with_tracker_keeps_detections(tmp_path):
+    path = str(tmp_path / 'tracks.csv')
+    writer = mot.make_writer(path)
+    writer.write(1, DETECTIONS, TRACKS, np.array([0.8]))
+    writer.write(2, DETECTIONS[:1], TRACKS[:0], np.empty(0))
+    writer.close()
+    tracks = read_rows(path)
+    np.testing.assert_allclose(tracks, [[1, 3, 11, 21, 30, 40, 0.8, -1, -1, -1]])
+    dets = read_rows(str(tmp_path / 'tracks.det.csv'))
+    np.testing.assert_array_equal(dets[:, :2], [[1, -1], [1, -1], [2, -1]])
+    np.testing.assert_allclose(dets[:, 2:7], DETECTIONS[[0, 1, 0], :5])
+
+
+def test_jsonl_writer(tmp_path):
+    path = str(tmp_path / 'tracks.jsonl')
+    writer = mot.make_writer(path)
+    writer.write(1, DETECTIONS, TRACKS, np.array([0.8]))
+    writer.close()
+    with open(path) as f:
+        record = json.loads(f.readline())
+    assert record['frame'] == 1
+    assert record['tracks'] == TRACKS.tolist()
+    assert record['detections'] == DETECTIONS.tolist()
@@ -0,0 +1,120 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+
+"""Tests for postprocess.py. Run with: python3 -m pytest test_postprocess.py"""
+import math
+
+import numpy as np
+import pytest
+
+import common
+import postprocess
+from benchmark import RawStubInterpreter
+from tracker import iou_matrix
+
+
+def test_ssd_anchors_300x300():
+    anchors = postprocess.ssd_anchors((300, 300), 1917)
+    # 3 anchors per cell of the 19x19 map, 6 per cell of the 10x10, 5x5, 3x3, 2x2 and 1x1 ones.
+    assert anchors.shape == (19 * 19 * 3 + (100 + 25 + 9 + 4 + 1) * 6, 4)
+    np.testing.assert_allclose(anchors[0], [0.5 / 19, 0.5 / 19, 0.1, 0.1])
+    np.testing.assert_allclose(anchors[-6], [0.5, 0.5, 0.95, 0.95])
+    assert postprocess.ssd_anchors((300, 300), 1917) is anchors
+    assert not anchors.flags.writeable
+    with pytest.raises(ValueError, match='are 1917, the model has 2034'):
+        postprocess.ssd_anchors((300, 300), 2034)
+
+
+def test_decode_boxes():
+    anchors = np.array([[0.5, 0.4, 0.2, 0.1],
+                        [0.5, 0.4, 0.2, 0.1]], dtype=np.float32)
+    # The second moves the center by one anchor height down and doubles the width.
+    encodings = np.array([[0.0, 0.0, 0.0, 0.0],
+                          [10.0, 0.0, 0.0, 5.0 * math.log(2.0)]], dtype=np.float32)
+    np.testing.assert_allclose(postprocess.decode_boxes(encodings, anchors),
+                               [[0.35, 0.4, 0.45, 0.6],
+                                [0.3, 0.6, 0.5, 0.8]], rtol=1e-6)
+
+
+def reference_decode(session, score_threshold, top_k, iou_threshold=0.5):
+    """Dequantizes and decodes every anchor, then runs NMS one box at a time."""
+    interpreter = session.interpreter
+    boxes_details, scores_details = interpreter.get_output_details()
+    scale, zero_point = scores_details['quantization']
+    scores = interpreter.tensor(scores_details['index'])()[0, :, 1:].astype(float)
+    scores = scale * (scores - zero_point)
+    low, high = scale * (np.array([0, 255]) - zero_point)
+    if not (low >= 0.0 and high <= 1.0):
+        scores = 1.0 / (1.0 + np.exp(-scores))
+    scale, zero_point = boxes_details['quantization']
+    encodings = interpreter.tensor(boxes_details['index'])()[0].astype(float)
+    encodings = scale * (encodings - zero_point)
+    boxes = postprocess.decode_boxes(encodings.astype(np.float32),
+                                     postprocess.ssd_anchors((300, 300), len(encodings)))
+    objs = []
+    for anchor_id, class_id in zip(*np.nonzero(scores >= score_threshold)):
+        objs.append((scores[anchor_id, class_id], anchor_id, class_id))
+    objs.sort(key=lambda obj: -obj[0])
+    kept = []
+    for score, anchor_id, class_id in objs:
+        if len(kept) == top_k:
+            break
+        box = boxes[anchor_id:anchor_id + 1]
+        if all(kept_class != class_id or iou_matrix(box, kept_box)[0, 0] <= iou_threshold
+               for _, kept_box, kept_class in kept):
+            kept.append((score, box, class_id))
+    result = np.empty((len(kept), 6))
+    for row, (score, box, class_id) in zip(result, kept):
+        row[:4] = np.clip(box[0], 0.0, 1.0)
+        row[4:] = score, class_id
+    return result
+
+
+def sorted_rows(objs):
+    return objs[np.lexsort(objs.T[::-1])]
+
+
+# Scores as class logits in units of 0.1, and as probabilities in units of
+# 1/256, of which 0.8125 is the quantized score 208 of the stub.
+@pytest.mark.parametrize('scores_quantization', [(0.1, 128), (1.0 / 256, 0)])
+@pytest.mark.parametrize('score_threshold', [0.5, 0.8, 0.8125, 0.999, 1.0])
+def test_ssd_decoder_matches_reference(scores_quantization, score_threshold):
+    interpreter = RawStubInterpreter(num_objects=10, seed=2)
+    interpreter.quantization[2] = scores_quantization
+    session = common.InterpreterSession(interpreter)
+    decoder = postprocess.make_decoder(session)
+    assert decoder.logits == (scores_quantization[0] == 0.1)
+    for _ in range(3):
+        session.invoke()
+        objs = decoder(session, score_threshold, top_k=50)
+        expected = reference_decode(session, score_threshold, top_k=50)
+        assert objs.dtype == np.float32
+        assert len(objs) == len(expected)
+        np.testing.assert_allclose(sorted_rows(objs), sorted_rows(expected), rtol=1e-5, atol=1e-6)
+        assert np.all(np.diff(objs[:, 4]) <= 0)
+
+
+@pytest.mark.parametrize('score_threshold', [0.0, 0.5])
+def test_ssd_decoder_top_k(score_threshold):
+    # With every anchor passing, only pre_nms_top_k of the equal background
+    # scores are decoded, so only the scores of the best are compared.
+    interpreter = RawStubInterpreter(num_objects=10, seed=2)
+    session = common.InterpreterSession(interpreter)
+    decoder = postprocess.make_decoder(session)
+    session.invoke()
+    objs = decoder(session, score_threshold, top_k=4)
+    expected = reference_decode(session, score_threshold, top_k=4)
+    assert len(objs) == 4
+    np.testing.assert_allclose(objs[:, 4], expected[:, 4], rtol=1e-5)
@@ -0,0 +1,302 @@
+# Copyright 2020 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for tracker.py. Run with: python3 -m pytest test_tracker.py"""
+import numpy as np
+import pytest
+
+from benchmark_tracker import synthetic_detections
+import tracker
+from tracker import (GreedyIoUTracker, VectorizedSort, _hungarian, gated_assignment,
+                     iou_matrix, linear_assignment)
+
+
+class ReferenceTrack(object):
+    """One upstream SORT KalmanBoxTracker, with filterpy's KalmanFilter written out."""
+
+    def __init__(self, box, track_id):
+        self.F = np.eye(7) + np.eye(7, k=4)
+        self.H = np.eye(4, 7)
+        self.R = np.eye(4)
+        self.R[2:, 2:] *= 10.0
+        self.P = np.eye(7)
+        self.P[4:, 4:] *= 1000.0
+        self.P *= 10.0
+        self.Q = np.eye(7)
+        self.Q[-1, -1] *= 0.01
+        self.Q[4:, 4:] *= 0.01
+        self.x = np.zeros(7)
+        self.x[:4] = to_z(box)
+        self.id = track_id
+        self.time_since_update = 0
+        self.hit_streak = 0
+
+    def predict(self):
+        if self.x[6] + self.x[2] <= 0:
+            self.x[6] *= 0.0
+        self.x = self.F @ self.x
+        self.P = self.F @ self.P @ self.F.T + self.Q
+        if self.time_since_update > 0:
+            self.hit_streak = 0
+        self.time_since_update += 1
+        return to_box(self.x)
+
+    def update(self, box):
+        self.time_since_update = 0
+        self.hit_streak += 1
+        y = to_z(box) - self.H @ self.x
+        S = self.H @ self.P @ self.H.T + self.R
+        K = self.P @ self.H.T @ np.linalg.inv(S)
+        self.x = self.x + K @ y
+        I_KH = np.eye(7) - K @ self.H
+        self.P = I_KH @ self.P @ I_KH.T + K @ self.R @ K.T
+
+
+class ReferenceSort(object):
+    """Upstream SORT (Bewley et al.), one Python object per track."""
+
+    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3):
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.iou_threshold = iou_threshold
+        self.trackers = []
+        self.frame_count = 0
+        self.next_id = 0
+
+    def update(self, dets):
+        self.frame_count += 1
+        trks = np.array([t.predict() for t in self.trackers]).reshape(-1, 4)
+        valid = ~np.isnan(trks).any(axis=1)
+        self.trackers = [t for t, v in zip(self.trackers, valid) if v]
+        trks = trks[valid]
+
+        iou = iou_matrix(dets, trks)
+        matched = set()
+        if iou.size:
+            a = (iou > self.iou_threshold).astype(int)
+            if a.sum(1).max() == 1 and a.sum(0).max() == 1:
+                matches = np.stack(np.where(a), axis=1)
+            else:
+                matches = linear_assignment(-iou)
+            for d, t in matches:
+                if iou[d, t] >= self.iou_threshold:
+                    self.trackers[t].update(dets[d, :4])
+                    matched.add(d)
+        for d in range(len(dets)):
+            if d not in matched:
+                self.trackers.append(ReferenceTrack(dets[d, :4], self.next_id))
+                self.next_id += 1
+
+        ret = []
+        for t in self.trackers:
+            if t.time_since_update < 1 and (
+                    t.hit_streak >= self.min_hits or self.frame_count <= self.min_hits):
+                ret.append(np.append(to_box(t.x), t.id + 1))
+        self.trackers = [t for t in self.trackers if t.time_since_update <= self.max_age]
+        return np.array(ret).reshape(-1, 5)
+
+
+def to_z(box):
+    w, h = box[2] - box[0], box[3] - box[1]
+    return np.array([box[0] + w / 2, box[1] + h / 2, w * h, w / h])
+
+
+def to_box(x):
+    w = np.sqrt(x[2] * x[3])
+    h = x[2] / w
+    return np.array([x[0] - w / 2, x[1] - h / 2, x[0] + w / 2, x[1] + h / 2])
+
+
+def by_id(tracks):
+    return tracks[np.argsort(tracks[:, 4])]
+
+
+@pytest.mark.parametrize('max_age,min_hits', [(1, 3), (3, 1), (5, 3)])
+def test_vectorized_sort_matches_reference(max_age, min_hits):
+    ours = VectorizedSort(max_age=max_age, min_hits=min_hits)
+    reference = ReferenceSort(max_age=max_age, min_hits=min_hits)
+    for dets in synthetic_detections(20, 60, seed=max_age, miss_rate=0.2):
+        expected = by_id(reference.update(dets))
+        actual = by_id(ours.update(dets))
+        np.testing.assert_array_equal(actual[:, 4], expected[:, 4])
+        np.testing.assert_allclose(actual, expected, rtol=1e-9, atol=1e-12)
+
+
+def test_vectorized_sort_detection_indices():
+    mot_tracker = VectorizedSort(min_hits=1)
+    for dets in synthetic_detections(10, 20, seed=1):
+        tracks = mot_tracker.update(dets)
+        matched = dets[mot_tracker.detection_indices]
+        assert np.all(np.diag(iou_matrix(tracks, matched)) > 0.5)
+
+
+def test_vectorized_sort_empty_frames():
+    mot_tracker = VectorizedSort()
+    assert mot_tracker.update().shape == (0, 5)
+    mot_tracker.update(np.array([[0.1, 0.1, 0.2, 0.2, 0.9]]))
+    assert mot_tracker.update().shape == (0, 5)
+    assert len(mot_tracker) == 1
+    mot_tracker.update()
+    assert len(mot_tracker) == 0
+
+
+@pytest.mark.parametrize('name', ['sort', 'iou'])
+def test_coasting_between_detections_keeps_ids(name):
+    # A box moving 0.01 per frame, detected on every third frame only.
+    mot_tracker = tracker.make_tracker(name)
+    box = np.array([0.1, 0.1, 0.2, 0.2])
+    for frame in range(30):
+        moved = box + 0.01 * frame
+        if frame % 3:
+            tracks = mot_tracker.coast()
+        else:
+            tracks = mot_tracker.update(np.append(moved, 0.9)[np.newaxis])
+        assert tracks[:, 4].tolist() == [1.0]
+        if frame >= 6:
+            np.testing.assert_allclose(tracks[0, :4], moved, atol=1e-3)
+
+
+def test_greedy_tracker_velocity_from_measurements():
+    mot_tracker = GreedyIoUTracker()
+    mot_tracker.update(np.array([[0.0, 0.0, 0.1, 0.1, 0.9]]))
+    mot_tracker.coast()
+    mot_tracker.update(np.array([[0.02, 0.0, 0.12, 0.1, 0.9]]))
+    np.testing.assert_allclose(mot_tracker.velocity, [[0.01, 0.0, 0.01, 0.0]])
+    np.testing.assert_allclose(mot_tracker.coast(), [[0.03, 0.0, 0.13, 0.1, 1.0]])
+
+
+def test_greedy_tracker_detection_indices():
+    mot_tracker = GreedyIoUTracker()
+    for dets in synthetic_detections(10, 20, seed=1):
+        tracks = mot_tracker.update(dets)
+        matched = dets[mot_tracker.detection_indices]
+        np.testing.assert_array_equal(tracks[:, :4], matched[:, :4])
+
+
+def test_greedy_tracker_matches_highest_iou_first():
+    mot_tracker = GreedyIoUTracker()
+    mot_tracker.update(np.array([[0.0, 0.0, 0.1, 0.1, 0.9]]))
+    tracks = mot_tracker.update(np.array([[0.03, 0.0, 0.13, 0.1, 0.9],
+                                          [0.01, 0.0, 0.11, 0.1, 0.9]]))
+    assert tracks[:, 4].tolist() == [1.0, 2.0]
+    assert mot_tracker.detection_indices.tolist() == [1, 0]
+
+
+def test_greedy_tracker_min_hits_and_max_age():
+    mot_tracker = GreedyIoUTracker(max_age=2, min_hits=2)
+    dets = np.array([[0.1, 0.1, 0.2, 0.2, 0.9]])
+    assert mot_tracker.update(dets).shape == (0, 5)
+    assert mot_tracker.update(dets)[:, 4].tolist() == [1.0]
+    for _ in range(2):
+        assert mot_tracker.update().shape == (0, 5)
+        assert len(mot_tracker.ids) == 1
+    mot_tracker.update()
+    assert len(mot_tracker.ids) == 0
+
+
+def test_make_tracker_returns_new_trackers():
+    assert {'iou', 'sort', 'sort_upstream'} <= set(tracker.available_trackers())
+    assert tracker.available_trackers() == sorted(tracker.available_trackers())
+    mot_tracker = tracker.make_tracker('iou')
+    assert isinstance(mot_tracker, GreedyIoUTracker)
+    assert isinstance(tracker.make_tracker('sort'), VectorizedSort)
+    assert tracker.make_tracker('iou') is not mot_tracker
+
+
+def test_register_tracker(monkeypatch):
+    monkeypatch.setattr(tracker, '_trackers', dict(tracker._trackers))
+    tracker.register_tracker('fixed', lambda: GreedyIoUTracker(min_hits=3))
+    assert 'fixed' in tracker.available_trackers()
+    assert tracker.make_tracker('fixed').min_hits == 3
+
+
+def test_make_tracker_unknown_name():
+    with pytest.raises(ValueError, match="Unknown tracker 'nope', choose from .*iou"):
+        tracker.make_tracker('nope')
+
+
+@pytest.mark.parametrize('shape', [(1, 1), (3, 3), (4, 7), (10, 10), (12, 30)])
+def test_hungarian_matches_scipy(shape):
+    optimize = pytest.importorskip('scipy.optimize')
+    rng = np.random.default_rng(shape[0] * 100 + shape[1])
+    for _ in range(20):
+        cost = rng.uniform(-1.0, 1.0, shape)
+        matches = _hungarian(cost)
+        rows, cols = optimize.linear_sum_assignment(cost)
+        assert len(matches) == shape[0]
+        assert len(np.unique(matches[:, 1])) == shape[0]
+        np.testing.assert_allclose(cost[matches[:, 0], matches[:, 1]].sum(),
+                                   cost[rows, cols].sum())
+
+
+def test_hungarian_ties():
+    optimize = pytest.importorskip('scipy.optimize')
+    cost = -np.array([[1.0, 1.0, 0.0], [1.0, 1.0, 0.0], [0.0, 0.0, 0.0]])
+    matches = _hungarian(cost)
+    rows, cols = optimize.linear_sum_assignment(cost)
+    assert cost[matches[:, 0], matches[:, 1]].sum() == cost[rows, cols].sum()
+
+
+def test_linear_assignment_tall_and_empty():
+    cost = np.array([[0.0, 5.0], [5.0, 0.0], [1.0, 1.0]])
+    matches = linear_assignment(cost)
+    assert cost[matches[:, 0], matches[:, 1]].sum() == 0.0
+    assert linear_assignment(np.empty((0, 3))).shape == (0, 2)
+
+
+def random_boxes(rng, n, size=0.1):
+    xy = rng.uniform(0.0, 1.0, (n, 2))
+    wh = rng.uniform(0.2, 1.0, (n, 2)) * size
+    return np.concatenate((xy, xy + wh), axis=1)
+
+
+def dense_assignment(boxes_a, boxes_b):
+    iou = iou_matrix(boxes_a, boxes_b)
+    matches = linear_assignment(-iou)
+    return matches[iou[matches[:, 0], matches[:, 1]] > 0], iou
+
+
+@pytest.mark.parametrize('seed', range(20))
+@pytest.mark.parametrize('n,m,size', [(1, 1, 0.5), (5, 4, 0.3), (12, 12, 0.2), (40, 30, 0.1)])
+def test_gated_assignment_matches_dense(seed, n, m, size):
+    rng = np.random.default_rng(seed)
+    boxes_a = random_boxes(rng, n, size)
+    # Half of boxes_b are jittered copies of boxes_a, so that components of
+    # several boxes on both sides are common.
+    k = min(n, m) // 2
+    boxes_b = np.concatenate((boxes_a[:k] + rng.normal(0.0, 0.02, (k, 4)),
+                              random_boxes(rng, m - k, size)))
+    matches, scores = gated_assignment(boxes_a, boxes_b)
+    expected, iou = dense_assignment(boxes_a, boxes_b)
+    np.testing.assert_allclose(scores, iou[matches[:, 0], matches[:, 1]])
+    assert len(np.unique(matches[:, 0])) == len(matches)
+    assert len(np.unique(matches[:, 1])) == len(matches)
+    np.testing.assert_allclose(scores.sum(), iou[expected[:, 0], expected[:, 1]].sum())
+    assert sorted(map(tuple, matches.tolist())) == sorted(map(tuple, expected.tolist()))
+
+
+def test_gated_assignment_without_overlaps():
+    boxes_a = np.array([[0.0, 0.0, 0.1, 0.1]])
+    boxes_b = np.array([[0.5, 0.5, 0.6, 0.6]])
+    matches, scores = gated_assignment(boxes_a, boxes_b)
+    assert matches.shape == (0, 2) and scores.shape == (0,)
+    matches, scores = gated_assignment(boxes_a, boxes_b[:0])
+    assert matches.shape == (0, 2) and scores.shape == (0,)
+
+
+def test_gated_sort_matches_dense_sort():
+    gated = VectorizedSort(dense_limit=0)
+    dense = VectorizedSort(dense_limit=np.inf)
+    for dets in synthetic_detections(200, 30, seed=3):
+        np.testing.assert_allclose(gated.update(dets), dense.update(dets))
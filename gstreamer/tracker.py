@@ -13,30 +13,587 @@
 # limitations under the License.
 
 """
-This module provides the support for Tracker Object. 
-This creates object for the specific tracker based on the name of the tracker provided 
-in the command line of the demo.
+This module provides the multi-object trackers of the demo and a registry to
+create them by the name given on the command line.
 
-To add more trackers here, simply replicate the SortTracker() code and replace it with 
-the new tracker as required.
+A tracker is an object with
+    update(dets): takes (N, 5) [x0, y0, x1, y1, score] detections, once per
+        frame, and returns (M, 5) [x0, y0, x1, y1, track_id] tracks.
+and optionally
+    coast(): a predict-only step for frames without detections, returning
+        tracks like update().
+    detection_indices: the row of dets each track last returned was matched to.
 
-Developer simply needs to instantiate the object of ObjectTracker(trackerObjectName) with a valid 
-trackerObjectName.
+Built-in trackers:
+    'sort': NumPy only implementation of SORT (https://github.com/abewley/sort)
+        which keeps every track in stacked arrays.
+    'sort_upstream': the upstream SORT, if it has been installed in
+        third_party/ by install_requirements.sh.
+    'iou': greedy IoU matching of boxes from frame to frame without a Kalman
+        filter, for hosts where even SORT costs too much.
 
+Trackers are added with register_tracker(name, factory), where factory is
+called without arguments each time a tracker is created. Other packages can
+register trackers with an entry point in the 'coral_tracker.trackers' group
+pointing at such a factory, e.g. in setup.cfg:
+
+    [options.entry_points]
+    coral_tracker.trackers =
+        mytracker = mypackage.tracking:MyTracker
+
+Modules behind a factory or entry point are only imported when that tracker is
+created.
 """
 import os,sys
 
+import numpy as np
+
+ENTRY_POINT_GROUP = 'coral_tracker.trackers'
+
+# Tracker name -> factory.
+_trackers = {}
+_entry_points_loaded = False
+
+
+def register_tracker(name, factory):
+    """Makes factory() available as the tracker called name."""
+    _trackers[name] = factory
+
+
+def _load_entry_points():
+    global _entry_points_loaded
+    if _entry_points_loaded:
+        return
+    _entry_points_loaded = True
+    try:
+        from importlib.metadata import entry_points
+    except ImportError:
+        return
+    eps = entry_points()
+    eps = eps.select(group=ENTRY_POINT_GROUP) if hasattr(eps, 'select') else eps.get(ENTRY_POINT_GROUP, [])
+    for ep in eps:
+        # Trackers registered in code take precedence.
+        if ep.name not in _trackers:
+            _trackers[ep.name] = lambda ep=ep: ep.load()()
+
+
+def available_trackers():
+    """Returns the names of all registered trackers, sorted."""
+    _load_entry_points()
+    return sorted(_trackers)
+
+
+def make_tracker(name):
+    """Returns a new tracker of the given name. Raises ValueError for unknown names."""
+    _load_entry_points()
+    if name not in _trackers:
+        raise ValueError('Unknown tracker {!r}, choose from {}'.format(
+            name, ', '.join(available_trackers())))
+    return _trackers[name]()
+
+
 class ObjectTracker(object):
+    """Wraps make_tracker() for older callers: ObjectTracker(name).trackerObject.mot_tracker."""
     def __init__(self, trackerObjectName):
-        if trackerObjectName == 'sort':  # Add more trackers in elif whenever needed
-            self.trackerObject = SortTracker()
+        self.trackerObject = self
+        self.mot_tracker = make_tracker(trackerObjectName)
+
+
+def _upstream_sort():
+    sys.path.append(os.path.join(os.path.dirname(__file__), '../third_party', 'sort-master'))
+    from sort import Sort
+    return Sort()
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """Returns the (N, M) IoU matrix of [x0, y0, x1, y1, ...] boxes."""
+    return _iou(boxes_a[:, np.newaxis, :4], boxes_b[np.newaxis, :, :4])
+
+
+def iou_pairs(boxes_a, boxes_b):
+    """Returns the IoU of each pair of rows of two (K, 4+) box arrays."""
+    return _iou(boxes_a[:, :4], boxes_b[:, :4])
+
+
+def _iou(a, b):
+    w = np.maximum(0.0, np.minimum(a[..., 2], b[..., 2]) - np.maximum(a[..., 0], b[..., 0]))
+    h = np.maximum(0.0, np.minimum(a[..., 3], b[..., 3]) - np.maximum(a[..., 1], b[..., 1]))
+    inter = w * h
+    area_a = (a[..., 2] - a[..., 0]) * (a[..., 3] - a[..., 1])
+    area_b = (b[..., 2] - b[..., 0]) * (b[..., 3] - b[..., 1])
+    with np.errstate(divide='ignore', invalid='ignore'):
+        iou = inter / (area_a + area_b - inter)
+    return np.nan_to_num(iou, copy=False)
+
+
+def overlapping_pairs(boxes_a, boxes_b):
+    """Returns the (K, 2) [a, b] indices of all pairs of boxes that overlap.
+
+    Sort and sweep along x: with boxes_b sorted by x0, the boxes_b that can
+    overlap a box of boxes_a are a contiguous run, from its x0 minus the widest
+    box of boxes_b to its x1. Only the pairs in those runs are checked.
+    """
+    if not len(boxes_a) or not len(boxes_b):
+        return np.empty((0, 2), dtype=int)
+    order = np.argsort(boxes_b[:, 0], kind='stable')
+    x0 = boxes_b[order, 0]
+    max_w = np.max(boxes_b[:, 2] - boxes_b[:, 0])
+    start = np.searchsorted(x0, boxes_a[:, 0] - max_w, 'left')
+    stop = np.searchsorted(x0, boxes_a[:, 2], 'left')
+    counts = np.maximum(stop - start, 0)
+    a = np.repeat(np.arange(len(boxes_a)), counts)
+    # Position of each candidate within its run, plus the start of the run.
+    offsets = np.arange(counts.sum()) - np.repeat(np.cumsum(counts) - counts, counts)
+    b = order[np.repeat(start, counts) + offsets]
+    overlap = ((np.minimum(boxes_a[a, 2], boxes_b[b, 2]) > np.maximum(boxes_a[a, 0], boxes_b[b, 0])) &
+               (np.minimum(boxes_a[a, 3], boxes_b[b, 3]) > np.maximum(boxes_a[a, 1], boxes_b[b, 1])))
+    return np.stack((a[overlap], b[overlap]), axis=1)
+
+
+def connected_components(num_nodes, u, v):
+    """Labels the connected components of the graph with edges u[k] - v[k].
+
+    Returns the component label of each node, the smallest node index in it.
+    """
+    labels = np.arange(num_nodes)
+    while True:
+        m = np.minimum(labels[u], labels[v])
+        new = labels.copy()
+        np.minimum.at(new, u, m)
+        np.minimum.at(new, v, m)
+        # Pointer jumping halves the distance to the root on every pass.
+        new = new[new]
+        if np.array_equal(new, labels):
+            return labels
+        labels = new
+
+
+def gated_assignment(boxes_a, boxes_b):
+    """Maximum total IoU assignment between two sets of boxes, for large sets.
+
+    Only overlapping pairs are scored. Since non-overlapping pairs add nothing
+    to the total, the assignment falls apart into one per connected component
+    of the overlap graph, which gives the same result as solving it on the
+    full IoU matrix. Components with a single box on either side, the common
+    case, are matched to their best pair without a solver; the solver is
+    called on each other component's own submatrix, so its cost is bounded by
+    the largest component rather than by all the boxes in a crowd. Returns
+    the (K, 2) [a, b] matches and their IoU.
+    """
+    pairs = overlapping_pairs(boxes_a, boxes_b)
+    iou = iou_pairs(boxes_a[pairs[:, 0]], boxes_b[pairs[:, 1]])
+    pairs, iou = pairs[iou > 0], iou[iou > 0]
+    if not len(pairs):
+        return pairs, iou
+    n = len(boxes_a)
+    labels = connected_components(n + len(boxes_b), pairs[:, 0], n + pairs[:, 1])
+    component = labels[pairs[:, 0]]
+    # Pairs grouped by component, best first within each.
+    order = np.lexsort((-iou, component))
+    pairs, iou, component = pairs[order], iou[order], component[order]
+    starts = np.flatnonzero(np.r_[True, component[1:] != component[:-1]])
+    num_a = np.bincount(labels[np.unique(pairs[:, 0])], minlength=len(labels))
+    num_b = np.bincount(labels[n + np.unique(pairs[:, 1])], minlength=len(labels))
+    star = ((num_a == 1) | (num_b == 1))[component]
+    best = starts[star[starts]]
+
+    matches, scores = [pairs[best]], [iou[best]]
+    # The pairs of each other component are contiguous, since they are sorted by component.
+    rest = np.flatnonzero(~star)
+    for group in np.split(rest, np.flatnonzero(np.diff(component[rest])) + 1):
+        if not len(group):
+            continue
+        rows, r = np.unique(pairs[group, 0], return_inverse=True)
+        cols, c = np.unique(pairs[group, 1], return_inverse=True)
+        sub = np.zeros((len(rows), len(cols)))
+        sub[r, c] = iou[group]
+        m = linear_assignment(-sub)
+        m = m[sub[m[:, 0], m[:, 1]] > 0]
+        matches.append(np.stack((rows[m[:, 0]], cols[m[:, 1]]), axis=1))
+        scores.append(sub[m[:, 0], m[:, 1]])
+    return np.concatenate(matches).astype(int), np.concatenate(scores)
+
+
+def linear_assignment(cost):
+    """Solves the minimum cost assignment for a 2D cost matrix.
+
+    Returns a (K, 2) array of matched [row, col] indices. Uses lap or scipy when
+    installed, and a NumPy Hungarian solver otherwise.
+    """
+    if cost.size == 0:
+        return np.empty((0, 2), dtype=int)
+    global _solver
+    if _solver is None:
+        _solver = _find_solver()
+    return _solver(cost)
+
+
+# Solver used by linear_assignment(), looked up on first use.
+_solver = None
+
+
+def _find_solver():
+    try:
+        import lap
+
+        def solve(cost):
+            _, x, _ = lap.lapjv(cost, extend_cost=True)
+            return np.array([[y, i] for y, i in enumerate(x) if i >= 0], dtype=int).reshape(-1, 2)
+        return solve
+    except ImportError:
+        pass
+    try:
+        from scipy.optimize import linear_sum_assignment
+        return lambda cost: np.stack(linear_sum_assignment(cost), axis=1)
+    except ImportError:
+        pass
+
+    def solve(cost):
+        if cost.shape[0] > cost.shape[1]:
+            return _hungarian(cost.T)[:, ::-1]
+        return _hungarian(cost)
+    return solve
+
+
+def _hungarian(cost):
+    """Hungarian algorithm for an (N, M) cost matrix with N <= M.
+
+    The inner loop over columns is done with array operations, so the Python
+    work is O(N^2) rather than O(N^2 M).
+    """
+    n, m = cost.shape
+    u = np.zeros(n + 1)
+    v = np.zeros(m + 1)
+    # p[j] is the 1-based row assigned to 1-based column j, 0 if none.
+    p = np.zeros(m + 1, dtype=int)
+    way = np.zeros(m + 1, dtype=int)
+    for i in range(1, n + 1):
+        p[0] = i
+        j0 = 0
+        minv = np.full(m + 1, np.inf)
+        used = np.zeros(m + 1, dtype=bool)
+        while True:
+            used[j0] = True
+            i0 = p[j0]
+            cur = cost[i0 - 1] - u[i0] - v[1:]
+            better = ~used[1:] & (cur < minv[1:])
+            minv[1:][better] = cur[better]
+            way[1:][better] = j0
+            free_minv = np.where(used[1:], np.inf, minv[1:])
+            j1 = int(np.argmin(free_minv)) + 1
+            delta = free_minv[j1 - 1]
+            u[p[used]] += delta
+            v[used] -= delta
+            minv[~used] -= delta
+            j0 = j1
+            if p[j0] == 0:
+                break
+        while j0:
+            j1 = way[j0]
+            p[j0] = p[j1]
+            j0 = j1
+    cols = np.nonzero(p[1:])[0]
+    return np.stack((p[1:][cols] - 1, cols), axis=1)
+
+
+class VectorizedSort(object):
+    """SORT multi-object tracker with all track state held in stacked arrays.
+
+    Follows the upstream SORT model: a constant velocity Kalman filter over
+    [u, v, s, r, du, dv, ds] (box center, area and aspect ratio), IoU based
+    association and the same max_age / min_hits / iou_threshold semantics.
+    Predict, update, birth and death are batched over all tracks.
+    """
+
+    # Kalman filter model, shared by all tracks.
+    F = np.eye(7) + np.eye(7, k=4)
+    H = np.eye(4, 7)
+    R = np.diag([1.0, 1.0, 10.0, 10.0])
+    Q = np.diag([1.0, 1.0, 1.0, 1.0, 0.01, 0.01, 0.0001])
+    P0 = np.diag([10.0, 10.0, 10.0, 10.0, 10000.0, 10000.0, 10000.0])
+
+    def __init__(self, max_age=1, min_hits=3, iou_threshold=0.3, dense_limit=10000):
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.iou_threshold = iou_threshold
+        # Above this many detection/track pairs, association only scores
+        # overlapping pairs (see gated_assignment()).
+        self.dense_limit = dense_limit
+        self.frame_count = 0
+        self.next_id = 0
+        self.x = np.empty((0, 7))
+        self.P = np.empty((0, 7, 7))
+        self.ids = np.empty(0, dtype=int)
+        self.age = np.empty(0, dtype=int)
+        self.hits = np.empty(0, dtype=int)
+        self.hit_streak = np.empty(0, dtype=int)
+        self.time_since_update = np.empty(0, dtype=int)
+        # Index of the detection each track was matched to or born from in the
+        # last update(), -1 if none.
+        self.detection = np.empty(0, dtype=int)
+        # Tracks returned by the last update(), continued by coast().
+        self.reported = np.empty(0, dtype=bool)
+        # Detection index of each row last returned by update() or coast().
+        self.detection_indices = np.empty(0, dtype=int)
+
+    def __len__(self):
+        return len(self.ids)
+
+    @staticmethod
+    def to_z(boxes):
+        """Converts (N, 4+) [x0, y0, x1, y1] boxes to (N, 4) [u, v, s, r]."""
+        w = boxes[:, 2] - boxes[:, 0]
+        h = boxes[:, 3] - boxes[:, 1]
+        return np.stack((boxes[:, 0] + w / 2, boxes[:, 1] + h / 2, w * h, w / h), axis=1)
+
+    @staticmethod
+    def to_boxes(x):
+        """Converts (N, 7+) states to (N, 4) [x0, y0, x1, y1] boxes."""
+        with np.errstate(invalid='ignore'):
+            w = np.sqrt(x[:, 2] * x[:, 3])
+            h = x[:, 2] / w
+        return np.stack((x[:, 0] - w / 2, x[:, 1] - h / 2,
+                         x[:, 0] + w / 2, x[:, 1] + h / 2), axis=1)
+
+    def _propagate(self):
+        # Don't let the predicted area go negative.
+        self.x[self.x[:, 6] + self.x[:, 2] <= 0, 6] = 0.0
+        self.x = self.x @ self.F.T
+        self.P = self.F @ self.P @ self.F.T + self.Q
+
+    def predict(self):
+        """Advances every track by one frame and returns the predicted boxes."""
+        self._propagate()
+        self.age += 1
+        self.hit_streak[self.time_since_update > 0] = 0
+        self.time_since_update += 1
+        return self.to_boxes(self.x)
+
+    def _keep(self, mask):
+        self.x = self.x[mask]
+        self.P = self.P[mask]
+        self.ids = self.ids[mask]
+        self.age = self.age[mask]
+        self.hits = self.hits[mask]
+        self.hit_streak = self.hit_streak[mask]
+        self.time_since_update = self.time_since_update[mask]
+        self.detection = self.detection[mask]
+
+    def associate(self, dets, trks):
+        """Matches detections to predicted track boxes.
+
+        Returns (matches, unmatched_dets, unmatched_trks) where matches is a
+        (K, 2) array of [det, trk] indices.
+        """
+        if len(dets) * len(trks) > self.dense_limit:
+            matches, iou = gated_assignment(dets, trks)
+            matches = matches[iou >= self.iou_threshold]
+            return self._unmatched(matches, len(dets), len(trks))
+        iou = iou_matrix(dets, trks)
+        if iou.size:
+            a = iou > self.iou_threshold
+            if a.sum(1).max() == 1 and a.sum(0).max() == 1:
+                matches = np.argwhere(a)
+            else:
+                matches = linear_assignment(-iou)
+            matches = matches[iou[matches[:, 0], matches[:, 1]] >= self.iou_threshold]
         else:
-            print("Invalid Tracker Name")
-            self.trackerObject = None
+            matches = np.empty((0, 2), dtype=int)
+        return self._unmatched(matches, len(dets), len(trks))
+
+    @staticmethod
+    def _unmatched(matches, num_dets, num_trks):
+        unmatched_dets = np.ones(num_dets, dtype=bool)
+        unmatched_dets[matches[:, 0]] = False
+        unmatched_trks = np.ones(num_trks, dtype=bool)
+        unmatched_trks[matches[:, 1]] = False
+        return matches, np.nonzero(unmatched_dets)[0], np.nonzero(unmatched_trks)[0]
+
+    def correct(self, idx, boxes):
+        """Kalman update of the tracks at idx with (K, 4+) measured boxes."""
+        x, P = self.x[idx], self.P[idx]
+        y = self.to_z(boxes) - x[:, :4]
+        S = P[:, :4, :4] + self.R
+        K = P[:, :, :4] @ np.linalg.inv(S)
+        x = x + (K @ y[..., np.newaxis])[..., 0]
+        I_KH = np.eye(7) - K @ self.H
+        # Joseph form, as used by filterpy.
+        P = I_KH @ P @ I_KH.transpose(0, 2, 1) + K @ self.R @ K.transpose(0, 2, 1)
+        self.x[idx], self.P[idx] = x, P
+        self.time_since_update[idx] = 0
+        self.hits[idx] += 1
+        self.hit_streak[idx] += 1
+
+    def birth(self, boxes):
+        """Starts a new track for each of the (K, 4+) boxes."""
+        n = len(boxes)
+        x = np.zeros((n, 7))
+        x[:, :4] = self.to_z(boxes)
+        self.x = np.concatenate((self.x, x))
+        self.P = np.concatenate((self.P, np.broadcast_to(self.P0, (n, 7, 7))))
+        self.ids = np.concatenate((self.ids, np.arange(self.next_id, self.next_id + n)))
+        self.next_id += n
+        zeros = np.zeros(n, dtype=int)
+        self.age = np.concatenate((self.age, zeros))
+        self.hits = np.concatenate((self.hits, zeros))
+        self.hit_streak = np.concatenate((self.hit_streak, zeros))
+        self.time_since_update = np.concatenate((self.time_since_update, zeros))
+
+    def update(self, dets=np.empty((0, 5))):
+        """Updates the tracker with (N, 5) [x0, y0, x1, y1, score] detections.
+
+        Must be called once per frame, even with no detections. Returns an
+        (M, 5) array of [x0, y0, x1, y1, track_id] for the confirmed tracks;
+        detection_indices then holds the row of dets each of them was matched to.
+        """
+        self.frame_count += 1
+        trks = self.predict()
+        valid = ~np.isnan(trks).any(axis=1)
+        if not valid.all():
+            self._keep(valid)
+            trks = trks[valid]
+
+        matches, unmatched_dets, _ = self.associate(dets, trks)
+        self.correct(matches[:, 1], dets[matches[:, 0]])
+        self.birth(dets[unmatched_dets])
+        self.detection = np.full(len(self), -1)
+        self.detection[matches[:, 1]] = matches[:, 0]
+        self.detection[len(trks):] = unmatched_dets
+
+        boxes = self.to_boxes(self.x)
+        confirmed = (self.time_since_update < 1) & (
+            (self.hit_streak >= self.min_hits) | (self.frame_count <= self.min_hits))
+        ret = np.concatenate((boxes[confirmed], self.ids[confirmed, np.newaxis] + 1.0), axis=1)
+        self.detection_indices = self.detection[confirmed]
+        alive = self.time_since_update <= self.max_age
+        self._keep(alive)
+        self.reported = confirmed[alive]
+        return ret
+
+    def coast(self):
+        """Advances every track by one frame without detections.
+
+        For frames on which the detector isn't run: the motion model moves the
+        tracks on, but their ages and hit counts are left alone so that
+        skipped frames don't expire them. Returns the tracks reported by the
+        last update() at their predicted positions, as (M, 5) [x0, y0, x1, y1,
+        track_id], with detection_indices still into the dets of that update().
+        """
+        self._propagate()
+        boxes = self.to_boxes(self.x)
+        mask = self.reported & ~np.isnan(boxes).any(axis=1)
+        self.detection_indices = self.detection[mask]
+        return np.concatenate((boxes[mask], self.ids[mask, np.newaxis] + 1.0), axis=1)
+
+
+class GreedyIoUTracker(object):
+    """Cheap tracker that links boxes from frame to frame by IoU alone.
+
+    Each track keeps its last measured box and the per-frame motion between
+    its last two measurements, averaged over the frames in between. New
+    detections are matched to the predicted boxes greedily, highest IoU
+    first, without a Kalman filter or an assignment solver. max_age and
+    min_hits have the same meaning as in SORT.
+    """
+
+    def __init__(self, max_age=1, min_hits=1, iou_threshold=0.3):
+        self.max_age = max_age
+        self.min_hits = min_hits
+        self.iou_threshold = iou_threshold
+        self.next_id = 0
+        self.boxes = np.empty((0, 4))
+        self.velocity = np.empty((0, 4))
+        # The box of the last matched detection and the frames predicted since.
+        self.measured = np.empty((0, 4))
+        self.frames_since_measured = np.empty(0, dtype=int)
+        self.ids = np.empty(0, dtype=int)
+        self.hits = np.empty(0, dtype=int)
+        self.time_since_update = np.empty(0, dtype=int)
+        self.detection = np.empty(0, dtype=int)
+        self.reported = np.empty(0, dtype=bool)
+        self.detection_indices = np.empty(0, dtype=int)
+
+    def match(self, dets, predicted):
+        """Returns (K, 2) [det, track] matches, greedily by decreasing IoU."""
+        if len(dets) * len(predicted) > 10000:
+            pairs = overlapping_pairs(dets, predicted)
+            iou = iou_pairs(dets[pairs[:, 0]], predicted[pairs[:, 1]])
+        else:
+            iou = iou_matrix(dets, predicted)
+            pairs = np.argwhere(iou >= self.iou_threshold)
+            iou = iou[pairs[:, 0], pairs[:, 1]]
+        keep = iou >= self.iou_threshold
+        pairs = pairs[keep][np.argsort(-iou[keep], kind='stable')]
+        used_dets = np.zeros(len(dets), dtype=bool)
+        used_trks = np.zeros(len(predicted), dtype=bool)
+        matches = []
+        for d, t in pairs.tolist():
+            if not used_dets[d] and not used_trks[t]:
+                used_dets[d] = used_trks[t] = True
+                matches.append((d, t))
+        return np.array(matches, dtype=int).reshape(-1, 2)
+
+    def _keep(self, mask):
+        self.boxes = self.boxes[mask]
+        self.velocity = self.velocity[mask]
+        self.measured = self.measured[mask]
+        self.frames_since_measured = self.frames_since_measured[mask]
+        self.ids = self.ids[mask]
+        self.hits = self.hits[mask]
+        self.time_since_update = self.time_since_update[mask]
+        self.detection = self.detection[mask]
+
+    def update(self, dets=np.empty((0, 5))):
+        """Updates the tracker with (N, 5) [x0, y0, x1, y1, score] detections.
+
+        Returns an (M, 5) array of [x0, y0, x1, y1, track_id] for the confirmed
+        tracks matched on this frame.
+        """
+        self.boxes = self.boxes + self.velocity
+        self.frames_since_measured += 1
+        self.time_since_update += 1
+        matches = self.match(dets, self.boxes)
+        d, t = matches[:, 0], matches[:, 1]
+        frames = self.frames_since_measured[t, np.newaxis]
+        self.velocity[t] = (dets[d, :4] - self.measured[t]) / frames
+        self.boxes[t] = self.measured[t] = dets[d, :4]
+        self.frames_since_measured[t] = 0
+        self.hits[t] += 1
+        self.time_since_update[t] = 0
+        self.detection = np.full(len(self.ids), -1)
+        self.detection[t] = d
+
+        new = np.ones(len(dets), dtype=bool)
+        new[d] = False
+        n = int(new.sum())
+        self.boxes = np.concatenate((self.boxes, dets[new, :4]))
+        self.velocity = np.concatenate((self.velocity, np.zeros((n, 4))))
+        self.measured = np.concatenate((self.measured, dets[new, :4]))
+        self.frames_since_measured = np.concatenate(
+            (self.frames_since_measured, np.zeros(n, dtype=int)))
+        self.ids = np.concatenate((self.ids, np.arange(self.next_id, self.next_id + n)))
+        self.next_id += n
+        self.hits = np.concatenate((self.hits, np.ones(n, dtype=int)))
+        self.time_since_update = np.concatenate((self.time_since_update, np.zeros(n, dtype=int)))
+        self.detection = np.concatenate((self.detection, np.flatnonzero(new)))
+
+        confirmed = (self.time_since_update == 0) & (self.hits >= self.min_hits)
+        ret = np.concatenate((self.boxes[confirmed], self.ids[confirmed, np.newaxis] + 1.0), axis=1)
+        self.detection_indices = self.detection[confirmed]
+        alive = self.time_since_update <= self.max_age
+        self._keep(alive)
+        self.reported = confirmed[alive]
+        return ret
+
+    def coast(self):
+        """Moves every track on by its last motion, see VectorizedSort.coast()."""
+        self.boxes = self.boxes + self.velocity
+        self.frames_since_measured += 1
+        mask = self.reported
+        self.detection_indices = self.detection[mask]
+        return np.concatenate((self.boxes[mask], self.ids[mask, np.newaxis] + 1.0), axis=1)
 
 
-class SortTracker(ObjectTracker):
-    def __init__(self):
-        sys.path.append(os.path.join(os.path.dirname(__file__), '../third_party', 'sort-master'))
-        from sort import Sort
-        self.mot_tracker = Sort()
+register_tracker('sort', VectorizedSort)
+register_tracker('sort_upstream', _upstream_sort)
+register_tracker('iou', GreedyIoUTracker)